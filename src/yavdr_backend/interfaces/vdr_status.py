@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import logging
 from collections.abc import AsyncGenerator
 from contextlib import closing
 from enum import StrEnum
@@ -169,3 +171,18 @@ async def signal_generator() -> AsyncGenerator[SignalType, None]:
                     }
                 )
                 yield result
+
+
+async def persistent_signal_generator(retry_interval: float = 10) -> AsyncGenerator[SignalType, None]:
+    """
+    like signal_generator(), but reconnects if the connection to the system bus fails,
+    so background tasks can keep listening while VDR or the bus are restarted
+    """
+    while True:
+        try:
+            async with contextlib.aclosing(signal_generator()) as g:
+                async for status_signal in g:
+                    yield status_signal
+        except Exception as err:
+            logging.warning("lost connection to VDR's status signals: %s", err)
+        await asyncio.sleep(retry_interval)
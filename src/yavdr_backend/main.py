@@ -7,7 +7,7 @@ from contextlib import asynccontextmanager
 from typing import Any
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, Request, Response, status
+from fastapi import FastAPI, HTTPException, Query, Request, Response, status
 from fastapi.exceptions import RequestValidationError
 
 from fastapi.responses import JSONResponse
@@ -17,6 +17,12 @@ from starlette.responses import RedirectResponse
 
 from yavdr_backend.routers import auth, system, lircd2uinput, vdr, log, audio, channelpedia
 from yavdr_backend.tools import systeminfo
+from yavdr_backend.tools.disk_forecast import DiskForecast
+from yavdr_backend.tools.metrics_archive import MetricsArchive
+from yavdr_backend.tools.metrics_store import MetricHistory, Resolution
+from yavdr_backend.tools.openmetrics import CONTENT_TYPE as OPENMETRICS_CONTENT_TYPE, REGISTRY as metrics_registry
+from yavdr_backend.tools.power_planner import PowerPlan
+from yavdr_backend.tools.process_tracker import ProcessStatus, ThreadUsage
 from yavdr_backend.tools.sse import SSE_StreamingResponse
 
 load_dotenv()  # take environment variables from .env.
@@ -28,10 +34,20 @@ async def lifespan_handler(app: FastAPI) -> AsyncGenerator[None, None]:
     print("callback on startup")
     # Initialize a shared HTTP/2 client for the application
     app.state.http_client = AsyncClient(http2=True, timeout=timeout) # TODO: check if this requires a more advanced proxy setting in nginx
-    t = asyncio.create_task(systemstat_collector.run_update())
+    background_tasks = [
+        asyncio.create_task(systemstat_collector.run_update()),
+        asyncio.create_task(metrics_archive.run_update()),
+        asyncio.create_task(vdr.recording_catalog.run_update()),
+        asyncio.create_task(vdr.timer_cache.run_update()),
+        asyncio.create_task(vdr.search_timer_engine.run_update()),
+        asyncio.create_task(vdr.thumbnail_service.run_workers()),
+        asyncio.create_task(vdr.disk_forecaster.run_update()),
+        asyncio.create_task(vdr.power_planner.run_update()),
+    ]
     yield
     print("shutdown of the fastapi app")
-    t.cancel()
+    for t in background_tasks:
+        t.cancel()
     await app.state.http_client.aclose()
 
 
@@ -59,7 +75,8 @@ async def disable_cache(request: Request, call_next: Callable[..., Awaitable[Res
     return response
 
 # collect system stats continously
-systemstat_collector = systeminfo.SystemStatHistory()
+metrics_archive = MetricsArchive()
+systemstat_collector = systeminfo.SystemStatHistory(archive=metrics_archive)
 
 
 # TODO: check if we need this with an nginx proxy
@@ -97,6 +114,18 @@ async def send_messages2clients(data: None|str) -> None:
         client.messages.put_nowait(data)
 
 
+async def send_disk_space_warning(forecast: DiskForecast) -> None:
+    await send_messages2clients(f"event: disk_space_warning\ndata: {forecast.model_dump_json()}\n\n")
+
+vdr.disk_forecaster.on_warning = send_disk_space_warning
+
+
+async def send_power_plan(plan: PowerPlan) -> None:
+    await send_messages2clients(f"event: power_plan\ndata: {plan.model_dump_json()}\n\n")
+
+vdr.power_planner.on_change = send_power_plan
+
+
 # def on_message(*args) -> None:
 #     data = args[4][0]
 #     data["server_ts"] = time.time()
@@ -121,16 +150,97 @@ async def process_signals() -> None: ...
 @app.get("/run/messages", response_class=SSE_StreamingResponse)
 async def stream_messages() -> SSE_StreamingResponse:
     global active_clients
+    # sample the system status in the short intervals while clients are connected
+    systemstat_collector.touch()
     return SSE_StreamingResponse(active_clients, media_type="text/event-stream")
 
 
+systemstat_collector.register_metrics(metrics_registry)
+systemstat_collector.demand_sources.append(lambda: bool(active_clients))
+
+
+@metrics_registry.gauge("yavdr_sse_clients", "connected clients of /run/messages")
+def _sse_clients():
+    return [((), len(active_clients))]
+
+
+@metrics_registry.gauge("yavdr_vdr_recordings", "recordings in the catalog")
+def _vdr_recordings():
+    return [((), len(vdr.recording_catalog.recordings))] if vdr.recording_catalog.loaded else []
+
+
+@metrics_registry.gauge("yavdr_vdr_timers", "timers of VDR", ["state"])
+def _vdr_timers():
+    if not vdr.timer_cache.loaded:
+        return []
+    details = vdr.timer_cache.details.values()
+    recording = sum(d.is_recording for d in details)
+    return [(("recording",), recording), (("waiting",), len(details) - recording)]
+
+
+@app.get("/metrics", response_class=Response)
+async def metrics():
+    """
+    Returns the latest values of the background collectors in the OpenMetrics text format
+    (rendered on the event loop, which updates the collected values)
+    """
+    return Response(content=metrics_registry.render(), media_type=OPENMETRICS_CONTENT_TYPE)
+
+
 @app.get("/system/status", response_model=systeminfo.SystemData)
-def system_info():
+async def system_info():
     """
     Returns a json object containing system status information
+    (the latest values of the background collector)
+    """
+    return await systemstat_collector.data()
+
+
+@app.get("/system/processes", response_model=list[ProcessStatus])
+async def system_processes():
+    """
+    Returns the resource usage of VDR and the other tracked services
+    """
+    return list(systemstat_collector.processes.status.values())
+
+
+@app.get("/system/processes/{service}/threads", response_model=list[ThreadUsage])
+async def system_process_threads(service: str, limit: int = Query(default=10, ge=1, le=1000)):
+    """
+    Returns the threads of a tracked service (e.g. vdr.service) with the highest cpu usage
+    """
+    if service not in systemstat_collector.processes.services:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{service} is not tracked")
+    return systemstat_collector.processes.top_threads(service, limit)
+
+
+@app.get("/system/history", response_model=dict[str, list[str]])
+async def system_history_groups():
+    """
+    Returns the metric groups of the system history and their columns
+    """
+    return {name: group.columns for name, group in systemstat_collector.history.groups.items()}
+
+
+@app.get("/system/history/{group}", response_model=MetricHistory)
+async def system_history(
+    group: str,
+    resolution: Resolution = Resolution.min1,
+    start: float = 0,
+    end: float | None = None,
+    column: list[str] | None = Query(default=None),
+    points: int | None = Query(default=None, ge=3, le=10000),
+):
+    """
+    Returns the history of a metric group (e.g. cpu, memory, temperatures) between
+    start and end (unix timestamps), min/max/avg are aggregated per bucket of the resolution.
+    With `points` each column is downsampled (LTTB) to at most this many points for charts.
     """
-    return systeminfo.collect_data()
-    # return systemstat_collector.data()
+    systemstat_collector.touch()
+    series = systemstat_collector.history.groups.get(group)
+    if series is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"unknown metric group {group}")
+    return series.history(resolution, start, end if end is not None else float("inf"), column, points)
 
 
 # include the routes defined in other modules
@@ -1,22 +1,26 @@
 import asyncio
-from collections.abc import AsyncGenerator
+from collections.abc import AsyncGenerator, AsyncIterator
 import contextlib
 import datetime
 
+import itertools
 import json
 import os
 import tempfile
+import time
 import uuid
 
 import pkgconfig
 
-from enum import IntFlag, StrEnum
+from enum import StrEnum
 from pathlib import Path
 from typing import Any
 from pydantic import Field, BaseModel
 from fastapi import (
     APIRouter,
     Depends,
+    HTTPException,
+    Query,
     Request,
     UploadFile,
     WebSocket,
@@ -28,16 +32,50 @@ from sse_starlette.sse import EventSourceResponse
 # from pydantic.main import BaseModel
 
 # import pydbus2vdr
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 import sdbus
 from starlette.responses import JSONResponse
 from starlette.status import (
     HTTP_200_OK,
+    HTTP_304_NOT_MODIFIED,
     HTTP_400_BAD_REQUEST,
+    HTTP_401_UNAUTHORIZED,
+    HTTP_404_NOT_FOUND,
     HTTP_503_SERVICE_UNAVAILABLE,
 )
 
 from yavdr_backend.tools.channel_interfaces import Channel
+from yavdr_backend.tools import hls
+from yavdr_backend.tools.power_planner import PowerPlan, PowerPlanner, PowerSettings
+from yavdr_backend.tools.recordings import (
+    Recording,
+    RecordingCatalog,
+    RecordingTreeLevel,
+    list_recordings,
+)
+from yavdr_backend.tools.duplicates import DuplicateIndex, DuplicateMatch, DuplicateReport
+from yavdr_backend.tools.disk_forecast import DiskForecast, DiskSpaceForecaster
+from yavdr_backend.tools.timer_conflicts import Conflict, ConflictChecker, list_tuners
+from yavdr_backend.tools.search_timers import SearchTimerEngine, SearchTimerMatch, SearchTimerRule
+from yavdr_backend.tools.timer_batch import BulkTimer, BulkTimerResponse, bulk_timers
+from yavdr_backend.tools.timer_cache import TimerCache, TimerDetails
+from yavdr_backend.tools.timer_feed import FeedToken, FeedTokens, TimerFeeds
+from yavdr_backend.tools.timers import (
+    PlannedRecording,
+    TimerData,
+    TimerSchedule,
+    planned_recordings,
+)
+from yavdr_backend.tools.thumbnails import (
+    DEFAULT_POSITION as DEFAULT_THUMBNAIL_POSITION,
+    DEFAULT_WIDTH as DEFAULT_THUMBNAIL_WIDTH,
+    ThumbnailError,
+    ThumbnailFormat,
+    ThumbnailRequest,
+    ThumbnailService,
+    media_type as thumbnail_media_type,
+)
+from yavdr_backend.tools.vdr_index import VdrIndex, open_index
 
 
 from .auth import get_current_active_user, User
@@ -52,7 +90,6 @@ from yavdr_backend.interfaces.vdr_channels import DeTvdrVdrChannelInterface
 from yavdr_backend.interfaces.vdr_epg import DeTvdrVdrEpgInterface
 from yavdr_backend.interfaces.vdr_plugins import DeTvdrVdrPluginmanagerInterface
 from yavdr_backend.interfaces.vdr_recordings import DeTvdrVdrRecordingInterface
-from yavdr_backend.interfaces.vdr_timers import DeTvdrVdrTimerInterface, DetailedTimer
 from yavdr_backend.interfaces.vdr_setup import DeTvdrVdrSetupInterface
 from yavdr_backend.interfaces.vdr_skin import DeTvdrVdrSkinInterface
 from yavdr_backend.interfaces.vdr_status import (
@@ -106,74 +143,115 @@ class Message(BaseModel):
 #     return wrapper
 
 
-class Recording(BaseModel):
-    RecNum: int
-    Path: str
-    Name: str
-    FullName: str | None = None
-    Title: str
-    title: str  # this is either InfoTitle or Name
-    searchTitle: str
-    Start: int
-    Priority: int
-    Lifetime: int
-    HierarchyLevels: int
-    FramesPerSecond: float
-    NumFrames: int
-    LengthInSeconds: int
-    duration: str
-    FileSizeMB: int
-    IsPesRecording: bool
-    IsNew: bool
-    IsEdited: bool
-    InfoChannelID: str | None = None
-    InfoChannelName: str | None = None
-    InfoTitle: str | None = None
-    InfoShortText: str | None = None
-    InfoDescription: str | None = None
-    InfoAux: str | None = None
-    InfoFramesPerSecond: float | None = None
-
-
 @router.get("/vdr/recordings", response_model=list[Recording])
 async def get_vdr_recordings(current_user: User = Depends(get_current_active_user)) -> list[Recording]:
-    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
-        vdr_recordings = DeTvdrVdrRecordingInterface.new_proxy(
-            "de.tvdr.vdr",
-            "/Recordings",
-            bus=bus,
-        )
-        recordings: list[Recording] = []
-        for n, r in await vdr_recordings.list():
-            try:
-                new_rec: dict[str, Any] = {}
-                for k, v in r:
-                    k = k.replace("/", "")
-                    # print(k, v, type(v))
-                    if isinstance(v, tuple): # pyright: ignore[reportUnnecessaryIsInstance]
-                        new_rec[k] = v[-1]
-                    else:
-                        new_rec[k] = v
-                new_rec["RecNum"] = int(n)
-
-                ls = new_rec["LengthInSeconds"]
-                hours = ls // 3600
-                minutes = (ls % 3600) // 60
-                seconds = (ls % 3600) % 60
-                new_rec["duration"] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-                title: str = new_rec.get("InfoTitle", new_rec["Name"])
-
-                subtitle = new_rec.get("InfoShortText")
-                if subtitle:
-                    title = f"{title} - {subtitle}"
-
-                new_rec["title"] = title
-                new_rec["searchTitle"] = title.lower()
-                recordings.append(Recording(**new_rec))
-            except Exception as err:
-                print("Error:", err)
-        # print(recordings)
-        return sorted(recordings, key=lambda r: r.Start, reverse=True)
+    recordings = await list_recordings()
+    return sorted(recordings, key=lambda r: r.Start, reverse=True)
+
+
+# recordings and their folder tree, kept up to date by main.lifespan_handler
+recording_catalog = RecordingCatalog()
+
+
+@router.get("/vdr/recordings/tree", response_model=RecordingTreeLevel)
+async def get_vdr_recordings_tree(
+    path: str = "", current_user: User = Depends(get_current_active_user)
+) -> RecordingTreeLevel:
+    """
+    Returns a single level of the recording folders (folder names are separated by "~")
+    with the number of recordings, the total size and duration and the number of new recordings
+    for each folder
+    """
+    await recording_catalog.ensure_loaded()
+    level = recording_catalog.level(path)
+    if level is None:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"unknown folder {path}")
+    return level
+
+
+# all timers with their upcoming recordings, kept up to date by main.lifespan_handler
+timer_cache = TimerCache()
+timer_schedule = timer_cache.schedule
+
+
+async def refresh_timer_schedule() -> TimerSchedule:
+    await timer_cache.ensure_loaded()
+    return timer_schedule
+
+
+async def get_planned_recordings(now: float, until: float) -> list[PlannedRecording]:
+    return planned_recordings(await refresh_timer_schedule(), now, until)
+
+
+# updated periodically by main.lifespan_handler
+disk_forecaster = DiskSpaceForecaster(recording_catalog, get_planned_recordings)
+
+
+# fingerprints of all recordings and timers
+duplicate_index = DuplicateIndex(recording_catalog, timer_cache)
+
+
+@router.get("/vdr/recordings/duplicates", response_model=DuplicateReport)
+async def get_duplicate_recordings(current_user: User = Depends(get_current_active_user)) -> DuplicateReport:
+    """
+    Returns the groups of recordings with the same title and subtitle (or episode),
+    sorted by their combined size
+    """
+    await recording_catalog.ensure_loaded()
+    return duplicate_index.report()
+
+
+@router.get("/vdr/duplicates", response_model=DuplicateMatch)
+async def check_duplicate(
+    title: str,
+    short_text: str | None = None,
+    description: str | None = None,
+    current_user: User = Depends(get_current_active_user),
+) -> DuplicateMatch:
+    """Returns the recordings and timers of the given episode"""
+    await recording_catalog.ensure_loaded()
+    await timer_cache.ensure_loaded()
+    return duplicate_index.lookup(title, short_text, description)
+
+
+@router.get("/vdr/disk_forecast", response_model=DiskForecast)
+async def get_disk_forecast(
+    days: int = Query(default=7, gt=0, le=60), current_user: User = Depends(get_current_active_user)
+) -> DiskForecast:
+    """
+    Returns the disk space the pending timers of the next `days` days are expected to need
+    (based on the bitrates of the existing recordings of each channel) and compares it
+    with the free space of the video directory
+    """
+    return await disk_forecaster.update(days)
+
+
+# shutdown and wakeup planning, updated by main.lifespan_handler
+power_planner = PowerPlanner(timer_cache)
+
+
+@router.get("/vdr/power", response_model=PowerPlan)
+async def get_power_plan(current_user: User = Depends(get_current_active_user)) -> PowerPlan:
+    """
+    Returns the power state, whether the system may be shut down now (or the earliest time
+    for a shutdown) and the next time it has to wake up for a recording or maintenance window.
+    Changes are sent as "power_plan" events to /run/messages.
+    """
+    return await power_planner.get_plan()
+
+
+@router.get("/vdr/power/settings", response_model=PowerSettings)
+async def get_power_settings(current_user: User = Depends(get_current_active_user)) -> PowerSettings:
+    return power_planner.settings
+
+
+@router.put("/vdr/power/settings", response_model=PowerPlan)
+async def set_power_settings(
+    settings: PowerSettings, current_user: User = Depends(get_current_active_user)
+) -> PowerPlan:
+    """set the maintenance windows and the margins, returns the updated plan"""
+    power_planner.set_settings(settings)
+    return await power_planner.update()
 
 
 class RecNum(BaseModel):
@@ -239,6 +317,203 @@ async def play_recording(
         return JSONResponse(status_code=HTTP_200_OK, content={"msg": f"playing recording {data.RecNum}"})
 
 
+async def get_vdr_recording(rec_num: int) -> dict[str, Any]:
+    """get the recording data as a dict (like the items of /vdr/recordings) from dbus2vdr"""
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        vdr_recordings = DeTvdrVdrRecordingInterface.new_proxy(
+            "de.tvdr.vdr",
+            "/Recordings",
+            bus=bus,
+        )
+        _n, r = await vdr_recordings.get(("i", rec_num))
+    return {k.replace("/", ""): v[-1] if isinstance(v, tuple) else v for k, v in r}
+
+
+@contextlib.asynccontextmanager
+async def recording_index(rec_num: int) -> AsyncIterator[tuple[dict[str, Any], VdrIndex]]:
+    """the recording and its index, the index can be used until the block is left"""
+    recording = await get_vdr_recording(rec_num)
+    if not recording.get("Path"):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"unknown recording {rec_num}")
+    with contextlib.ExitStack() as stack:
+        try:
+            index = stack.enter_context(
+                open_index(
+                    recording["Path"],
+                    frames_per_second=recording.get("FramesPerSecond"),
+                    is_pes_recording=recording.get("IsPesRecording"),
+                )
+            )
+        except OSError as err:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"could not read the index of recording {rec_num}: {err}")
+        yield recording, index
+
+
+class RecordingIndexInfo(BaseModel):
+    RecNum: int
+    Path: str
+    FramesPerSecond: float
+    NumFrames: int
+    LengthInSeconds: float
+    ReportedLengthInSeconds: int | None = None
+    length_matches: bool
+
+
+@router.get("/vdr/recordings/{rec_num}/index", response_model=RecordingIndexInfo)
+async def get_recording_index_info(
+    rec_num: int, current_user: User = Depends(get_current_active_user)
+) -> RecordingIndexInfo:
+    """
+    Returns the exact length of a recording calculated from its index file
+    and compares it to the length reported by VDR
+    """
+    async with recording_index(rec_num) as (recording, index):
+        reported_length = recording.get("LengthInSeconds")
+        return RecordingIndexInfo(
+            RecNum=rec_num,
+            Path=recording["Path"],
+            FramesPerSecond=index.frames_per_second,
+            NumFrames=index.num_frames,
+            LengthInSeconds=index.length_in_seconds,
+            ReportedLengthInSeconds=reported_length,
+            length_matches=reported_length == int(index.length_in_seconds),
+        )
+
+
+class RecordingPosition(BaseModel):
+    frame: int
+    seconds: float
+    file_number: int
+    offset: int
+    file: str
+
+
+@router.get("/vdr/recordings/{rec_num}/seek", response_model=RecordingPosition)
+async def seek_recording(
+    rec_num: int, seconds: float = 0, current_user: User = Depends(get_current_active_user)
+) -> RecordingPosition:
+    """
+    Maps a time (in seconds from the start of the recording) to the file and byte offset
+    of the independent frame a player has to start from
+    """
+    async with recording_index(rec_num) as (_recording, index):
+        try:
+            position = index.seek(seconds)
+        except IndexError as err:
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=str(err))
+        return RecordingPosition(
+            **position._asdict(), file=str(index.file_path(position.file_number))
+        )
+
+
+@router.get("/vdr/recordings/{rec_num}/hls/index.m3u8", response_class=Response)
+async def get_recording_hls_playlist(
+    rec_num: int,
+    segment_duration: float = Query(default=hls.DEFAULT_SEGMENT_DURATION, gt=0),
+    current_user: User = Depends(get_current_active_user),
+) -> Response:
+    """
+    Returns a HLS playlist for the recording, the segments are byte ranges of the recording's ts files
+    """
+    async with recording_index(rec_num) as (_recording, index):
+        # reading the index of a long recording would block the other requests
+        playlist = await asyncio.to_thread(hls.get_playlist, index, segment_duration)
+    return Response(content=playlist, media_type=hls.PLAYLIST_MEDIA_TYPE, headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/vdr/recordings/{rec_num}/hls/{file_number}.{extension}", response_class=FileResponse)
+async def get_recording_hls_segment(
+    rec_num: int,
+    file_number: int,
+    extension: str,
+    current_user: User = Depends(get_current_active_user),
+) -> FileResponse:
+    """
+    Serves a file of the recording, the player requests the segments with HTTP range requests
+    """
+    async with recording_index(rec_num) as (_recording, index):
+        path = index.file_path(file_number)
+        if path.suffix != f".{extension}" or not path.is_file():
+            raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"unknown file {file_number}.{extension}")
+        # FileResponse handles the range requests and uses the pathsend extension if the server supports it
+        return FileResponse(path, media_type=hls.SEGMENT_MEDIA_TYPE, headers={"Cache-Control": "private, max-age=3600"})
+
+
+# the workers are started by main.lifespan_handler
+thumbnail_service = ThumbnailService()
+
+
+def thumbnail_request(index: VdrIndex, seconds: float | None, width: int, format: ThumbnailFormat) -> ThumbnailRequest:
+    if seconds is None:
+        seconds = index.length_in_seconds * DEFAULT_THUMBNAIL_POSITION
+    try:
+        frame = index.seek(seconds).frame
+    except IndexError as err:
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=str(err))
+    return ThumbnailRequest(
+        recording_dir=index.recording_dir,
+        frame=frame,
+        width=width,
+        format=format,
+        is_pes_recording=index.is_pes_recording,
+    )
+
+
+@router.get("/vdr/recordings/{rec_num}/thumbnail", response_class=FileResponse)
+async def get_recording_thumbnail(
+    rec_num: int,
+    seconds: float | None = None,
+    width: int = Query(default=DEFAULT_THUMBNAIL_WIDTH, gt=0, le=1920),
+    format: ThumbnailFormat = ThumbnailFormat.jpeg,
+    current_user: User = Depends(get_current_active_user),
+) -> FileResponse:
+    """
+    Returns a thumbnail of the recording at the given time (in seconds)
+    """
+    async with recording_index(rec_num) as (_recording, index):
+        request = thumbnail_request(index, seconds, width, format)
+    try:
+        path = await thumbnail_service.get(request)
+    except (ThumbnailError, OSError) as err:
+        raise HTTPException(status_code=HTTP_503_SERVICE_UNAVAILABLE, detail=f"could not create thumbnail: {err}")
+    return FileResponse(
+        path,
+        media_type=thumbnail_media_type(format),
+        headers={"Cache-Control": "private, max-age=86400", "ETag": f'"{request.key}"'},
+    )
+
+
+class PreviewFrame(BaseModel):
+    seconds: float
+    url: str
+
+
+@router.get("/vdr/recordings/{rec_num}/preview", response_model=list[PreviewFrame])
+async def get_recording_preview(
+    rec_num: int,
+    count: int = Query(default=10, gt=0, le=100),
+    width: int = Query(default=DEFAULT_THUMBNAIL_WIDTH, gt=0, le=1920),
+    format: ThumbnailFormat = ThumbnailFormat.jpeg,
+    current_user: User = Depends(get_current_active_user),
+) -> list[PreviewFrame]:
+    """
+    Returns the thumbnail urls of a preview strip with `count` evenly spaced images
+    and creates the thumbnails in the background
+    """
+    async with recording_index(rec_num) as (_recording, index):
+        preview: list[PreviewFrame] = []
+        for i in range(count):
+            seconds = index.length_in_seconds * (i + 0.5) / count
+            thumbnail_service.prefetch(thumbnail_request(index, seconds, width, format))
+            preview.append(
+                PreviewFrame(
+                    seconds=seconds,
+                    url=f"/vdr/recordings/{rec_num}/thumbnail?seconds={seconds:.3f}&width={width}&format={format}",
+                )
+            )
+        return preview
+
+
 class Plugin(BaseModel):
     name: str
     version: str
@@ -310,29 +585,6 @@ class Timer(BaseModel):
     aux: str
 
 
-class TimerDetails(BaseModel):
-    status_flags: int
-    raw: str
-    id: int
-    channel_id: str
-    channel_name: str
-    remote: str
-    channel_id: str
-    day_weekdays: str
-    start: int
-    stop: int
-    time_span: str
-    duration: int
-    priority: int
-    lifetime: int
-    filename: str
-    aux: str
-    event_id: int
-    is_recording: bool
-    is_pending: bool
-    in_vps_margin: bool
-
-
 class ChannelData(BaseModel):
     name: str
     freq: int
@@ -352,153 +604,176 @@ class ChannelData(BaseModel):
 @router.get("/vdr/timers", response_model=list[TimerDetails])
 async def get_vdr_timers(
     *, current_user: User = Depends(get_current_active_user)
-) -> list[TimerDetails]:
-    vdr_channels = DeTvdrVdrChannelInterface.new_proxy(
-        "de.tvdr.vdr", "/Channels", bus=sdbus.sd_bus_open_system()
-    )
-    vdr_timers = DeTvdrVdrTimerInterface.new_proxy(
-        "de.tvdr.vdr", "/Timers", bus=sdbus.sd_bus_open_system()
-    )
-    # TODO: use svdrp, so we get the timer id, too
-    timers = [
-        line[4:].split(maxsplit=1)
-        async for line in async_send_svdrpcommand("LSTT")
-        if line.startswith("250")
-    ]
-    print(timers)
-    timers_detailed = (
-        await vdr_timers.list_detailed()
-    )  # TODO: do we want to use the more detailed vdr.Timers.ListDetailed ?
-    channels_raw, *_ = await vdr_channels.list("")
-    channel_ids: dict[str, str] = {}
-    for channel in channels_raw:
-        _chan_num, chan_str = channel
-        (
-            name,
-            freq,
-            params,
-            source,
-            _srate,
-            _vpid,
-            _apid,
-            _tpid,
-            _ca,
-            sid,
-            nid,
-            tid,
-            rid,
-        ) = chan_str.split(":")
-        if nid == "0" and tid == "0":
-            if source.startswith("S"):
-                offsets = {"H": 10000, "V": 20000, "L": 30000, "R": 40000}
-                offset = offsets[params[0]]
-            else:
-                offset = 0
-            tid = str(int(freq) + offset)
-
-        fields = [source, nid, tid, sid]
-
-        # the last part can be omitted if RID is 0
-        if rid != "0":
-            fields.append(rid)
-        chan_id = "-".join(fields)
-        channel_name = name.split(";")[0]
-        channel_ids[chan_id] = channel_name
-
-    t_data: list[TimerDetails] = []
-    for timer in timers_detailed:
-        d = DetailedTimer(*timer)
-
-        start_formatted = f"{d.start:04d}"
-        stop_formatted = f"{d.stop:04d}"
-        start_h = start_formatted[:2]
-        start_m = start_formatted[2:]
-        stop_h = stop_formatted[:2]
-        stop_m = stop_formatted[2:]
-        timespan_str = f"{start_h}:{start_m} - {stop_h}:{stop_m}"
-        try:
-            # try to get the day as a datetime.date
-            day_start = datetime.date.fromisoformat(d.day_weekdays)
-            t_start = datetime.time(hour=int(start_h), minute=int(start_m))
-            t_stop = datetime.time(hour=int(stop_h), minute=int(stop_m))
-
-            # check if the end point in hours is smaller than the start point - in this case we have a day change
-            day_stop = (
-                day_start + datetime.timedelta(days=1)
-                if (t_stop < t_start)
-                else day_start
-            )
+) -> Response:
+    """
+    Returns all timers with their channel name, the matching EPG event and the start and stop
+    of their next recording (served from the timer cache, which follows VDR's timer changes)
+    """
+    return Response(content=await timer_cache.timers_json(), media_type="application/json")
 
-            start = datetime.datetime.combine(day_start, t_start).timestamp()
-            stop = datetime.datetime.combine(day_stop, t_stop).timestamp()
-
-        except ValueError as err:
-            # TODO: handle VDR's repeating timers
-            print("special repeat timer by VDR:", err)
-            start = 0
-            stop = 0
-            duration = 0
-            continue
-
-        duration = stop - start
-
-        t_data.append(
-            TimerDetails(
-                id=d.id,
-                status_flags=d.flags,
-                raw=f"{d.flags}:{d.channel_id}:{d.day_weekdays}:{d.start}:{d.stop}:{d.lifetime}:{d.priority}:{d.aux}",
-                remote=d.remote,
-                channel_id=d.channel_id,
-                channel_name=channel_ids.get(d.channel_id, "?"),
-                day_weekdays=d.day_weekdays,
-                event_id=d.event_id,
-                start=int(start),
-                stop=int(stop),
-                time_span=timespan_str,
-                duration=int(duration),
-                priority=d.priority,
-                lifetime=d.lifetime,
-                filename=d.filename,
-                aux=d.aux,
-                is_recording=d.is_recording,
-                is_pending=d.is_pending,
-                in_vps_margin=d.in_vps_margin,
-            )
-        )
-    return t_data
 
+# pre-rendered feeds for calendar apps
+timer_feeds = TimerFeeds(timer_cache)
+# calendar apps can't send a bearer token, so the feeds use a secret token per user
+feed_tokens = FeedTokens()
 
-class TimerStatus(IntFlag):
-    INACTIVE = 0
-    PENDING = 1
-    INSTANT_REC = 2
-    VPS = 4
-    IS_RECORDING = 8
 
+def feed_user(token: str = Query(default="")) -> str:
+    if not token or (username := feed_tokens.user(token)) is None:
+        raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="invalid feed token")
+    return username
 
-class TimerData(BaseModel):
-    active: int = Field(default=TimerStatus.PENDING)
-    channel_id: str | int
-    dt_start: datetime.datetime
-    dt_end: datetime.datetime
-    title: str
-    prio: int = Field(default=50)
-    lifetime: int = Field(default=99)
-    aux: str = Field(default="")
+
+async def timer_feed_response(request: Request, name: str) -> Response:
+    feed = await timer_feeds.get(name)
+    # clients have to revalidate, but may keep the feed
+    headers = {"ETag": feed.etag, "Cache-Control": "private, no-cache"}
+    if feed.matches(request.headers.get("if-none-match")):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=feed.body, media_type=feed.media_type, headers=headers)
+
+
+@router.get("/vdr/timers.ics", response_class=Response)
+async def get_vdr_timers_ics(request: Request, username: str = Depends(feed_user)) -> Response:
+    """
+    The recordings of the next two weeks as iCalendar feed. Calendar apps can't log in,
+    so the feed (like the JSON feed) requires the feed token of a user as query parameter
+    (/vdr/timers.ics?token=...), see /vdr/timers/feed-token.
+    """
+    return await timer_feed_response(request, "ics")
+
+
+@router.get("/vdr/timers/feed.json", response_class=Response)
+async def get_vdr_timers_feed(request: Request, username: str = Depends(feed_user)) -> Response:
+    """The recordings of the next two weeks as compact JSON feed (requires the feed token)"""
+    return await timer_feed_response(request, "json")
+
+
+@router.get("/vdr/timers/feed-token", response_model=FeedToken)
+async def get_feed_token(current_user: User = Depends(get_current_active_user)) -> FeedToken:
+    """Returns the secret token of the user for the timer feeds, it is created on the first request"""
+    return FeedToken(token=feed_tokens.token(current_user.username))
+
+
+@router.post("/vdr/timers/feed-token", response_model=FeedToken)
+async def renew_feed_token(current_user: User = Depends(get_current_active_user)) -> FeedToken:
+    """Creates a new feed token for the user, feed URLs with the old token stop working"""
+    return FeedToken(token=feed_tokens.token(current_user.username, renew=True))
+
+
+class TimerOccurrence(BaseModel):
+    timer_id: int
+    channel_id: str
+    start: int
+    stop: int
+    priority: int
+    is_repeating: bool
+
+
+@router.get("/vdr/timers/schedule", response_model=list[TimerOccurrence])
+async def get_vdr_timer_schedule(
+    start: int | None = None,
+    end: int | None = None,
+    limit: int = Query(default=100, gt=0, le=1000),
+    active_only: bool = True,
+    after_timer_id: int | None = None,
+    current_user: User = Depends(get_current_active_user),
+) -> list[TimerOccurrence]:
+    """
+    Returns the recordings of all timers (including repeating timers) between start and end
+    (unix timestamps, start defaults to now) sorted by their start time and timer id.
+    For the next page use the start and the timer_id of the last returned entry as start and after_timer_id.
+    """
+    await refresh_timer_schedule()
+    dt_start = datetime.datetime.fromtimestamp(start).astimezone() if start is not None else datetime.datetime.now().astimezone()
+    dt_end = datetime.datetime.fromtimestamp(end).astimezone() if end is not None else None
+    return [
+        TimerOccurrence(**o._asdict(), is_repeating=timer_schedule.is_repeating(o.timer_id))
+        for o in itertools.islice(timer_schedule.occurrences(dt_start, dt_end, active_only, after_timer_id), limit)
+    ]
+
+
+# keeps the results of unchanged parts of the schedule between requests
+conflict_checker = ConflictChecker()
+
+
+@router.get("/vdr/timers/conflicts", response_model=list[Conflict])
+async def get_vdr_timer_conflicts(
+    days: int = Query(default=14, gt=0, le=60),
+    current_user: User = Depends(get_current_active_user),
+) -> list[Conflict]:
+    """
+    Returns the time spans in which not all timers can be recorded by the available tuners
+    """
+    await refresh_timer_schedule()
+    conflict_checker.set_tuners(await list_tuners())
+    conflict_checker.set_channels(timer_cache.channels)
+    now = time.time()
+    return conflict_checker.check(planned_recordings(timer_schedule, now, now + days * 86400))
 
 
 @router.post("/vdr/newt")
 async def create_timer(
     timer: TimerData, current_user: User = Depends(get_current_active_user)
 ):
-    print(
-        f"NEWT {timer.active}:{timer.channel_id}:{timer.dt_start.strftime('%Y-%m-%d')}:{timer.dt_start.strftime('%H%M')}:{timer.dt_end.strftime('%H%M')}:{timer.prio}:{timer.lifetime}:{timer.title}:{timer.aux}"
-    )
+    print(f"NEWT {timer.timer_string()}")
     # TODO: get time before/after timer
-    async for line in async_send_svdrpcommand(
-        f"NEWT {timer.active}:{timer.channel_id}:{timer.dt_start.strftime('%Y-%m-%d')}:{timer.dt_start.strftime('%H%M')}:{timer.dt_end.strftime('%H%M')}:{timer.prio}:{timer.lifetime}:{timer.title}:{timer.aux}"
-    ):
+    async for line in async_send_svdrpcommand(f"NEWT {timer.timer_string()}"):
         print(line)
+    timer_cache.invalidate()
+
+
+@router.post("/vdr/timers/bulk", response_model=BulkTimerResponse)
+async def create_timers(
+    timers: list[BulkTimer], current_user: User = Depends(get_current_active_user)
+) -> BulkTimerResponse:
+    """
+    Creates new timers and modifies existing timers (if an id is given) in a single SVDRP session.
+    If one of the timers is invalid nothing is changed, if VDR rejects one of the timers
+    the changes of the other timers are reverted.
+    """
+    await timer_cache.ensure_loaded()
+    await recording_catalog.ensure_loaded()
+    result = await bulk_timers(timers, timer_cache.channels, timer_cache.schedule.timers, duplicate_index)
+    if result.success or result.rolled_back:
+        timer_cache.invalidate()
+    return result
+
+
+# searches the EPG for the saved rules, run by main.lifespan_handler
+search_timer_engine = SearchTimerEngine(timer_cache, duplicate_index)
+
+
+@router.get("/vdr/searchtimers", response_model=list[SearchTimerRule])
+async def get_search_timers(current_user: User = Depends(get_current_active_user)) -> list[SearchTimerRule]:
+    return search_timer_engine.state.rules
+
+
+@router.post("/vdr/searchtimers", response_model=SearchTimerRule)
+async def set_search_timer(
+    rule: SearchTimerRule, current_user: User = Depends(get_current_active_user)
+) -> SearchTimerRule:
+    """
+    Adds a search timer (if the id is 0) or replaces an existing one.
+    The rule is checked against the whole EPG on the next scan.
+    """
+    try:
+        return search_timer_engine.set_rule(rule)
+    except ValueError as err:
+        raise HTTPException(status_code=HTTP_400_BAD_REQUEST, detail=str(err))
+
+
+@router.delete("/vdr/searchtimers/{rule_id}")
+async def delete_search_timer(rule_id: int, current_user: User = Depends(get_current_active_user)) -> bool:
+    if not search_timer_engine.delete_rule(rule_id):
+        raise HTTPException(status_code=HTTP_404_NOT_FOUND, detail=f"unknown search timer {rule_id}")
+    return True
+
+
+@router.post("/vdr/searchtimers/scan", response_model=list[SearchTimerMatch])
+async def scan_search_timers(current_user: User = Depends(get_current_active_user)) -> list[SearchTimerMatch]:
+    """check the new and changed EPG events now and return the matches which have been found"""
+    return await search_timer_engine.scan()
 
 
 class ChannelMapping(BaseModel):
@@ -1,6 +1,8 @@
 import asyncio
 from typing import AsyncGenerator
 
+from .openmetrics import SVDRP_LATENCY
+
 class SVDRP:
     def __init__(self, host: str = "127.0.0.1", port: int = 6419):
         self.host = host
@@ -46,11 +48,25 @@ class SVDRP:
     async def send_cmd(self, cmd: str) -> list[str]:
         if not self.writer:
             raise TypeError("trying to use reader without establishing the connection first")
-        self.writer.write(f"{cmd}\r\n".encode(self.encoding))
-        await self.writer.drain()
-        response = [l.decode(self.encoding, errors="backslashreplace") async for c, l in self.read_response_line_by_line()]
+        with SVDRP_LATENCY.time(cmd.split(" ", 1)[0].upper()):
+            self.writer.write(f"{cmd}\r\n".encode(self.encoding))
+            await self.writer.drain()
+            response = [l.decode(self.encoding, errors="backslashreplace") async for c, l in self.read_response_line_by_line()]
         return response
 
+    async def send_cmd_with_code(self, cmd: str) -> tuple[int, list[str]]:
+        """like send_cmd, but also returns the response code (of the last line)"""
+        if not self.writer:
+            raise TypeError("trying to use reader without establishing the connection first")
+        code = 0
+        response = []
+        with SVDRP_LATENCY.time(cmd.split(" ", 1)[0].upper()):
+            self.writer.write(f"{cmd}\r\n".encode(self.encoding))
+            await self.writer.drain()
+            async for code, l in self.read_response_line_by_line():
+                response.append(l.decode(self.encoding, errors="backslashreplace"))
+        return code, response
+
     async def __aenter__(self):
         await self.open_connection()
         return self
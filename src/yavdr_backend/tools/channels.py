@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Channel registry built from VDR's channel list
+"""
+import contextlib
+from typing import NamedTuple
+
+import sdbus
+
+from yavdr_backend.interfaces.vdr_channels import DeTvdrVdrChannelInterface
+
+POLARIZATION_OFFSETS = {"H": 100000, "V": 200000, "L": 300000, "R": 400000}
+
+
+class ChannelInfo(NamedTuple):
+    channel_id: str
+    number: int
+    name: str
+    provider: str
+    frequency: int
+    params: str
+    source: str
+    ca: str
+    sid: int
+    nid: int
+    tid: int
+    rid: int
+
+    @property
+    def is_encrypted(self) -> bool:
+        return self.ca not in ("", "0")
+
+    @property
+    def transponder_frequency(self) -> int:
+        """
+        the transponder as calculated by VDR's cChannel::Transponder():
+        the frequency in MHz plus an offset for the polarization of satellite channels
+        (some satellites use the same frequency with opposite polarizations)
+        """
+        tf = self.frequency
+        while tf > 20000:
+            tf //= 1000
+        if self.source.startswith("S"):
+            for p in self.params.upper():
+                if p in POLARIZATION_OFFSETS:
+                    tf += POLARIZATION_OFFSETS[p]
+                    break
+        return tf
+
+    @property
+    def transponder(self) -> tuple[str, int]:
+        return self.source, self.transponder_frequency
+
+
+def parse_channel_string(number: int, chan_str: str) -> ChannelInfo:
+    """parse a line of the channels.conf, raises a ValueError for channel groups and invalid lines"""
+    name, freq, params, source, _srate, _vpid, _apid, _tpid, ca, sid, nid, tid, rid, *_ = chan_str.split(":")
+    name, _, provider = name.partition(";")
+    channel = ChannelInfo(
+        channel_id="",
+        number=number,
+        name=name,
+        provider=provider,
+        frequency=int(freq),
+        params=params,
+        source=source,
+        ca=ca,
+        sid=int(sid),
+        nid=int(nid),
+        tid=int(tid),
+        rid=int(rid),
+    )
+    # If a channel has both NID and TID set to 0, the channel ID uses the transponder instead of the TID
+    tid = channel.transponder_frequency if channel.nid == 0 and channel.tid == 0 else channel.tid
+    fields = [source, str(channel.nid), str(tid), str(channel.sid)]
+    # the last part can be omitted if RID is 0
+    if channel.rid:
+        fields.append(str(channel.rid))
+    return channel._replace(channel_id="-".join(fields))
+
+
+async def list_channels() -> dict[str, ChannelInfo]:
+    """return all channels by their channel id"""
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        vdr_channels = DeTvdrVdrChannelInterface.new_proxy("de.tvdr.vdr", "/Channels", bus=bus)
+        channels_raw, *_ = await vdr_channels.list("")
+    channels: dict[str, ChannelInfo] = {}
+    for number, chan_str in channels_raw:
+        try:
+            channel = parse_channel_string(number, chan_str)
+        except ValueError:
+            continue
+        channels[channel.channel_id] = channel
+    return channels
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Forecast of the disk space needed by the scheduled timers.
+
+The bitrate of each channel is learned from the existing recordings (FileSizeMB and
+LengthInSeconds grouped by InfoChannelID), the sum of the projected sizes of all
+pending timers is compared with the free space on the video filesystem.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from enum import StrEnum
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from .recordings import Recording, RecordingCatalog
+from .timers import PlannedRecording
+
+VIDEO_DIR = Path(os.environ.get("VDR_VIDEO_DIR", "/srv/vdr/video"))
+# used if there are no recordings to learn from, roughly a HD channel with 8 MBit/s
+DEFAULT_BITRATE_MB_S = 1.0
+# ignore very short recordings (e.g. aborted ones), they don't tell much about the bitrate
+MIN_RECORDING_LENGTH = 300
+MB = 1024 * 1024
+
+
+class BitrateSource(StrEnum):
+    channel = "channel"
+    average = "average"
+    default = "default"
+
+
+class BitrateModel:
+    def __init__(self, recordings: Iterable[Recording]) -> None:
+        sizes: dict[str, float] = {}
+        lengths: dict[str, float] = {}
+        total_size = total_length = 0.0
+        for r in recordings:
+            if r.LengthInSeconds < MIN_RECORDING_LENGTH or r.FileSizeMB <= 0:
+                continue
+            total_size += r.FileSizeMB
+            total_length += r.LengthInSeconds
+            if r.InfoChannelID:
+                sizes[r.InfoChannelID] = sizes.get(r.InfoChannelID, 0) + r.FileSizeMB
+                lengths[r.InfoChannelID] = lengths.get(r.InfoChannelID, 0) + r.LengthInSeconds
+        self.channel_bitrates = {channel_id: sizes[channel_id] / lengths[channel_id] for channel_id in sizes}
+        self.average_bitrate = total_size / total_length if total_length else None
+
+    def bitrate(self, channel_id: str) -> tuple[float, BitrateSource]:
+        """return the expected bitrate in MB/s"""
+        if (bitrate := self.channel_bitrates.get(channel_id)) is not None:
+            return bitrate, BitrateSource.channel
+        if self.average_bitrate is not None:
+            return self.average_bitrate, BitrateSource.average
+        return DEFAULT_BITRATE_MB_S, BitrateSource.default
+
+
+class TimerForecast(BaseModel):
+    timer_id: int
+    channel_id: str
+    start: int
+    stop: int
+    bitrate_mb_s: float
+    bitrate_source: BitrateSource
+    estimated_size_mb: float
+    free_mb_after: float
+
+
+class DiskForecast(BaseModel):
+    video_dir: str
+    timestamp: int
+    days: int
+    total_mb: float
+    free_mb: float
+    required_mb: float
+    remaining_mb: float
+    # start of the first timer which won't fit on the disk
+    runs_out_at: int | None
+    warning: bool
+    timers: list[TimerForecast]
+
+
+def forecast(
+    planned: Iterable[PlannedRecording],
+    model: BitrateModel,
+    video_dir: Path,
+    days: int,
+    now: float,
+    reserve_mb: float = 0,
+) -> DiskForecast:
+    usage = shutil.disk_usage(video_dir)
+    free_mb = usage.free / MB - reserve_mb
+    remaining = free_mb
+    runs_out_at = None
+    timers: list[TimerForecast] = []
+    for p in sorted(planned, key=lambda p: p.start):
+        bitrate, source = model.bitrate(p.channel_id)
+        # running recordings only need space for their remaining part
+        size = bitrate * (p.stop - max(p.start, now))
+        remaining -= size
+        if remaining < 0 and runs_out_at is None:
+            runs_out_at = p.start
+        timers.append(
+            TimerForecast(
+                timer_id=p.timer_id,
+                channel_id=p.channel_id,
+                start=p.start,
+                stop=p.stop,
+                bitrate_mb_s=bitrate,
+                bitrate_source=source,
+                estimated_size_mb=size,
+                free_mb_after=remaining,
+            )
+        )
+    return DiskForecast(
+        video_dir=str(video_dir),
+        timestamp=int(now),
+        days=days,
+        total_mb=usage.total / MB,
+        free_mb=free_mb,
+        required_mb=free_mb - remaining,
+        remaining_mb=remaining,
+        runs_out_at=runs_out_at,
+        warning=runs_out_at is not None,
+        timers=timers,
+    )
+
+
+class DiskSpaceForecaster:
+    """
+    keeps the latest forecast and calls `on_warning` if the
+    pending timers are not expected to fit on the video disk
+    """
+
+    def __init__(
+        self,
+        catalog: RecordingCatalog,
+        planned_recordings: Callable[[float, float], Awaitable[list[PlannedRecording]]],
+        video_dir: Path = VIDEO_DIR,
+        days: int = 7,
+        interval: float = 900,
+    ) -> None:
+        self.catalog = catalog
+        self.planned_recordings = planned_recordings
+        self.video_dir = video_dir
+        self.days = days
+        self.interval = interval
+        self.latest: DiskForecast | None = None
+        self.on_warning: Callable[[DiskForecast], Awaitable[None]] | None = None
+        self._model: BitrateModel | None = None
+        self._model_version = -1
+
+    @property
+    def model(self) -> BitrateModel:
+        if self._model is None or self._model_version != self.catalog.version:
+            self._model = BitrateModel(self.catalog.recordings.values())
+            self._model_version = self.catalog.version
+        return self._model
+
+    async def update(self, days: int | None = None) -> DiskForecast:
+        days = days or self.days
+        await self.catalog.ensure_loaded()
+        now = time.time()
+        planned = await self.planned_recordings(now, now + days * 86400)
+        result = await asyncio.to_thread(forecast, planned, self.model, self.video_dir, days, now)
+        if days == self.days:
+            self.latest = result
+        return result
+
+    async def run_update(self) -> None:
+        was_warning = False
+        while True:
+            try:
+                result = await self.update()
+                if result.warning and not was_warning and self.on_warning is not None:
+                    await self.on_warning(result)
+                was_warning = result.warning
+            except Exception as err:
+                logging.warning("could not update the disk space forecast: %s", err)
+            await asyncio.sleep(self.interval)
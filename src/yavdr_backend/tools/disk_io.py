@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+I/O rates of the block devices.
+
+The counters in /proc/diskstats are read by the system status collector, IOPS,
+throughput, utilization and the average wait time are the differences to the previous
+sample. Devices are mapped to the mountpoints of `disk_usage`, so e.g. the video disk
+can be found by its mountpoint.
+"""
+import os
+import time
+from collections import defaultdict
+from collections.abc import Iterable
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+PROC_DISKSTATS = Path("/proc/diskstats")
+IGNORED_PREFIXES = ("loop", "ram")
+SECTOR_SIZE = 512
+
+
+class DiskCounters(NamedTuple):
+    reads: int
+    sectors_read: int
+    ms_reading: int
+    writes: int
+    sectors_written: int
+    ms_writing: int
+    in_progress: int
+    ms_doing_io: int
+
+
+# the fields which only increase
+COUNTERS = [f for f in DiskCounters._fields if f != "in_progress"]
+
+
+def parse_diskstats(text: str) -> dict[str, DiskCounters]:
+    counters: dict[str, DiskCounters] = {}
+    for line in text.splitlines():
+        fields = line.split()
+        if len(fields) < 14 or fields[2].startswith(IGNORED_PREFIXES):
+            continue
+        values = [int(f) for f in fields[3:13]]
+        counters[fields[2]] = DiskCounters(
+            reads=values[0],
+            sectors_read=values[2],
+            ms_reading=values[3],
+            writes=values[4],
+            sectors_written=values[6],
+            ms_writing=values[7],
+            in_progress=values[8],
+            ms_doing_io=values[9],
+        )
+    return counters
+
+
+class DiskIOStats(BaseModel):
+    name: str
+    mountpoints: list[str]
+    read_iops: float
+    write_iops: float
+    read_bytes_per_s: float
+    write_bytes_per_s: float
+    # the share of the time with I/O in progress (%)
+    utilization: float
+    # the average time of a completed request (queue and service time), None without requests
+    await_ms: float | None
+    in_progress: int
+
+
+def compare(name: str, mountpoints: list[str], previous: DiskCounters, current: DiskCounters, seconds: float) -> DiskIOStats:
+    reads = current.reads - previous.reads
+    writes = current.writes - previous.writes
+    wait = current.ms_reading - previous.ms_reading + current.ms_writing - previous.ms_writing
+    return DiskIOStats(
+        name=name,
+        mountpoints=mountpoints,
+        read_iops=round(reads / seconds, 1),
+        write_iops=round(writes / seconds, 1),
+        read_bytes_per_s=round((current.sectors_read - previous.sectors_read) * SECTOR_SIZE / seconds, 1),
+        write_bytes_per_s=round((current.sectors_written - previous.sectors_written) * SECTOR_SIZE / seconds, 1),
+        utilization=round(min((current.ms_doing_io - previous.ms_doing_io) / (seconds * 10), 100.0), 1),
+        await_ms=round(wait / (reads + writes), 2) if reads + writes > 0 else None,
+        in_progress=current.in_progress,
+    )
+
+
+class DiskIO:
+    def __init__(self, path: Path = PROC_DISKSTATS) -> None:
+        self.path = path
+        self.mountpoints: dict[str, list[str]] = {}
+        self._previous: dict[str, DiskCounters] = {}
+        self._timestamp = 0.0
+
+    def set_mounts(self, mounts: Iterable[tuple[str, str]]) -> None:
+        """map the devices (e.g. /dev/mapper/vg-video -> dm-0) of (device, mountpoint) pairs"""
+        mountpoints: defaultdict[str, list[str]] = defaultdict(list)
+        for device, mountpoint in mounts:
+            mountpoints[os.path.basename(os.path.realpath(device))].append(mountpoint)
+        self.mountpoints = dict(mountpoints)
+
+    def sample(self) -> list[DiskIOStats]:
+        now = time.monotonic()
+        counters = parse_diskstats(self.path.read_text())
+        seconds = now - self._timestamp
+        result: list[DiskIOStats] = []
+        for name, current in counters.items():
+            previous = self._previous.get(name)
+            # skip unused devices and counters which have been reset
+            if previous is None or seconds <= 0 or current.reads + current.writes == 0:
+                continue
+            if any(getattr(current, f) < getattr(previous, f) for f in COUNTERS):
+                continue
+            result.append(compare(name, self.mountpoints.get(name, []), previous, current, seconds))
+        self._previous, self._timestamp = counters, now
+        return result
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Duplicate detection for recordings and timers.
+
+Each recording and timer gets a fingerprint of its folded title and subtitle (or an
+episode marker like "Staffel 2, Folge 5" taken from the description if there is no
+subtitle). Without a subtitle or an episode marker there is no fingerprint, otherwise all
+episodes of a series would be duplicates of the first one. The `DuplicateIndex` maps fingerprints to the recordings and timers with that
+fingerprint, so "already recorded or scheduled?" is a dictionary lookup. The index is
+updated when the recording catalog or the timer cache have changed.
+"""
+import hashlib
+import re
+import unicodedata
+from collections.abc import Callable, Iterable, Mapping
+from typing import Any
+
+from pydantic import BaseModel
+
+from .recordings import Recording, RecordingCatalog
+from .timer_cache import TimerCache, TimerDetails
+
+FOLDER_SEPARATOR = "~"
+# only the beginning of the description is searched for episode markers
+DESCRIPTION_PREFIX = 300
+
+EPISODE_PATTERNS = [
+    re.compile(r"\bs(?P<season>\d{1,2})\s*e(?P<episode>\d{1,3})\b", re.IGNORECASE),
+    re.compile(
+        r"\b(?:staffel|season)\s+(?P<season>\d+)\s*,?\s*(?:folge|episode)\s+(?P<episode>\d+)", re.IGNORECASE
+    ),
+    re.compile(r"\b(?:folge|episode|teil|part)\s+(?P<episode>\d+)\b", re.IGNORECASE),
+    re.compile(r"\((?P<episode>\d+)/\d+\)"),
+]
+
+
+def fold(text: str | None) -> str:
+    """case fold, remove accents and punctuation and collapse whitespace"""
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    without_accents = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[\W_]+", " ", without_accents).split())
+
+
+def episode_marker(*texts: str | None) -> str:
+    """return the episode as "s2e5" or "e5" if one of the texts contains an episode marker"""
+    for text in texts:
+        if not text:
+            continue
+        for pattern in EPISODE_PATTERNS:
+            if (match := pattern.search(text[:DESCRIPTION_PREFIX])) is not None:
+                season = match.groupdict().get("season")
+                episode = int(match["episode"])
+                return f"s{int(season)}e{episode}" if season else f"e{episode}"
+    return ""
+
+
+def fingerprint(title: str, short_text: str | None = None, description: str | None = None) -> str | None:
+    """
+    identifies an episode regardless of the channel and the time it is broadcast,
+    None if the episode is unknown (so it can't be checked for duplicates)
+    """
+    episode = fold(short_text) or episode_marker(description)
+    if not episode:
+        return None
+    return hashlib.sha1(f"{fold(title)}\0{episode}".encode()).hexdigest()[:16]
+
+
+def recording_fingerprint(recording: Recording) -> str | None:
+    return fingerprint(recording.InfoTitle or recording.Name, recording.InfoShortText, recording.InfoDescription)
+
+
+def timer_fingerprint(timer: TimerDetails) -> str | None:
+    if timer.event is not None:
+        return fingerprint(timer.event.title, timer.event.short_text, timer.event.description)
+    # without EPG data the file name ("folder~title~subtitle") is all we have,
+    # "folder~title" and "title~subtitle" can't be told apart
+    parts = timer.filename.split(FOLDER_SEPARATOR)
+    if len(parts) < 3:
+        return None
+    return fingerprint(parts[-2], parts[-1])
+
+
+class DuplicateMatch(BaseModel):
+    # None if the episode is unknown
+    fingerprint: str | None
+    recordings: list[str]
+    timer_ids: list[int]
+
+    @property
+    def found(self) -> bool:
+        return bool(self.recordings or self.timer_ids)
+
+
+class DuplicateRecording(BaseModel):
+    RecNum: int
+    Path: str
+    Name: str
+    Start: int
+    FileSizeMB: int
+
+
+class DuplicateGroup(BaseModel):
+    fingerprint: str
+    title: str
+    short_text: str | None
+    recordings: list[DuplicateRecording]
+    size_mb: int
+    # the size of all but the largest recording
+    redundant_mb: int
+
+
+class DuplicateReport(BaseModel):
+    groups: list[DuplicateGroup]
+    size_mb: int
+    redundant_mb: int
+
+
+class DuplicateIndex:
+    def __init__(self, catalog: RecordingCatalog, timer_cache: TimerCache) -> None:
+        self.catalog = catalog
+        self.timer_cache = timer_cache
+        self.recordings: dict[str, set[str]] = {}
+        self.timers: dict[str, set[int]] = {}
+        self._recording_fps: dict[str, tuple[Recording, str | None]] = {}
+        self._timer_fps: dict[int, tuple[TimerDetails, str | None]] = {}
+        self._catalog_version = -1
+        self._timer_version = -1
+
+    @staticmethod
+    def _sync(
+        index: dict[str, set[Any]],
+        known: dict[Any, tuple[Any, str | None]],
+        items: Mapping[Any, Any],
+        get_fingerprint: Callable[[Any], str | None],
+    ) -> None:
+        """update the index with the items which have been added, changed or removed"""
+
+        def discard(key: Any, fp: str | None) -> None:
+            if fp is None:
+                return
+            index[fp].discard(key)
+            if not index[fp]:
+                del index[fp]
+
+        for key in known.keys() - items.keys():
+            discard(key, known.pop(key)[1])
+        for key, item in items.items():
+            if (old := known.get(key)) is not None:
+                if old[0] is item:
+                    continue
+                discard(key, old[1])
+            fp = get_fingerprint(item)
+            known[key] = item, fp
+            if fp is not None:
+                index.setdefault(fp, set()).add(key)
+
+    def update(self) -> None:
+        if self._catalog_version != self.catalog.version:
+            self._sync(self.recordings, self._recording_fps, self.catalog.recordings, recording_fingerprint)
+            self._catalog_version = self.catalog.version
+        if self._timer_version != self.timer_cache.version:
+            self._sync(self.timers, self._timer_fps, self.timer_cache.details, timer_fingerprint)
+            self._timer_version = self.timer_cache.version
+
+    def __contains__(self, fp: str | None) -> bool:
+        if fp is None:
+            return False
+        self.update()
+        return fp in self.recordings or fp in self.timers
+
+    def lookup(self, title: str, short_text: str | None = None, description: str | None = None) -> DuplicateMatch:
+        self.update()
+        fp = fingerprint(title, short_text, description)
+        if fp is None:
+            return DuplicateMatch(fingerprint=None, recordings=[], timer_ids=[])
+        return DuplicateMatch(
+            fingerprint=fp,
+            recordings=sorted(self.recordings.get(fp, ())),
+            timer_ids=sorted(self.timers.get(fp, ())),
+        )
+
+    def groups(self) -> Iterable[tuple[str, list[Recording]]]:
+        self.update()
+        for fp, paths in self.recordings.items():
+            if len(paths) > 1:
+                yield fp, [self.catalog.recordings[p] for p in paths]
+
+    def report(self) -> DuplicateReport:
+        groups: list[DuplicateGroup] = []
+        for fp, recordings in self.groups():
+            recordings.sort(key=lambda r: r.Start)
+            sizes = [r.FileSizeMB for r in recordings]
+            first = recordings[0]
+            groups.append(
+                DuplicateGroup(
+                    fingerprint=fp,
+                    title=first.InfoTitle or first.Name,
+                    short_text=first.InfoShortText,
+                    recordings=[DuplicateRecording(**r.model_dump(include=set(DuplicateRecording.model_fields))) for r in recordings],
+                    size_mb=sum(sizes),
+                    redundant_mb=sum(sizes) - max(sizes),
+                )
+            )
+        groups.sort(key=lambda g: g.size_mb, reverse=True)
+        return DuplicateReport(
+            groups=groups,
+            size_mb=sum(g.size_mb for g in groups),
+            redundant_mb=sum(g.redundant_mb for g in groups),
+        )
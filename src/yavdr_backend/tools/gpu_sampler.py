@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Sampling of NVIDIA GPUs with a single long running `nvidia-smi` process.
+
+`nvidia-smi -lms <interval>` prints a line for each GPU in every interval, the lines
+are parsed as they arrive, so reading the GPU temperature doesn't need a new process.
+If `nvidia-smi` isn't installed the sampler stops, if it fails (e.g. no GPU or the
+driver isn't loaded) it is restarted with an exponential backoff.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+
+NVIDIA_SMI = "nvidia-smi"
+QUERY_FIELDS = ("index", "name", "temperature.gpu", "utilization.gpu", "memory.used", "memory.total")
+
+
+class GpuStats(NamedTuple):
+    index: int
+    name: str
+    temperature: float | None
+    utilization: float | None
+    # MiB
+    memory_used: float | None
+    memory_total: float | None
+
+
+def parse_value(value: str) -> float | None:
+    """nvidia-smi reports e.g. "[N/A]" or "[Not Supported]" for missing values"""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_line(line: str) -> GpuStats | None:
+    fields = [f.strip() for f in line.split(",")]
+    if len(fields) != len(QUERY_FIELDS):
+        return None
+    try:
+        index = int(fields[0])
+    except ValueError:
+        return None
+    return GpuStats(index, fields[1], *(parse_value(f) for f in fields[2:]))
+
+
+class GpuSampler:
+    def __init__(
+        self,
+        command: str = NVIDIA_SMI,
+        interval: float = 2,
+        backoff: float = 10,
+        max_backoff: float = 3600,
+    ) -> None:
+        self.command = command
+        self.interval = interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.gpus: dict[int, GpuStats] = {}
+        self.updated = 0.0
+        self.failures = 0
+        # False if nvidia-smi isn't installed
+        self.available = True
+        # called with the stats of all GPUs of an interval
+        self.on_sample: Callable[[list[GpuStats]], None] | None = None
+
+    def latest(self) -> list[GpuStats]:
+        """the stats of the last interval, empty if they are outdated"""
+        if time.monotonic() - self.updated > 3 * self.interval:
+            return []
+        return [self.gpus[i] for i in sorted(self.gpus)]
+
+    def _publish(self, sample: dict[int, GpuStats]) -> None:
+        self.gpus = sample
+        self.updated = time.monotonic()
+        self.failures = 0
+        if self.on_sample is not None:
+            self.on_sample(list(sample.values()))
+
+    async def _run_process(self) -> int:
+        process = await asyncio.create_subprocess_exec(
+            self.command,
+            f"--query-gpu={','.join(QUERY_FIELDS)}",
+            "--format=csv,noheader,nounits",
+            f"-lms={int(self.interval * 1000)}",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        assert process.stdout is not None
+        sample: dict[int, GpuStats] = {}
+        # the number of GPUs is known after the first interval
+        count: int | None = None
+        try:
+            async for raw_line in process.stdout:
+                stats = parse_line(raw_line.decode(errors="replace"))
+                if stats is None:
+                    logging.debug("unexpected output of nvidia-smi: %r", raw_line)
+                    continue
+                # a GPU which has already been seen starts the next interval
+                if stats.index in sample:
+                    count = len(sample)
+                    self._publish(sample)
+                    sample = {}
+                sample[stats.index] = stats
+                if count is not None and len(sample) >= count:
+                    self._publish(sample)
+                    sample = {}
+            return await process.wait()
+        finally:
+            if process.returncode is None:
+                process.terminate()
+                with contextlib.suppress(ProcessLookupError):
+                    await process.wait()
+
+    async def run_update(self) -> None:
+        while True:
+            try:
+                returncode = await self._run_process()
+                logging.debug("nvidia-smi exited with %s", returncode)
+            except FileNotFoundError:
+                logging.info("%s is not available, not sampling the GPU", self.command)
+                self.available = False
+                return
+            except OSError as err:
+                logging.warning("could not run %s: %s", self.command, err)
+            self.gpus = {}
+            delay = min(self.backoff * 2 ** self.failures, self.max_backoff)
+            self.failures += 1
+            await asyncio.sleep(delay)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+HLS playlists for VDR recordings.
+
+The segments are cut at independent frames using the recording's index file and
+refer to byte ranges (EXT-X-BYTERANGE) of the existing ts files, so nothing has to be
+remuxed or transcoded - a player just requests ranges of the original files.
+Recordings which are still running get an EVENT playlist without an end, so players
+reload it and follow the recording. Walking the index of a long recording takes a
+while, so the segment starts are kept per recording and only the frames added since
+the last request are read when the index grows.
+"""
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import NamedTuple
+
+from .vdr_index import VdrIndex
+
+DEFAULT_SEGMENT_DURATION = 6.0
+PLAYLIST_CACHE_SIZE = 64
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPE = "video/mp2t"
+# VDR keeps this file in the recording directory while a timer is recording into it
+TIMER_RECORDING_FILE = ".timer"
+# an index which has been written to recently belongs to a running recording
+INDEX_GROWING_TIMEOUT = 10.0
+
+
+class HlsSegment(NamedTuple):
+    file_number: int
+    offset: int
+    length: int
+    duration: float
+
+
+# (frame, file_number, offset) of the first frame of a segment
+SegmentStart = tuple[int, int, int]
+
+
+def find_segment_starts(
+    index: VdrIndex, segment_duration: float, starts: list[SegmentStart], first_frame: int = 0
+) -> None:
+    """
+    append the segment starts from `first_frame` on to `starts`, the segments are at least
+    `segment_duration` seconds long and start at an independent frame
+    """
+    min_frames = max(int(segment_duration * index.frames_per_second), 1)
+    for frame, entry in index.independent_frames(first_frame):
+        if starts:
+            last_frame, last_file, _ = starts[-1]
+            if entry.file_number == last_file and frame - last_frame < min_frames:
+                continue
+        starts.append((frame, entry.file_number, entry.offset))
+
+
+def build_segments(
+    index: VdrIndex, segment_duration: float = DEFAULT_SEGMENT_DURATION, starts: list[SegmentStart] | None = None
+) -> list[HlsSegment]:
+    """
+    split the recording into segments of at least `segment_duration` seconds,
+    starting each segment at an independent frame. Segments never span two files.
+    """
+    if starts is None:
+        starts = []
+        find_segment_starts(index, segment_duration, starts)
+
+    file_sizes: dict[int, int] = {}
+
+    def file_size(file_number: int) -> int:
+        if file_number not in file_sizes:
+            try:
+                file_sizes[file_number] = os.stat(index.file_path(file_number)).st_size
+            except OSError:
+                file_sizes[file_number] = 0
+        return file_sizes[file_number]
+
+    segments: list[HlsSegment] = []
+    for i, (frame, file_number, offset) in enumerate(starts):
+        if i + 1 < len(starts):
+            next_frame, next_file, next_offset = starts[i + 1]
+        else:
+            next_frame, next_file, next_offset = index.num_frames, None, 0
+        end = next_offset if next_file == file_number else file_size(file_number)
+        if end <= offset:
+            continue
+        segments.append(
+            HlsSegment(
+                file_number=file_number,
+                offset=offset,
+                length=end - offset,
+                duration=(next_frame - frame) / index.frames_per_second,
+            )
+        )
+    return segments
+
+
+def segment_uri(index: VdrIndex, file_number: int) -> str:
+    return index.file_path(file_number).name
+
+
+def is_in_progress(index: VdrIndex, now: float | None = None) -> bool:
+    """whether the recording is still running, i.e. its timer is active or the index is growing"""
+    if (index.recording_dir / TIMER_RECORDING_FILE).exists():
+        return True
+    return (time.time() if now is None else now) - index.mtime < INDEX_GROWING_TIMEOUT
+
+
+def render_playlist(index: VdrIndex, segments: list[HlsSegment], in_progress: bool = False) -> bytes:
+    target_duration = math.ceil(max((s.duration for s in segments), default=DEFAULT_SEGMENT_DURATION))
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:4",  # EXT-X-BYTERANGE needs version 4
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        # players reload an EVENT playlist until it has an end
+        f"#EXT-X-PLAYLIST-TYPE:{'EVENT' if in_progress else 'VOD'}",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+    ]
+    for segment in segments:
+        lines.append(f"#EXTINF:{segment.duration:.3f},")
+        lines.append(f"#EXT-X-BYTERANGE:{segment.length}@{segment.offset}")
+        lines.append(segment_uri(index, segment.file_number))
+    if not in_progress:
+        lines.append("#EXT-X-ENDLIST")
+    return ("\n".join(lines) + "\n").encode()
+
+
+@dataclass
+class CachedPlaylist:
+    frames_per_second: float
+    # the frames of the index which have been searched for segment starts
+    scanned: int = 0
+    starts: list[SegmentStart] = field(default_factory=list)
+    # index size, index mtime and in progress of the rendered playlist
+    key: tuple[int, float, bool] | None = None
+    playlist: bytes = b""
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+# key: recording dir and segment duration, the most recently used playlist is the last one
+_playlist_cache: dict[tuple[Path, float], CachedPlaylist] = {}
+_playlist_cache_lock = threading.Lock()
+
+
+def get_playlist(index: VdrIndex, segment_duration: float = DEFAULT_SEGMENT_DURATION) -> bytes:
+    """
+    return the rendered playlist for the recording, playlists are cached until the index
+    file changes (e.g. because the recording is still running) or the recording ends.
+    This reads the index, so it should run in a thread.
+    """
+    in_progress = is_in_progress(index)
+    cache_key = (index.recording_dir, segment_duration)
+    with _playlist_cache_lock:
+        cached = _playlist_cache.pop(cache_key, None)
+        if cached is None or cached.frames_per_second != index.frames_per_second:
+            cached = CachedPlaylist(index.frames_per_second)
+        _playlist_cache[cache_key] = cached
+        while len(_playlist_cache) > PLAYLIST_CACHE_SIZE:
+            del _playlist_cache[next(iter(_playlist_cache))]
+    with cached.lock:
+        key = (index.size, index.mtime, in_progress)
+        if cached.key != key:
+            if index.num_frames < cached.scanned:
+                # the index has been replaced (e.g. the recording has been cut)
+                cached.starts.clear()
+                cached.scanned = 0
+            # the last start is kept, the frames after it decide where the next segment starts
+            find_segment_starts(index, segment_duration, cached.starts, cached.scanned)
+            cached.scanned = index.num_frames
+            segments = build_segments(index, segment_duration, cached.starts)
+            if in_progress:
+                # the end of the last segment is only known when the next independent frame has been written,
+                # the segments of an EVENT playlist must not change
+                segments = segments[:-1]
+            cached.playlist = render_playlist(index, segments, in_progress)
+            cached.key = key
+        return cached.playlist
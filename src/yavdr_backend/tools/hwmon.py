@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Direct reader for the temperature and fan sensors in /sys/class/hwmon.
+
+The sensors are discovered once and their `*_input` files are kept open, a sample
+is a `os.pread` for each sensor. The directory is listed again every `rescan_interval`
+seconds and if a sensor can't be read anymore, so added or removed devices (hotplug)
+are picked up. The values are the same as the ones of `psutil.sensors_temperatures`
+and `psutil.sensors_fans`.
+"""
+import logging
+import os
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+
+HWMON_ROOT = Path("/sys/class/hwmon")
+INPUT_FILE = re.compile(r"^(temp|fan)(\d+)_input$")
+
+
+class Reading(NamedTuple):
+    label: str
+    current: float | None
+    high: float | None
+    critical: float | None
+
+
+class Sensor(NamedTuple):
+    module: str
+    kind: str
+    label: str
+    fd: int
+    # temperatures are reported in millidegree Celsius
+    scale: float
+    high: float | None
+    critical: float | None
+
+
+def read_text(path: Path) -> str | None:
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def read_number(path: Path, scale: float = 1) -> float | None:
+    value = read_text(path)
+    try:
+        return float(value) / scale if value is not None else None
+    except ValueError:
+        return None
+
+
+def natural_key(name: str) -> tuple[str, int]:
+    match = re.match(r"^(\D*)(\d*)", name)
+    assert match is not None
+    return match[1], int(match[2] or 0)
+
+
+class HwmonReader:
+    def __init__(self, root: Path = HWMON_ROOT, rescan_interval: float = 30) -> None:
+        self.root = root
+        self.rescan_interval = rescan_interval
+        self.sensors: list[Sensor] = []
+        self._devices: list[str] | None = None
+        self._checked = 0.0
+        self._lock = Lock()
+
+    def _list_devices(self) -> list[str]:
+        try:
+            return sorted(os.listdir(self.root), key=natural_key)
+        except OSError:
+            return []
+
+    def close(self) -> None:
+        for sensor in self.sensors:
+            os.close(sensor.fd)
+        self.sensors = []
+
+    def scan(self, devices: list[str]) -> None:
+        self.close()
+        for device in devices:
+            directory = self.root / device
+            # some drivers have the attributes in the device directory
+            if not (directory / "name").exists() and (directory / "device" / "name").exists():
+                directory = directory / "device"
+            module = read_text(directory / "name") or device
+            try:
+                files = sorted(os.listdir(directory), key=natural_key)
+            except OSError:
+                continue
+            for name in files:
+                if not (match := INPUT_FILE.match(name)):
+                    continue
+                kind, number = match[1], match[2]
+                scale = 1000 if kind == "temp" else 1
+                try:
+                    fd = os.open(directory / name, os.O_RDONLY)
+                except OSError as err:
+                    logging.debug("could not open %s: %s", directory / name, err)
+                    continue
+                self.sensors.append(Sensor(
+                    module=module,
+                    kind=kind,
+                    label=read_text(directory / f"{kind}{number}_label") or "",
+                    fd=fd,
+                    scale=scale,
+                    high=read_number(directory / f"{kind}{number}_max", scale) if kind == "temp" else None,
+                    critical=read_number(directory / f"{kind}{number}_crit", scale) if kind == "temp" else None,
+                ))
+        self._devices = devices
+
+    def _check_devices(self) -> None:
+        now = time.monotonic()
+        if self._devices is not None and now - self._checked < self.rescan_interval:
+            return
+        self._checked = now
+        devices = self._list_devices()
+        if devices != self._devices:
+            self.scan(devices)
+
+    def read(self, kind: str) -> dict[str, list[Reading]]:
+        """the current values of all sensors of a kind ("temp" or "fan") by module"""
+        with self._lock:
+            self._check_devices()
+            readings: defaultdict[str, list[Reading]] = defaultdict(list)
+            failed = False
+            for sensor in self.sensors:
+                if sensor.kind != kind:
+                    continue
+                try:
+                    current = int(os.pread(sensor.fd, 32, 0)) / sensor.scale
+                except ValueError:
+                    continue
+                except OSError:
+                    # e.g. ENODATA for an unconnected sensor or ENODEV for a removed device
+                    failed = True
+                    continue
+                readings[sensor.module].append(Reading(sensor.label, current, sensor.high, sensor.critical))
+            if failed:
+                # look for removed devices with the next read
+                self._checked = 0.0
+            return dict(readings)
+
+    def temperatures(self) -> dict[str, list[Reading]]:
+        return self.read("temp")
+
+    def fans(self) -> dict[str, list[Reading]]:
+        return self.read("fan")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+Persistent archive of the system history, so the charts continue across restarts.
+
+Each metric group is stored in three files (the group name is percent-encoded, so
+e.g. `process/vdr.service` doesn't need a subdirectory):
+- `<group>.columns`: the names of the columns (JSON)
+- `<group>.log`: an append-only journal with a fixed size record for each column of
+  every completed bucket (10 s, 1 min and 15 min)
+- `<group>.snapshot`: the raw contents of the ring buffers at the last compaction
+
+A compaction writes the ring buffers as a new snapshot and truncates the journal,
+the buffers only hold the retained history, so old buckets are dropped on the way.
+On startup the snapshot is memory-mapped and copied into the ring buffers without
+parsing, only the (short) journal is replayed.
+"""
+import asyncio
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+from array import array
+from pathlib import Path
+from urllib.parse import quote, unquote
+
+from .metrics_store import LEVELS, Level, MetricsStore, SeriesGroup
+
+METRICS_DIR = Path(os.environ.get("YAVDR_METRICS_DIR", "/var/lib/yavdr-webfrontend/metrics"))
+# start time, level, column, min, max, avg
+RECORD = struct.Struct("<dBHfff")
+SNAPSHOT_MAGIC = b"YMS1"
+HEADER_LENGTH = struct.Struct("<I")
+# the raw samples are not archived
+ARCHIVED_LEVELS = [level for level in LEVELS if level.step is not None]
+LEVEL_IDS = {level.resolution: i for i, level in enumerate(LEVELS)}
+
+
+class MetricsArchive:
+    def __init__(self, directory: Path = METRICS_DIR, compact_interval: float = 3600) -> None:
+        self.directory = directory
+        self.compact_interval = compact_interval
+        self.groups: dict[str, SeriesGroup] = {}
+        self._logs: dict[str, int] = {}
+        # the number of columns written to the columns file of each group
+        self._columns: dict[str, int] = {}
+        # the groups which could not be written, so an error is only logged once
+        self._failed: set[str] = set()
+
+    def path(self, group: str, suffix: str) -> Path:
+        return self.directory / f"{quote(group, safe='')}.{suffix}"
+
+    def restore(self, store: MetricsStore) -> None:
+        """create all archived groups in the store, their history is loaded by `attach`"""
+        for path in sorted(self.directory.glob("*.columns")):
+            store.group(unquote(path.stem))
+
+    def attach(self, group: SeriesGroup) -> None:
+        """load the archived history of a group and archive its completed buckets from now on"""
+        try:
+            self.load(group)
+        except (OSError, ValueError) as err:
+            logging.error("could not load the archived history of %s: %s", group.name, err)
+        self.groups[group.name] = group
+        group.on_close = lambda level, ts, mins, maxs, avgs: self.append(group, level, ts, mins, maxs, avgs)
+
+    def load(self, group: SeriesGroup) -> None:
+        try:
+            names: list[str] = json.loads(self.path(group.name, "columns").read_text())
+        except FileNotFoundError:
+            return
+        # the columns of the archive might be in a different order (e.g. a new cpu)
+        index = [group.column_index(name) for name in names]
+        self._columns[group.name] = len(names)
+        self._load_snapshot(group, index)
+        self._replay_log(group, index)
+
+    def _load_snapshot(self, group: SeriesGroup, index: list[int]) -> None:
+        path = self.path(group.name, "snapshot")
+        if not path.exists() or path.stat().st_size == 0:
+            return
+        with path.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            if view[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a metrics snapshot")
+            offset = len(SNAPSHOT_MAGIC)
+            (length,) = HEADER_LENGTH.unpack_from(view, offset)
+            offset += HEADER_LENGTH.size
+            header = json.loads(bytes(view[offset:offset + length]))
+            offset += length
+            columns: int = header["columns"]
+
+            def read(typecode: str, count: int) -> array:
+                nonlocal offset
+                values = array(typecode)
+                values.frombytes(view[offset:offset + count * values.itemsize])
+                offset += count * values.itemsize
+                return values
+
+            for level in ARCHIVED_LEVELS:
+                count = header["levels"].get(level.resolution, 0)
+                ring = group.rings[level.resolution]
+                # keep the newest buckets if the capacity has been reduced
+                skip = max(count - ring.capacity, 0)
+                n = count - skip
+                ring.timestamps[:n] = read("d", count)[skip:]
+                for i in range(columns):
+                    for values in (ring.min, ring.max, ring.avg):
+                        values[index[i]][:n] = read("f", count)[skip:]
+                ring.count = n
+
+    def _replay_log(self, group: SeriesGroup, index: list[int]) -> None:
+        path = self.path(group.name, "log")
+        if not path.exists():
+            return
+        size = path.stat().st_size
+        # a record might be incomplete after a crash
+        size -= size % RECORD.size
+        if size == 0:
+            return
+        rows: dict[int, tuple[float, list[float], list[float], list[float]]] = {}
+        width = len(group.columns)
+
+        def flush(level_id: int) -> None:
+            ts, mins, maxs, avgs = rows.pop(level_id)
+            ring = group.rings[LEVELS[level_id].resolution]
+            if ring.count and ts <= ring.ordered(ring.timestamps)[-1]:
+                # already part of the snapshot
+                return
+            ring.append(ts, mins, maxs, avgs)
+
+        with path.open("rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            for ts, level_id, column, lo, hi, mean in RECORD.iter_unpack(view):
+                if level_id >= len(LEVELS) or column >= len(index):
+                    continue
+                row = rows.get(level_id)
+                if row is not None and row[0] != ts:
+                    flush(level_id)
+                    row = None
+                if row is None:
+                    row = rows[level_id] = (ts, [math.nan] * width, [math.nan] * width, [math.nan] * width)
+                row[1][index[column]] = lo
+                row[2][index[column]] = hi
+                row[3][index[column]] = mean
+        for level_id in list(rows):
+            flush(level_id)
+
+    def _log_fd(self, group: SeriesGroup) -> int:
+        fd = self._logs.get(group.name)
+        if fd is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self.path(group.name, "log")
+            fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            # drop an incomplete record, the journal is read in fixed size records
+            size = os.fstat(fd).st_size
+            if size % RECORD.size:
+                os.ftruncate(fd, size - size % RECORD.size)
+            self._logs[group.name] = fd
+        return fd
+
+    def _write_columns(self, group: SeriesGroup) -> None:
+        if self._columns.get(group.name) == len(group.columns):
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.path(group.name, "columns")
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(group.columns))
+        tmp.replace(path)
+        self._columns[group.name] = len(group.columns)
+
+    def append(self, group: SeriesGroup, level: Level, ts: float, mins: list[float], maxs: list[float], avgs: list[float]) -> None:
+        level_id = LEVEL_IDS[level.resolution]
+        data = b"".join(
+            RECORD.pack(ts, level_id, column, lo, hi, mean)
+            for column, (lo, hi, mean) in enumerate(zip(mins, maxs, avgs))
+            if mean == mean
+        )
+        try:
+            self._write_columns(group)
+            os.write(self._log_fd(group), data)
+        except OSError as err:
+            # e.g. a full disk, don't flood the log
+            if group.name not in self._failed:
+                logging.error("could not archive the history of %s: %s", group.name, err)
+            self._failed.add(group.name)
+        else:
+            self._failed.discard(group.name)
+
+    def compact(self, group: SeriesGroup) -> None:
+        """write the ring buffers as the new snapshot and start a new journal"""
+        header = {"columns": len(group.columns), "levels": {}}
+        chunks: list[bytes] = []
+        for level in ARCHIVED_LEVELS:
+            ring = group.rings[level.resolution]
+            header["levels"][level.resolution] = min(ring.count, ring.capacity)
+            chunks.append(ring.ordered(ring.timestamps).tobytes())
+            for i in range(len(group.columns)):
+                for values in (ring.min, ring.max, ring.avg):
+                    chunks.append(ring.ordered(values[i]).tobytes())
+        header_bytes = json.dumps(header).encode()
+        self._write_columns(group)
+        path = self.path(group.name, "snapshot")
+        tmp = path.with_suffix(".tmp")
+        with tmp.open("wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(HEADER_LENGTH.pack(len(header_bytes)))
+            f.write(header_bytes)
+            f.writelines(chunks)
+            f.flush()
+            os.fsync(f.fileno())
+        tmp.replace(path)
+        os.ftruncate(self._log_fd(group), 0)
+
+    def compact_all(self) -> None:
+        for group in self.groups.values():
+            try:
+                self.compact(group)
+            except OSError as err:
+                logging.error("could not compact the history of %s: %s", group.name, err)
+
+    def close(self) -> None:
+        for fd in self._logs.values():
+            os.close(fd)
+        self._logs.clear()
+
+    async def run_update(self) -> None:
+        """compact the archive regularly and on shutdown"""
+        try:
+            while True:
+                await asyncio.sleep(self.compact_interval)
+                self.compact_all()
+        finally:
+            self.compact_all()
+            self.close()
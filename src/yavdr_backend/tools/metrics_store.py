@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Compact in-memory time series for the system status history.
+
+Related values which are sampled together (e.g. the load of all cpu cores) form a
+`SeriesGroup`. Each group keeps the raw samples in a ring buffer and rolls them up into
+10 s, 1 min and 15 min buckets with min, max and average. All values are stored in
+fixed size `array`s of 32 bit floats, so a week of history only takes a few MB.
+"""
+import bisect
+import math
+from array import array
+from collections.abc import Callable, Iterable, Sequence
+from dataclasses import dataclass
+from enum import StrEnum
+
+from pydantic import BaseModel
+
+NAN = float("nan")
+
+
+class Resolution(StrEnum):
+    raw = "raw"
+    s10 = "10s"
+    min1 = "1min"
+    min15 = "15min"
+
+
+@dataclass(frozen=True)
+class Level:
+    resolution: Resolution
+    # bucket size in seconds, None for the raw samples
+    step: int | None
+    capacity: int
+
+
+LEVELS = (
+    Level(Resolution.raw, None, 600),
+    Level(Resolution.s10, 10, 6 * 360),  # 6 hours
+    Level(Resolution.min1, 60, 2 * 1440),  # 2 days
+    Level(Resolution.min15, 900, 30 * 96),  # 30 days
+)
+
+
+def nan_array(typecode: str, size: int) -> array:
+    return array(typecode, [NAN]) * size
+
+
+class Ring:
+    """the buckets (or samples) of one level, slot i holds the i-th appended bucket modulo the capacity"""
+
+    def __init__(self, level: Level, columns: int) -> None:
+        self.level = level
+        self.capacity = level.capacity
+        self.count = 0
+        self.timestamps = nan_array("d", self.capacity)
+        self.min = [nan_array("f", self.capacity) for _ in range(columns)]
+        self.max = [nan_array("f", self.capacity) for _ in range(columns)]
+        self.avg = [nan_array("f", self.capacity) for _ in range(columns)]
+
+    def add_column(self) -> None:
+        for values in (self.min, self.max, self.avg):
+            values.append(nan_array("f", self.capacity))
+
+    def append(self, ts: float, mins: Sequence[float], maxs: Sequence[float], avgs: Sequence[float]) -> None:
+        slot = self.count % self.capacity
+        self.timestamps[slot] = ts
+        for column, (lo, hi, mean) in enumerate(zip(mins, maxs, avgs)):
+            self.min[column][slot] = lo
+            self.max[column][slot] = hi
+            self.avg[column][slot] = mean
+        self.count += 1
+
+    def ordered(self, values: array) -> array:
+        """the filled slots of an array of this ring in chronological order"""
+        if self.count <= self.capacity:
+            return values[:self.count]
+        slot = self.count % self.capacity
+        return values[slot:] + values[:slot]
+
+    def window(self, start: float, end: float) -> tuple[int, int]:
+        """the range of the chronological positions with start <= timestamp <= end"""
+        timestamps = self.ordered(self.timestamps)
+        return bisect.bisect_left(timestamps, start), bisect.bisect_right(timestamps, end)
+
+
+class Bucket:
+    """the aggregation of the current (incomplete) bucket of a level"""
+
+    def __init__(self, columns: int) -> None:
+        self.id: int | None = None
+        self.reset(columns)
+
+    def reset(self, columns: int) -> None:
+        self.min = [math.inf] * columns
+        self.max = [-math.inf] * columns
+        self.sum = [0.0] * columns
+        self.count = [0] * columns
+
+    def add(self, values: Sequence[float]) -> None:
+        for column, value in enumerate(values):
+            if value != value:  # NaN, the value is missing
+                continue
+            if value < self.min[column]:
+                self.min[column] = value
+            if value > self.max[column]:
+                self.max[column] = value
+            self.sum[column] += value
+            self.count[column] += 1
+
+    def result(self) -> tuple[list[float], list[float], list[float]]:
+        mins, maxs, avgs = [], [], []
+        for lo, hi, total, n in zip(self.min, self.max, self.sum, self.count):
+            mins.append(lo if n else NAN)
+            maxs.append(hi if n else NAN)
+            avgs.append(total / n if n else NAN)
+        return mins, maxs, avgs
+
+
+class ColumnHistory(BaseModel):
+    min: list[float | None]
+    max: list[float | None]
+    avg: list[float | None]
+    # only set if the column has been downsampled
+    timestamps: list[float] | None = None
+
+
+class MetricHistory(BaseModel):
+    group: str
+    resolution: Resolution
+    # the bucket size in seconds (None for raw samples)
+    step: int | None
+    # the start of each bucket (or the time of each sample), empty if the columns
+    # have been downsampled, each column has its own timestamps then
+    timestamps: list[float]
+    columns: dict[str, ColumnHistory]
+
+
+def json_values(values: Iterable[float]) -> list[float | None]:
+    """NaN (missing values) isn't valid JSON"""
+    return [None if v != v else round(v, 3) for v in values]
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], points: int) -> list[int]:
+    """
+    Largest-Triangle-Three-Buckets: select `points` indices which keep the visual shape of
+    the series. Missing (NaN) values are skipped, the first and last values are always kept.
+    """
+    valid = [i for i, y in enumerate(ys) if y == y]
+    if points >= len(valid) or points < 3:
+        return valid if points >= len(valid) else valid[:1] + valid[-1:]
+    selected = [valid[0]]
+    # the points between the first and the last are split into points - 2 buckets
+    size = (len(valid) - 2) / (points - 2)
+    a = valid[0]
+    for b in range(points - 2):
+        start = int(b * size) + 1
+        stop = int((b + 1) * size) + 1
+        # the average of the next bucket is the third corner of the triangle
+        next_bucket = valid[stop:int((b + 2) * size) + 1] or valid[-1:]
+        cx = sum(xs[i] for i in next_bucket) / len(next_bucket)
+        cy = sum(ys[i] for i in next_bucket) / len(next_bucket)
+        ax, ay = xs[a], ys[a]
+        best_area = -1.0
+        for i in valid[start:stop]:
+            area = abs((ax - cx) * (ys[i] - ay) - (ax - xs[i]) * (cy - ay))
+            if area > best_area:
+                best_area, a = area, i
+        selected.append(a)
+    selected.append(valid[-1])
+    return selected
+
+
+def downsample(timestamps: Sequence[float], mins: Sequence[float], maxs: Sequence[float], avgs: Sequence[float], points: int) -> ColumnHistory:
+    """
+    select the points of the averages with LTTB, min and max cover all values up to the
+    next selected point, so peaks don't get lost
+    """
+    selected = lttb(timestamps, avgs, points)
+    bounds = selected[1:] + [len(timestamps)]
+    return ColumnHistory(
+        min=json_values(min((v for v in mins[i:j] if v == v), default=NAN) for i, j in zip(selected, bounds)),
+        max=json_values(max((v for v in maxs[i:j] if v == v), default=NAN) for i, j in zip(selected, bounds)),
+        avg=json_values(avgs[i] for i in selected),
+        timestamps=[timestamps[i] for i in selected],
+    )
+
+
+class SeriesGroup:
+    def __init__(self, name: str, columns: Iterable[str] = ()) -> None:
+        self.name = name
+        self.columns: list[str] = list(columns)
+        self._index = {c: i for i, c in enumerate(self.columns)}
+        self.rings = {level.resolution: Ring(level, len(self.columns)) for level in LEVELS}
+        self.buckets = {level.resolution: Bucket(len(self.columns)) for level in LEVELS if level.step is not None}
+        # called with the level, start time, min, max and average of each completed bucket
+        self.on_close: Callable[[Level, float, list[float], list[float], list[float]], None] | None = None
+
+    def column_index(self, column: str) -> int:
+        if (index := self._index.get(column)) is None:
+            index = self._index[column] = len(self.columns)
+            self.columns.append(column)
+            for ring in self.rings.values():
+                ring.add_column()
+            for bucket in self.buckets.values():
+                bucket.min.append(math.inf)
+                bucket.max.append(-math.inf)
+                bucket.sum.append(0.0)
+                bucket.count.append(0)
+        return index
+
+    def append(self, ts: float, values: dict[str, float] | Sequence[float]) -> None:
+        """add a sample, values are given by column name or in the order of the columns"""
+        if isinstance(values, dict):
+            row = [NAN] * len(self.columns)
+            for column, value in values.items():
+                index = self.column_index(column)
+                if index >= len(row):
+                    row.extend([NAN] * (index + 1 - len(row)))
+                row[index] = value
+        else:
+            row = list(values)
+            for i in range(len(self.columns), len(row)):
+                self.column_index(str(i))
+        self.rings[Resolution.raw].append(ts, row, row, row)
+        for level in LEVELS:
+            if level.step is None:
+                continue
+            bucket = self.buckets[level.resolution]
+            bucket_id = int(ts // level.step)
+            if bucket.id != bucket_id:
+                self._close(level, bucket)
+                bucket.id = bucket_id
+            bucket.add(row)
+
+    def _close(self, level: Level, bucket: Bucket) -> None:
+        if bucket.id is not None and any(bucket.count):
+            ts = bucket.id * level.step
+            result = bucket.result()
+            self.rings[level.resolution].append(ts, *result)
+            if self.on_close is not None:
+                self.on_close(level, ts, *result)
+        bucket.reset(len(self.columns))
+
+    def history(
+        self,
+        resolution: Resolution,
+        start: float,
+        end: float,
+        columns: Iterable[str] | None = None,
+        points: int | None = None,
+    ) -> MetricHistory:
+        """
+        return the values between start and end, if `points` is given each column is
+        downsampled with LTTB to at most this many points and gets its own timestamps
+        """
+        ring = self.rings[resolution]
+        lo, hi = ring.window(start, end)
+        timestamps = ring.ordered(ring.timestamps)[lo:hi]
+        names = [c for c in (columns or self.columns) if c in self._index]
+        current: tuple[list[float], list[float], list[float]] | None = None
+        bucket = self.buckets.get(resolution)
+        # the current bucket is incomplete, but clients want to see the latest values
+        if bucket is not None and bucket.id is not None and any(bucket.count):
+            bucket_ts = bucket.id * ring.level.step
+            if start <= bucket_ts <= end:
+                current = bucket.result()
+                timestamps.append(bucket_ts)
+        column_data: dict[str, ColumnHistory] = {}
+        for name in names:
+            i = self._index[name]
+            mins, maxs, avgs = (ring.ordered(values[i])[lo:hi] for values in (ring.min, ring.max, ring.avg))
+            if current is not None:
+                mins.append(current[0][i])
+                maxs.append(current[1][i])
+                avgs.append(current[2][i])
+            if points is not None and len(timestamps) > points:
+                column_data[name] = downsample(timestamps, mins, maxs, avgs, points)
+            else:
+                column_data[name] = ColumnHistory(min=json_values(mins), max=json_values(maxs), avg=json_values(avgs))
+        return MetricHistory(
+            group=self.name,
+            resolution=resolution,
+            step=ring.level.step,
+            timestamps=[] if points is not None and len(timestamps) > points else timestamps.tolist(),
+            columns=column_data,
+        )
+
+    def column(self, name: str, resolution: Resolution = Resolution.raw) -> tuple[array, array]:
+        """the timestamps and (average) values of a column in chronological order"""
+        ring = self.rings[resolution]
+        return ring.ordered(ring.timestamps), ring.ordered(ring.avg[self._index[name]])
+
+    def memory_size(self) -> int:
+        """the approximate size of the buffers in bytes"""
+        size = 0
+        for ring in self.rings.values():
+            size += ring.timestamps.buffer_info()[1] * ring.timestamps.itemsize
+            for values in (*ring.min, *ring.max, *ring.avg):
+                size += values.buffer_info()[1] * values.itemsize
+        return size
+
+
+class MetricsStore:
+    def __init__(self, on_new_group: Callable[[SeriesGroup], None] | None = None) -> None:
+        self.groups: dict[str, SeriesGroup] = {}
+        # e.g. to restore the history of a group from the archive
+        self.on_new_group = on_new_group
+
+    def group(self, name: str, columns: Iterable[str] = ()) -> SeriesGroup:
+        if (group := self.groups.get(name)) is None:
+            group = self.groups[name] = SeriesGroup(name, columns)
+            if self.on_new_group is not None:
+                self.on_new_group(group)
+        return group
+
+    def append(self, name: str, ts: float, values: dict[str, float] | Sequence[float]) -> None:
+        self.group(name).append(ts, values)
+
+    def memory_size(self) -> int:
+        return sum(group.memory_size() for group in self.groups.values())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Cached mount table and file system usage with timeouts.
+
+The mount table is parsed from /proc/self/mountinfo only if the kernel signals a
+change (the file becomes readable with POLLPRI/POLLERR), so the filtering of the
+mounts happens once per change instead of once per request. `statvfs` runs in a
+thread pool with a timeout: a hanging mount (e.g. NFS) only delays the result by the
+timeout, its last known usage is used until it answers again.
+"""
+import logging
+import os
+import re
+import select
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, NamedTuple
+
+MOUNTINFO = Path("/proc/self/mountinfo")
+PROC_FILESYSTEMS = Path("/proc/filesystems")
+# network file systems are shown as well, they are the reason for the timeouts
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3"}
+OCTAL_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+class Mount(NamedTuple):
+    device: str
+    mountpoint: str
+    fstype: str
+    opts: str
+
+
+class Usage(NamedTuple):
+    total: int
+    used: int
+    free: int
+    percent: float
+
+
+def unescape(value: str) -> str:
+    """spaces, tabs, newlines and backslashes are escaped as octal numbers (e.g. \\040)"""
+    return OCTAL_ESCAPE.sub(lambda m: chr(int(m[1], 8)), value)
+
+
+def parse_mountinfo(text: str) -> list[Mount]:
+    mounts: list[Mount] = []
+    for line in text.splitlines():
+        fields = line.split()
+        try:
+            separator = fields.index("-", 6)
+        except ValueError:
+            continue
+        fstype, source = fields[separator + 1], fields[separator + 2]
+        super_opts = fields[separator + 3] if len(fields) > separator + 3 else ""
+        opts = ",".join(dict.fromkeys(fields[5].split(",") + super_opts.split(",")))
+        mounts.append(Mount(unescape(source), unescape(fields[4]), fstype, opts.strip(",")))
+    return mounts
+
+
+def physical_filesystems(path: Path = PROC_FILESYSTEMS) -> set[str]:
+    """the file systems which need a device (like psutil.disk_partitions(all=False))"""
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return set()
+    return {line.strip() for line in lines if not line.startswith("nodev")} | {"zfs"}
+
+
+def is_shown(mount: Mount, filesystems: set[str]) -> bool:
+    if mount.fstype not in filesystems and mount.fstype not in NETWORK_FILESYSTEMS:
+        return False
+    return not (mount.device.startswith("/dev/loop") or "/home/vdr" in mount.mountpoint or "/snap/" in mount.mountpoint)
+
+
+def usage(mountpoint: str) -> Usage:
+    """the same values as psutil.disk_usage"""
+    st = os.statvfs(mountpoint)
+    total = st.f_blocks * st.f_frsize
+    used = (st.f_blocks - st.f_bfree) * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+    # the reserved blocks are neither used nor free for users
+    total_user = used + free
+    percent = round(used / total_user * 100, 1) if total_user else 0.0
+    return Usage(total, used, free, percent)
+
+
+class MountTable:
+    def __init__(self, path: Path = MOUNTINFO) -> None:
+        self.path = path
+        self._file: BinaryIO | None = None
+        self._poller: select.poll | None = None
+        self._mounts: list[Mount] | None = None
+        self._filesystems = physical_filesystems()
+        self._lock = Lock()
+
+    def _changed(self) -> bool:
+        if self._file is None or self._poller is None:
+            self._file = self.path.open("rb")
+            self._poller = select.poll()
+            self._poller.register(self._file.fileno(), select.POLLPRI | select.POLLERR)
+            return True
+        return bool(self._poller.poll(0))
+
+    def mounts(self) -> list[Mount]:
+        """the mounts which are shown in the status, parsed again if the mount table has changed"""
+        with self._lock:
+            if self._changed() or self._mounts is None:
+                assert self._file is not None
+                # poll reports each change once
+                self._file.seek(0)
+                text = self._file.read().decode(errors="surrogateescape")
+                self._mounts = [m for m in parse_mountinfo(text) if is_shown(m, self._filesystems)]
+            return self._mounts
+
+
+class DiskUsageReader:
+    def __init__(self, table: MountTable | None = None, timeout: float = 2, workers: int = 4) -> None:
+        self.table = table if table is not None else MountTable()
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="statvfs")
+        # statvfs calls which haven't returned yet
+        self._pending: dict[str, Future[Usage]] = {}
+        self._last: dict[str, Usage] = {}
+        self._lock = Lock()
+
+    def read(self) -> list[tuple[Mount, Usage]]:
+        """the usage of all mounts, mounts which have never answered are left out"""
+        mounts = self.table.mounts()
+        with self._lock:
+            futures = {}
+            for mount in mounts:
+                future = self._pending.get(mount.mountpoint)
+                # don't pile up calls for a hanging mount
+                if future is None or future.done():
+                    future = self._pending[mount.mountpoint] = self._executor.submit(usage, mount.mountpoint)
+                futures[mount.mountpoint] = future
+            # forget mounts which are gone
+            for mountpoint in self._pending.keys() - futures.keys():
+                del self._pending[mountpoint]
+                self._last.pop(mountpoint, None)
+        wait(futures.values(), timeout=self.timeout)
+        result: list[tuple[Mount, Usage]] = []
+        for mount in mounts:
+            future = futures[mount.mountpoint]
+            if future.done():
+                try:
+                    self._last[mount.mountpoint] = future.result()
+                except OSError as err:
+                    logging.debug("could not get the usage of %s: %s", mount.mountpoint, err)
+                    self._last.pop(mount.mountpoint, None)
+            else:
+                logging.warning("statvfs of %s takes longer than %s s", mount.mountpoint, self.timeout)
+            if (value := self._last.get(mount.mountpoint)) is not None:
+                result.append((mount, value))
+        return result
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Throughput and error rates of the network interfaces.
+
+The counters in /proc/net/dev are read by the system status collector, the rates are
+the differences to the previous sample. Interfaces are tagged with their wake-on-LAN
+(ACPI wakeup) state from `network_wol`, which is looked up again if the interfaces change.
+"""
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+from .network_wol import ACPIWakeupInfo, get_nic_acpi_wakeup_map
+
+PROC_NET_DEV = Path("/proc/net/dev")
+IGNORED_INTERFACES = {"lo"}
+
+
+class NetCounters(NamedTuple):
+    rx_bytes: int
+    rx_packets: int
+    rx_errors: int
+    rx_dropped: int
+    tx_bytes: int
+    tx_packets: int
+    tx_errors: int
+    tx_dropped: int
+
+
+def parse_net_dev(text: str) -> dict[str, NetCounters]:
+    """parse /proc/net/dev (two header lines, 8 receive and 8 transmit counters per interface)"""
+    counters: dict[str, NetCounters] = {}
+    for line in text.splitlines()[2:]:
+        name, _, values = line.partition(":")
+        fields = values.split()
+        if len(fields) < 16:
+            continue
+        rx, tx = [int(f) for f in fields[:4]], [int(f) for f in fields[8:12]]
+        counters[name.strip()] = NetCounters(*rx, *tx)
+    return counters
+
+
+class InterfaceStats(BaseModel):
+    name: str
+    rx_bytes: int
+    tx_bytes: int
+    # None for the first sample of an interface
+    rx_bytes_per_s: float | None = None
+    tx_bytes_per_s: float | None = None
+    rx_packets_per_s: float | None = None
+    tx_packets_per_s: float | None = None
+    rx_errors_per_s: float | None = None
+    tx_errors_per_s: float | None = None
+    rx_dropped_per_s: float | None = None
+    tx_dropped_per_s: float | None = None
+    wakeup: ACPIWakeupInfo | None = None
+
+
+class NetworkStats:
+    def __init__(self, path: Path = PROC_NET_DEV) -> None:
+        self.path = path
+        self._previous: dict[str, NetCounters] = {}
+        self._timestamp = 0.0
+        self._wakeup: dict[str, ACPIWakeupInfo] = {}
+        self._interfaces: set[str] = set()
+
+    def wakeup_map(self, interfaces: set[str]) -> dict[str, ACPIWakeupInfo]:
+        if interfaces != self._interfaces:
+            self._interfaces = interfaces
+            self._wakeup = get_nic_acpi_wakeup_map()
+        return self._wakeup
+
+    def sample(self) -> list[InterfaceStats]:
+        now = time.monotonic()
+        counters = {
+            name: values for name, values in parse_net_dev(self.path.read_text()).items()
+            if name not in IGNORED_INTERFACES
+        }
+        seconds = now - self._timestamp
+        wakeup = self.wakeup_map(set(counters))
+        result: list[InterfaceStats] = []
+        for name, current in counters.items():
+            stats = InterfaceStats(name=name, rx_bytes=current.rx_bytes, tx_bytes=current.tx_bytes, wakeup=wakeup.get(name))
+            previous = self._previous.get(name)
+            # the counters are reset if a driver is reloaded
+            if previous is not None and seconds > 0 and all(c >= p for c, p in zip(current, previous)):
+                for field, delta in zip(NetCounters._fields, (c - p for c, p in zip(current, previous))):
+                    setattr(stats, f"{field}_per_s", round(delta / seconds, 1))
+            result.append(stats)
+        self._previous, self._timestamp = counters, now
+        return result
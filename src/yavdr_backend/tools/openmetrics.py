@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+A small OpenMetrics (Prometheus) exporter.
+
+Metric families are registered once with a function which returns the current
+samples from state that is kept up to date anyway (e.g. the system status
+collector), so a scrape only formats numbers. The header of each family and the
+label sets are rendered once and reused.
+"""
+import contextlib
+import logging
+import math
+import time
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator
+from enum import StrEnum
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+# the request duration buckets in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Sample = tuple[tuple[str, ...], float]
+
+
+class MetricType(StrEnum):
+    gauge = "gauge"
+    counter = "counter"
+    histogram = "histogram"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+
+class MetricFamily:
+    def __init__(
+        self,
+        name: str,
+        type: MetricType,
+        help: str,
+        labels: Iterable[str] = (),
+        collect: Callable[[], Iterable[Sample]] | None = None,
+        unit: str | None = None,
+    ) -> None:
+        self.name = name
+        self.type = type
+        self.labels = tuple(labels)
+        self.collect = collect
+        header = [f"# TYPE {name} {type}\n", f"# HELP {name} {escape_label(help)}\n"]
+        if unit is not None:
+            header.append(f"# UNIT {name} {unit}\n")
+        self.header = "".join(header)
+        self.sample_name = f"{name}_total" if type == MetricType.counter else name
+        self._label_text: dict[tuple[str, ...], str] = {}
+
+    def label_text(self, values: tuple[str, ...], extra: str = "") -> str:
+        """the rendered label set, e.g. {cpu="cpu0"}"""
+        text = self._label_text.get(values)
+        if text is None:
+            text = ",".join(f'{k}="{escape_label(str(v))}"' for k, v in zip(self.labels, values))
+            self._label_text[values] = text
+        if extra:
+            text = f"{text},{extra}" if text else extra
+        return f"{{{text}}}" if text else ""
+
+    def samples(self) -> Iterable[Sample]:
+        return self.collect() if self.collect is not None else ()
+
+    def render(self, out: list[str]) -> None:
+        lines = [
+            f"{self.sample_name}{self.label_text(values)} {format_value(value)}\n"
+            for values, value in self.samples()
+        ]
+        if lines:
+            out.append(self.header)
+            out.extend(lines)
+
+
+class HistogramChild:
+    def __init__(self, buckets: int) -> None:
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(MetricFamily):
+    """a histogram of durations (e.g. of D-Bus calls) by a label"""
+
+    def __init__(self, name: str, help: str, label: str, buckets: tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        super().__init__(name, MetricType.histogram, help, (label,), unit="seconds")
+        self.buckets = buckets
+        self._bucket_labels = [f'le="{format_value(float(b))}"' for b in buckets] + ['le="+Inf"']
+        self.children: dict[str, HistogramChild] = {}
+
+    def observe(self, label: str, seconds: float) -> None:
+        child = self.children.get(label)
+        if child is None:
+            child = self.children[label] = HistogramChild(len(self.buckets) + 1)
+        child.counts[bisect_left(self.buckets, seconds)] += 1
+        child.sum += seconds
+        child.count += 1
+
+    @contextlib.contextmanager
+    def time(self, label: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label, time.perf_counter() - start)
+
+    def render(self, out: list[str]) -> None:
+        if not self.children:
+            return
+        out.append(self.header)
+        for label, child in self.children.items():
+            cumulative = 0
+            for bucket_label, count in zip(self._bucket_labels, child.counts):
+                cumulative += count
+                out.append(f"{self.name}_bucket{self.label_text((label,), bucket_label)} {cumulative}\n")
+            labels = self.label_text((label,))
+            out.append(f"{self.name}_count{labels} {child.count}\n")
+            out.append(f"{self.name}_sum{labels} {format_value(child.sum)}\n")
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.families: dict[str, MetricFamily] = {}
+
+    def register(self, family: MetricFamily) -> MetricFamily:
+        if family.name in self.families:
+            raise ValueError(f"metric family {family.name} is already registered")
+        self.families[family.name] = family
+        return family
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = (), unit: str | None = None):
+        """decorator to register the collect function of a gauge"""
+        def decorator(collect: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+            self.register(MetricFamily(name, MetricType.gauge, help, labels, collect, unit))
+            return collect
+        return decorator
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = (), unit: str | None = None):
+        """decorator to register the collect function of a counter"""
+        def decorator(collect: Callable[[], Iterable[Sample]]) -> Callable[[], Iterable[Sample]]:
+            self.register(MetricFamily(name, MetricType.counter, help, labels, collect, unit))
+            return collect
+        return decorator
+
+    def render(self) -> bytes:
+        out: list[str] = []
+        for family in self.families.values():
+            try:
+                family.render(out)
+            except Exception as err:
+                logging.debug("could not collect %s: %s", family.name, err)
+        out.append("# EOF\n")
+        return "".join(out).encode()
+
+
+REGISTRY = Registry()
+DBUS_LATENCY = Histogram("yavdr_dbus_request_duration_seconds", "duration of D-Bus calls to VDR", "call")
+SVDRP_LATENCY = Histogram("yavdr_svdrp_command_duration_seconds", "duration of SVDRP commands", "command")
+REGISTRY.register(DBUS_LATENCY)
+REGISTRY.register(SVDRP_LATENCY)
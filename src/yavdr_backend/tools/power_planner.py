@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Shutdown and wake-up planning.
+
+The planner combines the timer schedule, VDR's recording and user activity state
+(de.tvdr.vdr.shutdown) and maintenance windows (e.g. for EPG scans or updates) into
+a `PowerPlan`: whether VDR may be shut down now, the earliest time for a shutdown and
+the next time the system has to be woken up. The plan is calculated when the timers
+or the recording state change and kept in memory, so clients don't have to poll VDR.
+"""
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import time
+from collections.abc import Awaitable, Callable, Iterable, Iterator
+from enum import StrEnum
+from pathlib import Path
+from typing import NamedTuple
+
+import sdbus
+from pydantic import BaseModel, Field
+
+from yavdr_backend.interfaces.vdr_shutdown import DeTvdrVdrShutdownInterface
+from yavdr_backend.interfaces.vdr_status import Recording as RecordingSignal, persistent_signal_generator
+
+from .openmetrics import DBUS_LATENCY
+from .timer_cache import TimerCache
+from .timers import PlannedRecording, local_datetime, split_hhmm
+
+POWER_PLANNER_FILE = Path(
+    os.environ.get("YAVDR_POWER_PLANNER_FILE", "/var/lib/yavdr-webfrontend/power_planner.json")
+)
+# how far ahead recordings and maintenance windows are considered
+PLANNING_DAYS = 7
+
+
+class MaintenanceWindow(BaseModel):
+    name: str
+    # local start time as hhmm
+    start: int
+    duration: int = Field(default=60, gt=0, description="minutes")
+    # Monday is 0, an empty list means every day
+    weekdays: list[int] = Field(default_factory=list)
+
+    def occurrences(self, after: datetime.datetime, until: datetime.datetime) -> Iterator["Busy"]:
+        day = (after - datetime.timedelta(minutes=self.duration)).date()
+        while True:
+            start = local_datetime(day, datetime.time(*split_hhmm(self.start)))
+            if start >= until:
+                return
+            stop = start + datetime.timedelta(minutes=self.duration)
+            if stop > after and (not self.weekdays or day.weekday() in self.weekdays):
+                yield Busy(int(start.timestamp()), int(stop.timestamp()), BusyReason.maintenance, self.name)
+            day += datetime.timedelta(days=1)
+
+
+class PowerSettings(BaseModel):
+    # wake up this many seconds before a recording or maintenance window starts
+    wakeup_lead: int = 300
+    # don't shut down if the system would have to wake up again within this time
+    min_sleep: int = 1800
+    maintenance_windows: list[MaintenanceWindow] = Field(default_factory=list)
+
+
+class BusyReason(StrEnum):
+    recording = "recording"
+    maintenance = "maintenance"
+
+
+class Busy(NamedTuple):
+    start: int
+    stop: int
+    reason: BusyReason
+    name: str
+
+
+class PowerState(StrEnum):
+    recording = "recording"
+    maintenance = "maintenance"
+    user_active = "user_active"
+    idle = "idle"
+    unknown = "unknown"
+
+
+class PowerPlan(BaseModel):
+    timestamp: int
+    state: PowerState
+    user_active: bool | None
+    # running and upcoming activities which keep the system busy
+    busy_until: int | None
+    busy_reason: str | None
+    # the system may be shut down now
+    shutdown_possible: bool
+    # the earliest time for a shutdown (now if the system is idle)
+    shutdown_at: int
+    # the next time the system has to be running (None if there is nothing to do)
+    next_wakeup: int | None
+    next_wakeup_reason: str | None
+    # VDR's own idea of the next wakeup and of the shutdown
+    vdr_next_wakeup: int | None = None
+    vdr_shutdown_message: str | None = None
+
+    def same_plan(self, other: "PowerPlan | None") -> bool:
+        return other is not None and self.model_dump(exclude={"timestamp"}) == other.model_dump(exclude={"timestamp"})
+
+
+def compute_plan(
+    busy: Iterable[Busy],
+    settings: PowerSettings,
+    now: int,
+    user_active: bool | None = None,
+) -> PowerPlan:
+    """
+    find the earliest shutdown: activities starting (minus the wakeup lead) less than `min_sleep`
+    after the end of the previous ones are joined, the first activity after a long enough gap
+    is the next wakeup
+    """
+    shutdown_at = now
+    state = PowerState.idle
+    busy_reason = None
+    next_wakeup = next_wakeup_reason = None
+    for item in sorted(busy):
+        if item.stop <= now:
+            continue
+        if item.start <= now and state == PowerState.idle:
+            state = PowerState.recording if item.reason == BusyReason.recording else PowerState.maintenance
+        if item.start - settings.wakeup_lead < shutdown_at + settings.min_sleep:
+            if item.stop > shutdown_at:
+                shutdown_at = item.stop
+                busy_reason = f"{item.reason}: {item.name}"
+            continue
+        next_wakeup = item.start - settings.wakeup_lead
+        next_wakeup_reason = f"{item.reason}: {item.name}"
+        break
+    if state == PowerState.idle and user_active:
+        state = PowerState.user_active
+    return PowerPlan(
+        timestamp=now,
+        state=state,
+        user_active=user_active,
+        busy_until=shutdown_at if shutdown_at > now else None,
+        busy_reason=busy_reason,
+        # an unknown user state (None) doesn't allow a shutdown
+        shutdown_possible=shutdown_at <= now and user_active is False,
+        shutdown_at=shutdown_at,
+        next_wakeup=next_wakeup,
+        next_wakeup_reason=next_wakeup_reason,
+    )
+
+
+def recordings_busy(recordings: Iterable[PlannedRecording], names: dict[int, str]) -> Iterator[Busy]:
+    for r in recordings:
+        yield Busy(r.start, r.stop, BusyReason.recording, names.get(r.timer_id, str(r.timer_id)))
+
+
+class PowerPlanner:
+    def __init__(self, timer_cache: TimerCache, path: Path = POWER_PLANNER_FILE, interval: float = 60) -> None:
+        self.timer_cache = timer_cache
+        self.path = path
+        self.interval = interval
+        self.settings = self.load()
+        self.plan: PowerPlan | None = None
+        self.on_change: Callable[[PowerPlan], Awaitable[None]] | None = None
+        self._changed = asyncio.Event()
+        timer_cache.on_change.append(self._changed.set)
+
+    def load(self) -> PowerSettings:
+        try:
+            return PowerSettings.model_validate_json(self.path.read_bytes())
+        except FileNotFoundError:
+            return PowerSettings()
+        except ValueError as err:
+            logging.error("could not read the power settings from %s: %s", self.path, err)
+            return PowerSettings()
+
+    def set_settings(self, settings: PowerSettings) -> None:
+        self.settings = settings
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(settings.model_dump_json(indent=2))
+        tmp.replace(self.path)
+        self._changed.set()
+
+    def busy(self, now: datetime.datetime) -> Iterator[Busy]:
+        until = now + datetime.timedelta(days=PLANNING_DAYS)
+        names = {timer_id: d.filename for timer_id, d in self.timer_cache.details.items()}
+        yield from recordings_busy(self.timer_cache.schedule.occurrences(now, until), names)
+        for window in self.settings.maintenance_windows:
+            yield from window.occurrences(now, until)
+        # a recording might run longer than planned (e.g. VPS or an instant recording)
+        ts = int(now.timestamp())
+        for timer_id, details in self.timer_cache.details.items():
+            if details.is_recording and details.stop <= ts:
+                yield Busy(ts, ts + self.interval, BusyReason.recording, names[timer_id])
+
+    async def update(self) -> PowerPlan:
+        await self.timer_cache.ensure_loaded()
+        user_active = vdr_next_wakeup = vdr_message = None
+        try:
+            with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+                shutdown = DeTvdrVdrShutdownInterface.new_proxy("de.tvdr.vdr", "/Shutdown", bus=bus)
+                with DBUS_LATENCY.time("shutdown.state"):
+                    user_active = await shutdown.is_user_active()
+                    vdr_next_wakeup, _ = await shutdown.next_wakeup_time()
+                    _code, vdr_message, *_ = await shutdown.confirm_shutdown(False)
+        except Exception as err:
+            logging.debug("could not get the shutdown state of VDR: %s", err)
+        now = datetime.datetime.now().astimezone()
+        plan = compute_plan(self.busy(now), self.settings, int(now.timestamp()), user_active)
+        if user_active is None and plan.state == PowerState.idle:
+            plan.state = PowerState.unknown
+        plan.vdr_next_wakeup = vdr_next_wakeup or None
+        plan.vdr_shutdown_message = vdr_message
+        previous, self.plan = self.plan, plan
+        if not plan.same_plan(previous) and self.on_change is not None:
+            await self.on_change(plan)
+        return plan
+
+    async def get_plan(self) -> PowerPlan:
+        if self.plan is None or time.time() - self.plan.timestamp > self.interval:
+            return await self.update()
+        return self.plan
+
+    async def _watch_signals(self) -> None:
+        async for status_signal in persistent_signal_generator():
+            if isinstance(status_signal, RecordingSignal):
+                self._changed.set()
+
+    async def run_update(self) -> None:
+        watcher = asyncio.create_task(self._watch_signals())
+        try:
+            while True:
+                try:
+                    await self.update()
+                except Exception as err:
+                    logging.warning("could not update the power plan: %s", err)
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._changed.wait(), self.interval)
+                self._changed.clear()
+        finally:
+            watcher.cancel()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Resource usage of VDR and other services over time.
+
+The main PID of each service is looked up through systemd (org.freedesktop.systemd1),
+the usage is read from /proc: cpu time, RSS, open file descriptors and I/O bytes of
+the process and the cpu time of each thread, so e.g. a busy plugin thread can be told
+apart from VDR's own threads. Rates are calculated from the difference to the last sample.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from pathlib import Path
+from typing import NamedTuple
+
+import sdbus
+from pydantic import BaseModel
+
+from yavdr_backend.interfaces.systemd_dbus_interface import OrgFreedesktopSystemd1ManagerInterface
+from yavdr_backend.interfaces.systemd_unit_interface import OrgFreedesktopSystemd1ServiceInterface
+
+SYSTEMD_DBUS_INTERFACE = "org.freedesktop.systemd1"
+TRACKED_SERVICES = [
+    s.strip() for s in os.environ.get("YAVDR_TRACKED_SERVICES", "vdr.service").split(",") if s.strip()
+]
+PROC = Path("/proc")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class ProcStat(NamedTuple):
+    name: str
+    # utime + stime in clock ticks
+    cpu_ticks: int
+    threads: int
+    # pages
+    rss: int
+
+
+def parse_stat(data: str) -> ProcStat:
+    """parse /proc/<pid>/stat, the name (comm) may contain spaces and parentheses"""
+    start, end = data.index("("), data.rindex(")")
+    fields = data[end + 2:].split()
+    # the fields after the name start with the state (field 3 in proc(5))
+    return ProcStat(
+        name=data[start + 1:end],
+        cpu_ticks=int(fields[11]) + int(fields[12]),
+        threads=int(fields[17]),
+        rss=int(fields[21]),
+    )
+
+
+def read_io(path: Path) -> tuple[int, int] | None:
+    """read_bytes and write_bytes of /proc/<pid>/io (only readable for the owner or root)"""
+    try:
+        values = dict(line.split(": ", 1) for line in path.read_text().splitlines())
+        return int(values["read_bytes"]), int(values["write_bytes"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def count_fds(path: Path) -> int | None:
+    try:
+        return len(os.listdir(path))
+    except OSError:
+        return None
+
+
+class ProcessSample(NamedTuple):
+    timestamp: float
+    stat: ProcStat
+    io: tuple[int, int] | None
+    fds: int | None
+    # tid -> (name, cpu ticks)
+    threads: dict[int, tuple[str, int]]
+
+
+def read_process(pid: int, proc: Path = PROC) -> ProcessSample:
+    """raises OSError if the process doesn't exist (anymore)"""
+    base = proc / str(pid)
+    stat = parse_stat((base / "stat").read_text())
+    threads: dict[int, tuple[str, int]] = {}
+    with contextlib.suppress(OSError):
+        for tid in os.listdir(base / "task"):
+            # threads may end while they are read
+            with contextlib.suppress(OSError, ValueError):
+                thread = parse_stat((base / "task" / tid / "stat").read_text())
+                threads[int(tid)] = (thread.name, thread.cpu_ticks)
+    return ProcessSample(time.time(), stat, read_io(base / "io"), count_fds(base / "fd"), threads)
+
+
+class ProcessStatus(BaseModel):
+    service: str
+    pid: int
+    name: str
+    timestamp: float
+    cpu_percent: float
+    rss: int
+    threads: int
+    fds: int | None
+    read_bytes_per_s: float | None
+    write_bytes_per_s: float | None
+
+
+class ThreadUsage(BaseModel):
+    tid: int
+    name: str
+    cpu_percent: float
+
+
+def cpu_percent(ticks: int, seconds: float) -> float:
+    return round(100 * ticks / CLOCK_TICKS / seconds, 1) if seconds > 0 else 0.0
+
+
+def compare(service: str, pid: int, previous: ProcessSample, current: ProcessSample) -> tuple[ProcessStatus, list[ThreadUsage]]:
+    seconds = current.timestamp - previous.timestamp
+    read_rate = write_rate = None
+    if previous.io is not None and current.io is not None and seconds > 0:
+        read_rate = (current.io[0] - previous.io[0]) / seconds
+        write_rate = (current.io[1] - previous.io[1]) / seconds
+    status = ProcessStatus(
+        service=service,
+        pid=pid,
+        name=current.stat.name,
+        timestamp=current.timestamp,
+        cpu_percent=cpu_percent(current.stat.cpu_ticks - previous.stat.cpu_ticks, seconds),
+        rss=current.stat.rss * PAGE_SIZE,
+        threads=current.stat.threads,
+        fds=current.fds,
+        read_bytes_per_s=read_rate,
+        write_bytes_per_s=write_rate,
+    )
+    # new threads have used all of their cpu time since the last sample
+    threads = [
+        ThreadUsage(tid=tid, name=name, cpu_percent=cpu_percent(ticks - previous.threads.get(tid, (name, 0))[1], seconds))
+        for tid, (name, ticks) in current.threads.items()
+    ]
+    threads.sort(key=lambda t: t.cpu_percent, reverse=True)
+    return status, threads
+
+
+async def service_main_pid(service: str) -> int:
+    """the main PID of a systemd service, 0 if it isn't running"""
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        manager = OrgFreedesktopSystemd1ManagerInterface.new_proxy(
+            SYSTEMD_DBUS_INTERFACE, "/org/freedesktop/systemd1", bus=bus
+        )
+        unit_path = await manager.load_unit(service)
+        unit = OrgFreedesktopSystemd1ServiceInterface.new_proxy(SYSTEMD_DBUS_INTERFACE, unit_path, bus=bus)
+        return await unit.main_pid.get_async()
+
+
+class ProcessTracker:
+    def __init__(self, services: list[str] = TRACKED_SERVICES, interval: float = 5, proc: Path = PROC) -> None:
+        self.services = services
+        self.interval = interval
+        self.proc = proc
+        self.pids: dict[str, int] = {}
+        self.status: dict[str, ProcessStatus] = {}
+        self.threads: dict[str, list[ThreadUsage]] = {}
+        self._samples: dict[str, ProcessSample] = {}
+        # called with the status and the threads of a service after each sample
+        self.on_sample: Callable[[ProcessStatus, list[ThreadUsage]], None] | None = None
+
+    async def resolve(self, service: str) -> int:
+        try:
+            pid = await service_main_pid(service)
+        except Exception as err:
+            logging.debug("could not get the main PID of %s: %s", service, err)
+            pid = 0
+        if pid != self.pids.get(service) or not pid:
+            self.forget(service)
+        self.pids[service] = pid
+        return pid
+
+    def forget(self, service: str) -> None:
+        """drop the samples of a service which has been stopped or restarted"""
+        self._samples.pop(service, None)
+        self.threads.pop(service, None)
+        self.status.pop(service, None)
+
+    def add_sample(self, service: str, pid: int, current: ProcessSample) -> None:
+        previous = self._samples.get(service)
+        self._samples[service] = current
+        if previous is not None:
+            status, threads = compare(service, pid, previous, current)
+            self.status[service], self.threads[service] = status, threads
+            if self.on_sample is not None:
+                self.on_sample(status, threads)
+
+    def top_threads(self, service: str, limit: int = 10) -> list[ThreadUsage]:
+        return self.threads.get(service, [])[:limit]
+
+    async def update(self) -> None:
+        for service in self.services:
+            pid = self.pids.get(service) or await self.resolve(service)
+            if not pid:
+                continue
+            try:
+                current = await asyncio.to_thread(read_process, pid, self.proc)
+            except (OSError, ValueError, IndexError):
+                # the service has been stopped or restarted
+                self.pids[service] = 0
+                self.forget(service)
+                continue
+            self.add_sample(service, pid, current)
+
+    async def run_update(self) -> None:
+        while True:
+            try:
+                await self.update()
+            except Exception as err:
+                logging.warning("could not track the services: %s", err)
+            await asyncio.sleep(self.interval)
+
+
+def thread_columns(threads: list[ThreadUsage]) -> dict[str, float]:
+    """the cpu usage by thread name, threads with the same name are added up"""
+    usage: defaultdict[str, float] = defaultdict(float)
+    for thread in threads:
+        usage[thread.name] += thread.cpu_percent
+    return dict(usage)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+In-memory catalog of VDR's recordings.
+
+The catalog is refreshed from dbus2vdr when VDR signals a started or finished
+recording or replay and keeps a folder tree (recording names are split on "~")
+with aggregated values for each folder, so clients can browse huge archives
+one level at a time.
+"""
+import asyncio
+import contextlib
+import logging
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+import sdbus
+from pydantic import BaseModel
+
+from yavdr_backend.interfaces.vdr_recordings import DeTvdrVdrRecordingInterface
+from yavdr_backend.interfaces.vdr_status import (
+    Recording as RecordingSignal,
+    Replaying as ReplayingSignal,
+    persistent_signal_generator,
+)
+
+from .openmetrics import DBUS_LATENCY
+
+FOLDER_SEPARATOR = "~"
+
+
+class Recording(BaseModel):
+    RecNum: int
+    Path: str
+    Name: str
+    FullName: str | None = None
+    Title: str
+    title: str  # this is either InfoTitle or Name
+    searchTitle: str
+    Start: int
+    Priority: int
+    Lifetime: int
+    HierarchyLevels: int
+    FramesPerSecond: float
+    NumFrames: int
+    LengthInSeconds: int
+    duration: str
+    FileSizeMB: int
+    IsPesRecording: bool
+    IsNew: bool
+    IsEdited: bool
+    InfoChannelID: str | None = None
+    InfoChannelName: str | None = None
+    InfoTitle: str | None = None
+    InfoShortText: str | None = None
+    InfoDescription: str | None = None
+    InfoAux: str | None = None
+    InfoFramesPerSecond: float | None = None
+
+
+def parse_recording(n: int, r: list[tuple[str, Any]]) -> Recording:
+    """build a Recording from an entry of dbus2vdr's recording list"""
+    new_rec: dict[str, Any] = {}
+    for k, v in r:
+        k = k.replace("/", "")
+        if isinstance(v, tuple):  # pyright: ignore[reportUnnecessaryIsInstance]
+            new_rec[k] = v[-1]
+        else:
+            new_rec[k] = v
+    new_rec["RecNum"] = int(n)
+
+    ls = new_rec["LengthInSeconds"]
+    hours = ls // 3600
+    minutes = (ls % 3600) // 60
+    seconds = (ls % 3600) % 60
+    new_rec["duration"] = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    title: str = new_rec.get("InfoTitle", new_rec["Name"])
+
+    subtitle = new_rec.get("InfoShortText")
+    if subtitle:
+        title = f"{title} - {subtitle}"
+
+    new_rec["title"] = title
+    new_rec["searchTitle"] = title.lower()
+    return Recording(**new_rec)
+
+
+async def list_recordings() -> list[Recording]:
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        vdr_recordings = DeTvdrVdrRecordingInterface.new_proxy(
+            "de.tvdr.vdr",
+            "/Recordings",
+            bus=bus,
+        )
+        recordings: list[Recording] = []
+        with DBUS_LATENCY.time("recordings.list"):
+            response = await vdr_recordings.list()
+        for n, r in response:
+            try:
+                recordings.append(parse_recording(n, r))
+            except Exception as err:
+                print("Error:", err)
+        return recordings
+
+
+class RecordingFolderInfo(BaseModel):
+    name: str
+    path: str
+    count: int
+    size_mb: int
+    duration: int
+    new_count: int
+
+
+@dataclass(eq=False)
+class RecordingFolder:
+    name: str
+    path: str
+    parent: "RecordingFolder | None" = None
+    children: dict[str, "RecordingFolder"] = field(default_factory=dict)
+    recordings: dict[str, Recording] = field(default_factory=dict)
+    # aggregated values of this folder and all of its subfolders
+    count: int = 0
+    size_mb: int = 0
+    duration: int = 0
+    new_count: int = 0
+
+    def update_aggregates(self, recording: Recording, sign: int) -> None:
+        folder: RecordingFolder | None = self
+        while folder is not None:
+            folder.count += sign
+            folder.size_mb += sign * recording.FileSizeMB
+            folder.duration += sign * recording.LengthInSeconds
+            folder.new_count += sign * recording.IsNew
+            folder = folder.parent
+
+    def info(self) -> RecordingFolderInfo:
+        return RecordingFolderInfo(
+            name=self.name,
+            path=self.path,
+            count=self.count,
+            size_mb=self.size_mb,
+            duration=self.duration,
+            new_count=self.new_count,
+        )
+
+
+def split_folder_path(path: str) -> list[str]:
+    return [p for p in path.split(FOLDER_SEPARATOR) if p]
+
+
+class RecordingFolderTree:
+    """
+    Folder hierarchy of the recordings, adding or removing a recording only
+    touches the folders on its path.
+    """
+
+    def __init__(self) -> None:
+        self.root = RecordingFolder(name="", path="")
+
+    def get(self, path: str) -> RecordingFolder | None:
+        folder = self.root
+        for part in split_folder_path(path):
+            if (folder := folder.children.get(part)) is None:
+                return None
+        return folder
+
+    def add(self, recording: Recording) -> None:
+        folder = self.root
+        for part in split_folder_path(recording.Name)[:-1]:
+            if (child := folder.children.get(part)) is None:
+                child_path = f"{folder.path}{FOLDER_SEPARATOR}{part}" if folder.path else part
+                child = folder.children[part] = RecordingFolder(name=part, path=child_path, parent=folder)
+            folder = child
+        folder.recordings[recording.Path] = recording
+        folder.update_aggregates(recording, 1)
+
+    def remove(self, recording: Recording) -> None:
+        folder = self.get(FOLDER_SEPARATOR.join(split_folder_path(recording.Name)[:-1]))
+        if folder is None or folder.recordings.pop(recording.Path, None) is None:
+            return
+        folder.update_aggregates(recording, -1)
+        # drop empty folders
+        while folder.parent is not None and not folder.count:
+            del folder.parent.children[folder.name]
+            folder = folder.parent
+
+
+class RecordingTreeLevel(BaseModel):
+    folder: RecordingFolderInfo
+    folders: list[RecordingFolderInfo]
+    recordings: list[Recording]
+
+
+class RecordingCatalog:
+    def __init__(self, refresh_interval: float = 300, debounce: float = 2) -> None:
+        self.recordings: dict[str, Recording] = {}
+        self.tree = RecordingFolderTree()
+        self.refresh_interval = refresh_interval
+        self.debounce = debounce
+        self.loaded = False
+        self.version = 0
+        self._changed = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def apply(self, recordings: Iterable[Recording]) -> bool:
+        """update the catalog with a complete list of recordings, returns True if something has changed"""
+        current = {r.Path: r for r in recordings}
+        changed = False
+        for path in self.recordings.keys() - current.keys():
+            self.tree.remove(self.recordings.pop(path))
+            changed = True
+        for path, recording in current.items():
+            old = self.recordings.get(path)
+            if old == recording:
+                continue
+            if old is not None:
+                self.tree.remove(old)
+            self.tree.add(recording)
+            self.recordings[path] = recording
+            changed = True
+        if changed:
+            self.version += 1
+        return changed
+
+    async def refresh(self) -> None:
+        async with self._lock:
+            self.apply(await list_recordings())
+            self.loaded = True
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.refresh()
+
+    def invalidate(self) -> None:
+        """reload the recordings soon, VDR doesn't signal e.g. deleted recordings"""
+        self._changed.set()
+
+    def level(self, path: str = "") -> RecordingTreeLevel | None:
+        folder = self.tree.get(path)
+        if folder is None:
+            return None
+        return RecordingTreeLevel(
+            folder=folder.info(),
+            folders=[f.info() for f in sorted(folder.children.values(), key=lambda f: f.name.lower())],
+            recordings=sorted(folder.recordings.values(), key=lambda r: r.Start, reverse=True),
+        )
+
+    async def _watch_signals(self) -> None:
+        async for status_signal in persistent_signal_generator():
+            if isinstance(status_signal, (RecordingSignal, ReplayingSignal)):
+                self._changed.set()
+
+    async def run_update(self) -> None:
+        watcher = asyncio.create_task(self._watch_signals())
+        try:
+            while True:
+                try:
+                    await self.refresh()
+                except Exception as err:
+                    logging.warning("could not update the recording catalog: %s", err)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.refresh_interval)
+                    # VDR often sends several signals in a row, so wait a bit before refreshing
+                    await asyncio.sleep(self.debounce)
+                except TimeoutError:
+                    pass
+                self._changed.clear()
+        finally:
+            watcher.cancel()
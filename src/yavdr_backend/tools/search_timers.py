@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Search timers (autotimers).
+
+Saved rules (title regex, genres, channels, time window) are compiled once and matched
+against the EPG. The EPG is read over SVDRP (LSTE), but the rules are only evaluated
+against events which are new or have changed since the last scan (a different version,
+start time or title). VDR can't list only the changed events, so LSTE still returns
+the whole EPG of the channels used by the rules on each scan. New or changed rules are
+evaluated against the whole EPG once, on the next scan. Matches become timers which are
+sent in a single SVDRP session, each one on its own, so a timer which VDR rejects doesn't
+roll back the others. A rejected match is only tried again if its event changes.
+Episodes which have already been recorded or scheduled are skipped using the
+fingerprints of the `DuplicateIndex`, so a series episode is only recorded once.
+"""
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import re
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel, Field
+
+from .async_svdrp import SVDRP
+from .duplicates import DuplicateIndex, fingerprint
+from .timer_batch import BulkTimer, BulkTimerResult, BulkTimerStatus, apply_timers, validate_timers
+from .timer_cache import TimerCache
+
+SEARCH_TIMERS_FILE = Path(
+    os.environ.get("YAVDR_SEARCH_TIMERS_FILE", "/var/lib/yavdr-webfrontend/search_timers.json")
+)
+FOLDER_SEPARATOR = "~"
+
+
+class EpgEvent(NamedTuple):
+    channel_id: str
+    event_id: int
+    start: int
+    duration: int
+    table_id: int
+    version: int
+    title: str = ""
+    short_text: str = ""
+    description: str = ""
+    genres: tuple[int, ...] = ()
+
+    @property
+    def revision(self) -> tuple[int, int, int, str, str]:
+        """changes if VDR has received a different version of the event"""
+        return self.version, self.start, self.duration, self.title, self.short_text
+
+
+def parse_lste(lines: Iterable[str]) -> Iterator[EpgEvent]:
+    """parse the output of LSTE (without the response codes)"""
+    channel_id = ""
+    event: dict | None = None
+    for line in lines:
+        field_type, _, value = line.partition(" ")
+        match field_type:
+            case "C":
+                channel_id = value.split(maxsplit=1)[0]
+            case "c":
+                channel_id = ""
+            case "E":
+                try:
+                    event_id, start, duration, table_id, version, *_ = value.split()
+                    event = {
+                        "channel_id": channel_id,
+                        "event_id": int(event_id),
+                        "start": int(start),
+                        "duration": int(duration),
+                        "table_id": int(table_id, 16),
+                        "version": int(version, 16),
+                    }
+                except ValueError:
+                    event = None
+            case "T" if event is not None:
+                event["title"] = value
+            case "S" if event is not None:
+                event["short_text"] = value
+            case "D" if event is not None:
+                event["description"] = value
+            case "G" if event is not None:
+                with contextlib.suppress(ValueError):
+                    event["genres"] = tuple(int(g, 16) for g in value.split())
+            case "e" if event is not None:
+                yield EpgEvent(**event)
+                event = None
+
+
+class SearchTimerRule(BaseModel):
+    id: int = 0
+    name: str
+    active: bool = True
+    # regular expression, matched case insensitive against the title
+    title_pattern: str
+    search_short_text: bool = False
+    # content nibbles of the EPG, values up to 0xF match the whole group (e.g. 0x1 for all movies)
+    genres: list[int] = Field(default_factory=list)
+    # an empty list matches all channels
+    channel_ids: list[str] = Field(default_factory=list)
+    # local start time of the event as hhmm, windows can cross midnight (e.g. 2000 - 0200)
+    start_after: int | None = None
+    start_before: int | None = None
+    # Monday is 0
+    weekdays: list[int] = Field(default_factory=list)
+    avoid_duplicates: bool = True
+    folder: str = ""
+    # use "title~short text" as file name, so episodes are stored in a folder per series
+    series: bool = False
+    margin_before: int = 2
+    margin_after: int = 10
+    priority: int = 50
+    lifetime: int = 99
+
+
+@dataclass(frozen=True)
+class CompiledRule:
+    rule: SearchTimerRule
+    pattern: re.Pattern[str]
+    channels: frozenset[str]
+    genres: frozenset[int]
+    weekdays: frozenset[int]
+
+    @classmethod
+    def compile(cls, rule: SearchTimerRule) -> "CompiledRule":
+        return cls(
+            rule=rule,
+            pattern=re.compile(rule.title_pattern, re.IGNORECASE),
+            channels=frozenset(rule.channel_ids),
+            genres=frozenset(rule.genres),
+            weekdays=frozenset(rule.weekdays),
+        )
+
+    def matches(self, event: EpgEvent) -> bool:
+        if self.channels and event.channel_id not in self.channels:
+            return False
+        if not (
+            self.pattern.search(event.title)
+            or (self.rule.search_short_text and self.pattern.search(event.short_text))
+        ):
+            return False
+        if self.genres and not any(g in self.genres or g >> 4 in self.genres for g in event.genres):
+            return False
+        if self.weekdays or self.rule.start_after is not None or self.rule.start_before is not None:
+            start = datetime.datetime.fromtimestamp(event.start)
+            if self.weekdays and start.weekday() not in self.weekdays:
+                return False
+            if not self._in_time_window(start.hour * 100 + start.minute):
+                return False
+        return True
+
+    def _in_time_window(self, hhmm: int) -> bool:
+        after, before = self.rule.start_after, self.rule.start_before
+        if after is None and before is None:
+            return True
+        if after is None:
+            return hhmm <= before
+        if before is None:
+            return hhmm >= after
+        if after <= before:
+            return after <= hhmm <= before
+        return hhmm >= after or hhmm <= before
+
+    def timer(self, event: EpgEvent) -> BulkTimer:
+        rule = self.rule
+        start = datetime.datetime.fromtimestamp(event.start).astimezone()
+        parts = [rule.folder, event.title, event.short_text if rule.series else ""]
+        return BulkTimer(
+            channel_id=event.channel_id,
+            dt_start=start - datetime.timedelta(minutes=rule.margin_before),
+            dt_end=start + datetime.timedelta(seconds=event.duration, minutes=rule.margin_after),
+            # VDR uses the tilde as folder separator
+            title=FOLDER_SEPARATOR.join(p.replace(FOLDER_SEPARATOR, "-") for p in parts if p),
+            prio=rule.priority,
+            lifetime=rule.lifetime,
+            aux=f"<searchtimer>{rule.id}</searchtimer>",
+        )
+
+
+class SearchTimerState(BaseModel):
+    rules: list[SearchTimerRule] = Field(default_factory=list)
+    # fingerprints of the episodes scheduled by the search timers
+    done: set[str] = Field(default_factory=set)
+
+
+class SearchTimerMatch(BaseModel):
+    rule_id: int
+    channel_id: str
+    event_id: int
+    start: int
+    title: str
+    short_text: str
+    status: BulkTimerStatus
+    errors: list[str] = []
+
+
+class SearchTimerEngine:
+    def __init__(
+        self,
+        timer_cache: TimerCache,
+        duplicates: DuplicateIndex,
+        path: Path = SEARCH_TIMERS_FILE,
+        interval: float = 600,
+    ) -> None:
+        self.timer_cache = timer_cache
+        self.duplicates = duplicates
+        self.path = path
+        self.interval = interval
+        self.state = SearchTimerState()
+        self.rules: dict[int, CompiledRule] = {}
+        # channel id -> rules, rules without channels are kept under ""
+        self._by_channel: dict[str, list[CompiledRule]] = {}
+        # rules which have to be checked against the whole EPG on the next scan
+        self._pending: set[int] = set()
+        # (channel id, event id) -> revision of the event at the last scan
+        self._seen: dict[tuple[str, int], tuple[int, int, int, str, str]] = {}
+        self.last_matches: list[SearchTimerMatch] = []
+        self._lock = asyncio.Lock()
+        self.load()
+
+    def load(self) -> None:
+        try:
+            self.state = SearchTimerState.model_validate_json(self.path.read_bytes())
+        except FileNotFoundError:
+            self.state = SearchTimerState()
+        except ValueError as err:
+            logging.error("could not read the search timers from %s: %s", self.path, err)
+            self.state = SearchTimerState()
+        self._compile()
+        self._pending = set(self.rules)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(self.state.model_dump_json(indent=2))
+        tmp.replace(self.path)
+
+    def _compile(self) -> None:
+        self.rules = {}
+        self._by_channel = {}
+        for rule in self.state.rules:
+            try:
+                compiled = CompiledRule.compile(rule)
+            except re.error as err:
+                logging.error("invalid pattern in search timer %s: %s", rule.name, err)
+                continue
+            self.rules[rule.id] = compiled
+            if not rule.active:
+                continue
+            for channel_id in compiled.channels or ("",):
+                self._by_channel.setdefault(channel_id, []).append(compiled)
+
+    def set_rule(self, rule: SearchTimerRule) -> SearchTimerRule:
+        """add (id 0) or replace a rule, raises a ValueError for invalid patterns"""
+        try:
+            re.compile(rule.title_pattern)
+        except re.error as err:
+            raise ValueError(f"invalid pattern: {err}") from err
+        if rule.id == 0:
+            # rules with an invalid pattern are stored but not compiled, their ids are taken as well
+            rule = rule.model_copy(update={"id": max((r.id for r in self.state.rules), default=0) + 1})
+        self.state.rules = [r for r in self.state.rules if r.id != rule.id] + [rule]
+        self._compile()
+        self._pending.add(rule.id)
+        self.save()
+        return rule
+
+    def delete_rule(self, rule_id: int) -> bool:
+        if rule_id not in self.rules:
+            return False
+        self.state.rules = [r for r in self.state.rules if r.id != rule_id]
+        self._compile()
+        self._pending.discard(rule_id)
+        self.save()
+        return True
+
+    def candidate_rules(self, channel_id: str) -> list[CompiledRule]:
+        return self._by_channel.get(channel_id, []) + self._by_channel.get("", [])
+
+    def evaluate(self, events: Iterable[EpgEvent], now: float) -> list[tuple[CompiledRule, EpgEvent]]:
+        """match the changed events against all rules and all events against new rules"""
+        pending = [self.rules[rule_id] for rule_id in self._pending if rule_id in self.rules]
+        pending = [r for r in pending if r.rule.active]
+        self._pending.clear()
+        # already recorded, scheduled by another timer or scheduled by an earlier scan
+        self.duplicates.update()
+
+        def is_known(fp: str | None) -> bool:
+            # episodes without a fingerprint are never duplicates
+            return fp is not None and (fp in self.state.done or fp in self.duplicates)
+        matches: list[tuple[CompiledRule, EpgEvent]] = []
+
+        def check(rule: CompiledRule, event: EpgEvent) -> None:
+            if not rule.matches(event):
+                return
+            if rule.rule.avoid_duplicates and is_known(fingerprint(event.title, event.short_text, event.description)):
+                return
+            matches.append((rule, event))
+
+        for event in events:
+            if event.start + event.duration <= now:
+                continue
+            is_changed = self._seen.get((event.channel_id, event.event_id)) != event.revision
+            for rule in pending:
+                check(rule, event)
+            if is_changed:
+                for rule in self.candidate_rules(event.channel_id):
+                    if rule not in pending:
+                        check(rule, event)
+        return matches
+
+    async def read_epg(self, svdrp: SVDRP) -> list[EpgEvent]:
+        """read the EPG of the channels used by the rules (or of all channels)"""
+        if "" in self._by_channel or self._pending:
+            return list(parse_lste(await svdrp.send_cmd("LSTE")))
+        events: list[EpgEvent] = []
+        for channel_id in self._by_channel:
+            events.extend(parse_lste(await svdrp.send_cmd(f"LSTE {channel_id}")))
+        return events
+
+    async def apply_matches(
+        self, matches: list[tuple[CompiledRule, EpgEvent]], svdrp: SVDRP
+    ) -> list[BulkTimerResult]:
+        """
+        create a timer for each match, each timer is applied on its own, so a rejected
+        timer doesn't roll back the others
+        """
+        items = [rule.timer(event) for rule, event in matches]
+        results = validate_timers(items, self.timer_cache.channels, self.timer_cache.schedule.timers)
+        # matches which haven't been sent (e.g. the connection to VDR is lost) are checked again on the next scan
+        for _rule, event in matches:
+            self._seen.pop((event.channel_id, event.event_id), None)
+        for (_rule, event), item, result in zip(matches, items, results):
+            if not result.errors:
+                await apply_timers([item], [result], svdrp)
+            if result.status == BulkTimerStatus.failed:
+                logging.warning("VDR rejected the search timer for %s: %s", event.title, " ".join(result.errors))
+            # invalid and rejected matches are only tried again if the event changes
+            self._seen[(event.channel_id, event.event_id)] = event.revision
+        return results
+
+    async def scan(self) -> list[SearchTimerMatch]:
+        async with self._lock:
+            if not any(r.rule.active for r in self.rules.values()):
+                return []
+            await self.duplicates.catalog.ensure_loaded()
+            await self.timer_cache.ensure_loaded()
+            now = datetime.datetime.now().timestamp()
+            async with SVDRP() as svdrp:
+                events = await self.read_epg(svdrp)
+                matches = self.evaluate(events, now)
+                self._seen = {(e.channel_id, e.event_id): e.revision for e in events}
+
+                # events which already have a timer (e.g. created by an earlier scan)
+                timers = self.timer_cache.schedule.timers
+                scheduled = {(t.channel_id, t.event_id) for t in timers.values()}
+                matches = [(r, e) for r, e in matches if (e.channel_id, e.event_id) not in scheduled]
+                # an episode might be found on several channels, only the first broadcast is recorded
+                unique: dict[str, tuple[CompiledRule, EpgEvent]] = {}
+                for rule, event in sorted(matches, key=lambda m: m[1].start):
+                    key = fingerprint(event.title, event.short_text, event.description) if rule.rule.avoid_duplicates else None
+                    unique.setdefault(key or f"{event.channel_id}/{event.event_id}", (rule, event))
+                matches = list(unique.values())
+                if not matches:
+                    return []
+                results = await self.apply_matches(matches, svdrp)
+
+        self.last_matches = [
+            SearchTimerMatch(
+                rule_id=rule.rule.id,
+                channel_id=event.channel_id,
+                event_id=event.event_id,
+                start=event.start,
+                title=event.title,
+                short_text=event.short_text,
+                status=result.status,
+                errors=result.errors,
+            )
+            for (rule, event), result in zip(matches, results)
+        ]
+        created = [
+            fp
+            for (rule, event), result in zip(matches, results)
+            if result.status == BulkTimerStatus.created and rule.rule.avoid_duplicates
+            and (fp := fingerprint(event.title, event.short_text, event.description)) is not None
+        ]
+        if created:
+            self.state.done.update(created)
+            self.save()
+        if any(r.status == BulkTimerStatus.created for r in results):
+            self.timer_cache.invalidate()
+        return self.last_matches
+
+    async def run_update(self) -> None:
+        while True:
+            try:
+                await self.scan()
+            except Exception as err:
+                logging.warning("could not run the search timers: %s", err)
+            await asyncio.sleep(self.interval)
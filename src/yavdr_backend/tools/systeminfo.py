@@ -1,18 +1,30 @@
 #!/usr/bin/env python3
 import asyncio
+import contextlib
 import datetime
 import logging
 import os
 import platform
 import subprocess
+import time
+from array import array
 from collections import defaultdict, deque
 from collections.abc import Callable
 from typing import Any
 
 import distro
 import psutil
-from pydantic import BaseModel
-
+from pydantic import BaseModel, Field
+
+from .disk_io import DiskIO, DiskIOStats
+from .gpu_sampler import GpuSampler, GpuStats
+from .hwmon import HwmonReader
+from .metrics_archive import MetricsArchive
+from .metrics_store import MetricsStore
+from .mounts import DiskUsageReader, Mount, Usage
+from .network_stats import InterfaceStats, NetworkStats
+from .openmetrics import Registry
+from .process_tracker import ProcessStatus, ProcessTracker, ThreadUsage, thread_columns
 
 cpu_hist: deque[float] = deque(maxlen=100)  # store the last 100 cpu load measurements
 
@@ -62,15 +74,18 @@ class DiskUsageValues(BaseModel):
     opts: str
 
 
+# caches the mount table and calls statvfs with a timeout
+disk_usage_reader = DiskUsageReader()
+
+
 def disk_usage(all: bool=False) -> list[DiskUsageValues]:
-    def build_dict(p) -> DiskUsageValues:
-        usage: dict[str, Any] = psutil.disk_usage(p.mountpoint)._asdict()
+    def build_dict(mount: Mount, values: Usage) -> DiskUsageValues:
+        usage: dict[str, Any] = values._asdict()
         add_human_readable(usage)
-        usage.update(p._asdict())
+        usage.update(mount._asdict())
         return DiskUsageValues(**usage)
 
-    partitions = psutil.disk_partitions(all=False)
-    return [build_dict(p) for p in partitions if not (p.device.startswith("/dev/loop") or "/home/vdr" in p.mountpoint or "/snap/" in p.mountpoint)]
+    return [build_dict(mount, values) for mount, values in disk_usage_reader.read()]
 
 
 class MemoryUsage(BaseModel):
@@ -149,8 +164,7 @@ class Temperatures(BaseModel):
     sensors: dict[str, list[TempValue]]
 
 
-def sensors_temperature() -> Temperatures:
-    temperature_data: defaultdict[str, list[TempValue]] = defaultdict(list)
+def nvidia_temperatures() -> list[TempValue]:
     try:
         p = subprocess.run(
             ["nvidia-smi", "--query-gpu=temperature.gpu", "--format=csv,noheader"],
@@ -160,7 +174,7 @@ def sensors_temperature() -> Temperatures:
         )
         nvidia_temp = p.stdout.strip()
         if nvidia_temp:
-            temperature_data["nvidia"] = [
+            return [
                 TempValue(
                     label= "GPU",
                     current= float(p.stdout.strip()),
@@ -170,8 +184,28 @@ def sensors_temperature() -> Temperatures:
             ]
     except (subprocess.CalledProcessError, IOError) as err:
         logging.debug("could not get nvidia-temperature: %s", err)
-        pass
-    for sensor_module, data in psutil.sensors_temperatures().items():
+    return []
+
+
+def sensors_temperature(gpus: list[GpuStats] | None = None, hwmon: HwmonReader | None = None) -> Temperatures:
+    """
+    gpus: the latest values of the GPU sampler, nvidia-smi is called if they are not given
+    hwmon: read the sensors with the (cached) hwmon reader instead of psutil
+    """
+    temperature_data: defaultdict[str, list[TempValue]] = defaultdict(list)
+    if gpus is None:
+        nvidia = nvidia_temperatures()
+    else:
+        nvidia = [
+            TempValue(label="GPU" if len(gpus) == 1 else f"GPU{gpu.index}", current=gpu.temperature, critical=115, high=80)
+            for gpu in gpus
+            if gpu.temperature is not None
+        ]
+    if nvidia:
+        temperature_data["nvidia"] = nvidia
+    # psutil also knows about /sys/class/thermal if there are no hwmon sensors
+    sensors = (hwmon.temperatures() if hwmon is not None else None) or psutil.sensors_temperatures()
+    for sensor_module, data in sensors.items():
         sensors_seen: set[str] = set()
         for sensor in data:
             if sensor.label not in sensors_seen:
@@ -190,10 +224,11 @@ class Fans(BaseModel):
     sensors: dict[str, list[Fan]]
 
 
-def sensors_fans() -> Fans:
+def sensors_fans(hwmon: HwmonReader | None = None) -> Fans:
     fan_data: dict[str, list[Fan]] = {}
-    for sensor_module, data in psutil.sensors_fans().items():
-        fan_data[sensor_module] = [Fan(** s._asdict()) for s in data]
+    sensors = hwmon.fans() if hwmon is not None else psutil.sensors_fans()
+    for sensor_module, data in sensors.items():
+        fan_data[sensor_module] = [Fan(label=s.label, current=s.current) for s in data]
     # print(fan_data)
     return Fans(sensors=fan_data)
 
@@ -219,15 +254,19 @@ class SystemData(BaseModel):
     cpu_num: int
     # cpu_hist: List[Tuple[float, ...]]
     load_average: LoadAverage
-    disk_usage: list[DiskUsageValues]
+    # the blocking values are empty until their first sample has finished
+    disk_usage: list[DiskUsageValues] = Field(default_factory=list)
     memory_usage: MemoryUsage
     swap_usage: SwapUsage
-    temperatures: Temperatures
-    fans: Fans
+    temperatures: Temperatures = Field(default_factory=lambda: Temperatures(sensors={}))
+    fans: Fans = Field(default_factory=lambda: Fans(sensors={}))
     release: list[str]
     kernel: str
     system_alias: list[str]
     uptime: str
+    # only sampled by the background collector (the rates need a previous sample)
+    network: list[InterfaceStats] = Field(default_factory=list)
+    disk_io: list[DiskIOStats] = Field(default_factory=list)
 
 
 def cpu_usage() -> list[float]:
@@ -259,58 +298,397 @@ def collect_data(include: list[str]=[]) -> SystemData:
     return SystemData(**data)
 
 
+# the interval of the process tracker with and without demand
+PROCESS_INTERVAL = 5
+PROCESS_IDLE_INTERVAL = 30
+# how long a status request waits for the first sample of the blocking values
+FIRST_SAMPLE_TIMEOUT = 3
+
+
+class Metric:
+    """a value of the system status which is sampled in its own interval"""
+
+    def __init__(
+        self,
+        name: str,
+        function: Callable[[], Any],
+        interval: float | None,
+        blocking: bool = False,
+        idle_interval: float | None = None,
+    ) -> None:
+        self.name = name
+        self.function = function
+        # None: the value doesn't change while the system is running
+        self.interval = interval
+        # the interval while nobody is watching
+        self.idle_interval = idle_interval if idle_interval is not None else interval
+        # blocking metrics (subprocesses, many files) are sampled in a thread
+        self.blocking = blocking
+        self.next_due = 0.0
+        # the sample of a blocking metric which is running in a thread
+        self.task: asyncio.Task[None] | None = None
+        # the last sample has failed, requests don't try again before the next interval
+        self.failed = False
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def schedule(self, now: float, active: bool = True) -> None:
+        interval = self.interval if active else self.idle_interval
+        self.next_due = now + interval if interval is not None else float("inf")
+
+
 class SystemStatHistory():
-    # TODO: collect system data continously, so clients can request data without delay
-    #       and the number of requests does not influence the number of data points
-    def __init__(self, hist_len: int=100) -> None:
-        self.cpu_hist: deque[list[float]] = deque(maxlen=hist_len)
-        self.mem_hist: deque[float] = deque(maxlen=hist_len)
-        self.fan_hist: deque[Fans] = deque(maxlen=hist_len)
+    """
+    Collects all values of the system status in the background (each in its own interval),
+    so clients get the latest values without delay and the number of requests does not
+    influence the number of samples or subprocesses.
+
+    The values are sampled in their short intervals only while there is demand (requests
+    of the status or a demand source like connected SSE clients) and for `linger` seconds
+    afterwards, otherwise the collector falls back to the idle intervals.
+    """
+
+    def __init__(self, archive: MetricsArchive | None = None, linger: float = 60) -> None:
+        self.linger = linger
+        # e.g. "are there connected SSE clients?"
+        self.demand_sources: list[Callable[[], bool]] = []
+        self.active = False
+        self._last_demand = -float("inf")
+        self._wake = asyncio.Event()
+        # the history of the numeric values in multiple resolutions, optionally persisted
+        self.archive = archive
+        self.history = MetricsStore(on_new_group=archive.attach if archive is not None else None)
+        if archive is not None:
+            archive.restore(self.history)
+        # a single nvidia-smi process instead of one for each temperature read
+        self.gpu = GpuSampler()
+        self.gpu.on_sample = self.record_gpus
+        # keeps the sensor files open
+        self.hwmon = HwmonReader()
+        self.network = NetworkStats()
+        self.disk_io = DiskIO()
+        # VDR and other services
+        self.processes = ProcessTracker(interval=PROCESS_IDLE_INTERVAL)
+        self.processes.on_sample = self.record_process
         self.current_cpu_data = cpu_usage()
         self.current_memory_data = memory_usage()
         self.current_swap_data = swap_usage()
+        self.metrics: dict[str, Metric] = {
+            m.name: m
+            for m in (
+                Metric("cpu_usage", cpu_usage, 0.5, idle_interval=10),
+                Metric("memory_usage", memory_usage, 1, idle_interval=10),
+                Metric("swap_usage", swap_usage, 5, idle_interval=60),
+                Metric("load_average", load_average, 5, idle_interval=30),
+                Metric("uptime", uptime, 1, idle_interval=60),
+                Metric("network", self.network.sample, 2, idle_interval=10),
+                Metric("disk_io", self.disk_io.sample, 2, idle_interval=10),
+                Metric("disk_usage", disk_usage, 60, blocking=True, idle_interval=300),
+                Metric("temperatures", self.temperatures, 10, blocking=True, idle_interval=60),
+                Metric("fans", self.fans, 10, blocking=True, idle_interval=60),
+                Metric("cpu_num", psutil.cpu_count, None),
+                Metric("release", distro.linux_distribution, None),
+                Metric("kernel", platform.release, None),
+                Metric("system_alias", system_alias, None),
+            )
+        }
+        self.values: dict[str, Any] = {
+            "cpu_usage": self.current_cpu_data,
+            "memory_usage": self.current_memory_data,
+            "swap_usage": self.current_swap_data,
+        }
+        self._snapshot: SystemData | None = None
+
+    def set_value(self, name: str, value: Any) -> None:
+        self.values[name] = value
+        self._snapshot = None
+        match name:
+            case "cpu_usage":
+                self.current_cpu_data = value
+            case "memory_usage":
+                self.current_memory_data = value
+            case "swap_usage":
+                self.current_swap_data = value
+            case "disk_usage":
+                self.disk_io.set_mounts((d.device, d.mountpoint) for d in value)
+        self.record(name, value, time.time())
+
+    def record(self, name: str, value: Any, ts: float) -> None:
+        """add the numeric parts of a value to the history"""
+        match name:
+            case "cpu_usage":
+                cpu = self.history.group("cpu", ["total", *(f"cpu{i}" for i in range(len(value)))])
+                cpu.append(ts, [sum(value) / len(value) if value else float("nan"), *value])
+            case "memory_usage":
+                self.history.append("memory", ts, {k: value[k] for k in ("percent", "used", "available")})
+            case "swap_usage":
+                self.history.append("swap", ts, {k: value[k] for k in ("percent", "used")})
+            case "load_average":
+                self.history.append("load", ts, value.model_dump())
+            case "temperatures":
+                self.history.append("temperatures", ts, {
+                    f"{module}/{sensor.label}": sensor.current
+                    for module, sensors in value.sensors.items()
+                    for sensor in sensors
+                    if sensor.current is not None
+                })
+            case "network":
+                self.history.append("network", ts, {
+                    f"{interface.name}/{field}": rate
+                    for interface in value
+                    for field in ("rx_bytes_per_s", "tx_bytes_per_s", "rx_packets_per_s", "tx_packets_per_s", "rx_errors_per_s", "tx_errors_per_s")
+                    if (rate := getattr(interface, field)) is not None
+                })
+            case "disk_io":
+                self.history.append("disk_io", ts, {
+                    f"{disk.name}/{field}": rate
+                    for disk in value
+                    for field in ("read_iops", "write_iops", "read_bytes_per_s", "write_bytes_per_s", "utilization", "await_ms")
+                    if (rate := getattr(disk, field)) is not None
+                })
+            case "fans":
+                self.history.append("fans", ts, {
+                    f"{module}/{fan.label}": fan.current
+                    for module, fans in value.sensors.items()
+                    for fan in fans
+                    if fan.current is not None
+                })
+
+    def temperatures(self) -> Temperatures:
+        return sensors_temperature(self.gpu.latest() if self.gpu.available else [], self.hwmon)
+
+    def fans(self) -> Fans:
+        return sensors_fans(self.hwmon)
+
+    def record_gpus(self, gpus: list[GpuStats]) -> None:
+        ts = time.time()
+        values: dict[str, float] = {}
+        for gpu in gpus:
+            for field in ("temperature", "utilization", "memory_used"):
+                if (value := getattr(gpu, field)) is not None:
+                    values[f"{gpu.index}/{field}"] = value
+        self.history.append("gpu", ts, values)
+
+    def record_process(self, status: ProcessStatus, threads: list[ThreadUsage]) -> None:
+        self.history.append(f"process/{status.service}", status.timestamp, {
+            "cpu_percent": status.cpu_percent,
+            "rss": status.rss,
+            "threads": status.threads,
+            "fds": status.fds if status.fds is not None else float("nan"),
+            "read_bytes_per_s": status.read_bytes_per_s if status.read_bytes_per_s is not None else float("nan"),
+            "write_bytes_per_s": status.write_bytes_per_s if status.write_bytes_per_s is not None else float("nan"),
+        })
+        self.history.append(f"threads/{status.service}", status.timestamp, thread_columns(threads))
+
+    def sample(self, metric: Metric) -> None:
+        try:
+            self.set_value(metric.name, metric.function())
+        except Exception as err:
+            logging.warning("could not collect %s: %s", metric.name, err)
+            metric.failed = True
+        else:
+            metric.failed = False
+
+    async def _sample_in_thread(self, metric: Metric) -> None:
+        try:
+            value = await asyncio.to_thread(metric.function)
+            self.set_value(metric.name, value)
+        except Exception as err:
+            logging.warning("could not collect %s: %s", metric.name, err)
+            metric.failed = True
+        else:
+            metric.failed = False
+
+    def sample_in_background(self, metric: Metric) -> asyncio.Task[None]:
+        """sample a blocking metric in a thread, a sample which is already running is reused"""
+        if metric.task is None or metric.task.done():
+            metric.task = asyncio.create_task(self._sample_in_thread(metric))
+        return metric.task
+
+    def touch(self) -> None:
+        """a client is watching, sample in the short intervals (again)"""
+        self._last_demand = time.monotonic()
+        if not self.active:
+            self._activate(sample_now=False)
+
+    def has_demand(self, now: float) -> bool:
+        if any(source() for source in self.demand_sources):
+            self._last_demand = now
+        return now - self._last_demand < self.linger
+
+    def _activate(self, sample_now: bool) -> None:
+        """switch to the short intervals, the values which are outdated are sampled right away"""
+        logging.debug("system status: sampling in the short intervals")
+        self.active = True
+        self.processes.interval = PROCESS_INTERVAL
+        now = time.monotonic()
+        for metric in self.metrics.values():
+            if metric.interval is None or metric.running:
+                continue
+            if sample_now and not metric.blocking:
+                self.sample(metric)
+                metric.schedule(now)
+            else:
+                metric.next_due = min(metric.next_due, now)
+        self._wake.set()
+
+    def _deactivate(self) -> None:
+        logging.debug("system status: nobody is watching, sampling in the idle intervals")
+        self.active = False
+        self.processes.interval = PROCESS_IDLE_INTERVAL
 
     async def run_update(self):
-        while True:
-            await asyncio.sleep(.5)
-            self.update_cpu_hist()
-            self.update_ram_hist()
-            self.update_fan_hist()
+        helpers = [
+            asyncio.create_task(self.gpu.run_update()),
+            asyncio.create_task(self.processes.run_update()),
+        ]
+        try:
+            while True:
+                now = time.monotonic()
+                active = self.has_demand(now)
+                if active and not self.active:
+                    self._activate(sample_now=False)
+                elif not active and self.active:
+                    self._deactivate()
+                for metric in self.metrics.values():
+                    if metric.next_due > now or metric.running:
+                        continue
+                    metric.schedule(now, self.active)
+                    if metric.blocking:
+                        self.sample_in_background(metric)
+                    else:
+                        self.sample(metric)
+                next_due = min(m.next_due for m in self.metrics.values())
+                self._wake.clear()
+                with contextlib.suppress(TimeoutError):
+                    await asyncio.wait_for(self._wake.wait(), max(next_due - time.monotonic(), 0.05))
+        finally:
+            for helper in helpers:
+                helper.cancel()
+
+    def register_metrics(self, registry: Registry) -> None:
+        """export the latest values, a scrape never samples"""
+        values = self.values
+
+        @registry.gauge("yavdr_cpu_usage_percent", "cpu usage", ["cpu"])
+        def _cpu():
+            return [((f"cpu{i}",), v) for i, v in enumerate(values.get("cpu_usage", []))]
+
+        @registry.gauge("yavdr_load_average", "system load average", ["period"])
+        def _load():
+            if (load := values.get("load_average")) is None:
+                return []
+            return [(("1m",), load.last_min), (("5m",), load.last_5_min), (("15m",), load.last_10_min)]
+
+        @registry.gauge("yavdr_memory_bytes", "memory usage", ["state"], unit="bytes")
+        def _memory():
+            memory = values.get("memory_usage", {})
+            return [((k,), memory[k]) for k in ("total", "available", "used", "cached") if k in memory]
+
+        @registry.gauge("yavdr_swap_bytes", "swap usage", ["state"], unit="bytes")
+        def _swap():
+            swap = values.get("swap_usage", {})
+            return [((k,), swap[k]) for k in ("total", "used") if k in swap]
+
+        @registry.gauge("yavdr_filesystem_bytes", "file system usage", ["mountpoint", "state"], unit="bytes")
+        def _filesystems():
+            return [
+                ((d.mountpoint, state), getattr(d, state))
+                for d in values.get("disk_usage", [])
+                for state in ("total", "used", "free")
+            ]
+
+        @registry.gauge("yavdr_temperature_celsius", "sensor temperatures", ["module", "sensor"], unit="celsius")
+        def _temperatures():
+            if (temperatures := values.get("temperatures")) is None:
+                return []
+            return [
+                ((module, t.label), t.current)
+                for module, sensors in temperatures.sensors.items()
+                for t in sensors
+                if t.current is not None
+            ]
 
-    def update_cpu_hist(self) -> None:
-        cpu_load = psutil.cpu_percent(percpu=True)
-        self.cpu_hist.append(cpu_load)
+        @registry.gauge("yavdr_fan_rpm", "fan speeds", ["module", "sensor"])
+        def _fans():
+            if (fans := values.get("fans")) is None:
+                return []
+            return [
+                ((module, f.label or ""), f.current)
+                for module, sensors in fans.sensors.items()
+                for f in sensors
+                if f.current is not None
+            ]
+
+        @registry.counter("yavdr_network_bytes", "bytes received and sent", ["interface", "direction"], unit="bytes")
+        def _network():
+            return [
+                sample
+                for i in values.get("network", [])
+                for sample in (((i.name, "rx"), i.rx_bytes), ((i.name, "tx"), i.tx_bytes))
+            ]
 
-    def update_ram_hist(self) -> None:
-        data = memory_usage()
-        self.mem_hist.append(data["percent"])
+        @registry.gauge("yavdr_disk_utilization_percent", "share of the time with I/O in progress", ["device"])
+        def _disk_utilization():
+            return [((d.name,), d.utilization) for d in values.get("disk_io", [])]
+
+        @registry.gauge("yavdr_disk_throughput_bytes_per_second", "block device throughput", ["device", "direction"])
+        def _disk_throughput():
+            return [
+                sample
+                for d in values.get("disk_io", [])
+                for sample in (((d.name, "read"), d.read_bytes_per_s), ((d.name, "write"), d.write_bytes_per_s))
+            ]
 
-    def update_fan_hist(self) -> None:
-        data: Fans = sensors_fans()
-        self.fan_hist.append(data)
+        @registry.gauge("yavdr_gpu_temperature_celsius", "GPU temperature", ["gpu"], unit="celsius")
+        def _gpu():
+            return [((str(g.index),), g.temperature) for g in self.gpu.latest() if g.temperature is not None]
+
+        @registry.gauge("yavdr_process_cpu_percent", "cpu usage of the tracked services", ["service"])
+        def _process_cpu():
+            return [((s.service,), s.cpu_percent) for s in self.processes.status.values()]
+
+        @registry.gauge("yavdr_process_resident_memory_bytes", "RSS of the tracked services", ["service"], unit="bytes")
+        def _process_rss():
+            return [((s.service,), s.rss) for s in self.processes.status.values()]
+
+    async def data(self) -> SystemData:
+        """
+        return the latest values, values which have not been sampled yet are collected now,
+        if the collector has been idle the cheap values are sampled again first.
+        Blocking values are only sampled in a thread: a request waits up to FIRST_SAMPLE_TIMEOUT
+        for their first sample and gets empty values for those which aren't there (yet).
+        """
+        self._last_demand = time.monotonic()
+        if not self.active:
+            self._activate(sample_now=True)
+        snapshot = self._snapshot
+        if snapshot is not None:
+            return snapshot
+        pending: list[asyncio.Task[None]] = []
+        for name, metric in self.metrics.items():
+            # failed values are sampled again by the background task in their interval
+            if name in self.values or metric.failed:
+                continue
+            if metric.blocking:
+                pending.append(self.sample_in_background(metric))
+            else:
+                self.sample(metric)
+        if pending:
+            await asyncio.wait(pending, timeout=FIRST_SAMPLE_TIMEOUT)
+        snapshot = SystemData(**self.values)
+        if self.values.keys() >= self.metrics.keys():
+            self._snapshot = snapshot
+        return snapshot
 
     @property
-    def cpu_history_per_core(self) -> list[list[float]]:
-        return list(map(list, zip(*self.cpu_hist)))
-
-    # def collect_data(self) -> SystemData:
-    #     SystemData(
-    #         cpu_num = psutil.cpu_count()
-    #     )
-    #     self.cpu_history_per_core
-    #         cpu_usage: list[float]
-    #     cpu_num: int
-    #     # cpu_hist: List[Tuple[float, ...]]
-    #     load_average: LoadAverage
-    #     disk_usage: list[DiskUsageValues]
-    #     memory_usage: MemoryUsage
-    #     swap_usage: SwapUsage
-    #     temperatures: Temperatures
-    #     fans: Fans
-    #     release: list[str]
-    #     kernel: str
-    #     system_alias: list[str]
-    #     uptime: str
+    def cpu_history_per_core(self) -> list[array]:
+        """the raw cpu load samples of each core (the store keeps them as columns)"""
+        if (cpu := self.history.groups.get("cpu")) is None:
+            return []
+        return [cpu.column(name)[1] for name in cpu.columns if name != "total"]
 
 
 if __name__ == "__main__":
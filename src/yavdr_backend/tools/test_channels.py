@@ -0,0 +1,33 @@
+import pytest
+
+from .channels import parse_channel_string
+
+
+def test_parse_satellite_channel():
+    channel = parse_channel_string(1, "Das Erste HD;ARD:11494:HC23M5O35P0S1:S19.2E:22000:5101=27:5102=deu@3:5104:0:10301:1:1019:0")
+    assert (channel.name, channel.provider, channel.number) == ("Das Erste HD", "ARD", 1)
+    assert channel.channel_id == "S19.2E-1-1019-10301"
+    # horizontal polarization
+    assert channel.transponder == ("S19.2E", 111494)
+    assert not channel.is_encrypted
+
+
+def test_parse_cable_channel():
+    channel = parse_channel_string(7, "Sky Cinema;Sky:450000:M256:C:6900:255=2:256=deu:0:1702,1833:10:133:4:2")
+    assert channel.channel_id == "C-133-4-10-2"
+    # the frequency is reduced to MHz, there is no polarization
+    assert channel.transponder == ("C", 450)
+    assert channel.is_encrypted
+
+
+def test_channel_id_without_nid_and_tid():
+    channel = parse_channel_string(3, "Local TV:12345:V:S19.2E:27500:101:102:0:0:100:0:0:0")
+    # VDR uses the transponder instead of the TID
+    assert channel.channel_id == "S19.2E-0-212345-100"
+
+
+def test_invalid_lines():
+    with pytest.raises(ValueError):
+        parse_channel_string(0, ":Nachrichten")
+    with pytest.raises(ValueError):
+        parse_channel_string(0, "Broken:abc:H:S19.2E:27500:1:2:0:0:100:1:2:0")
@@ -0,0 +1,74 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from . import disk_forecast
+from .disk_forecast import MB, BitrateModel, BitrateSource
+from .testing import make_recording
+from .timers import PlannedRecording
+
+
+def recording(channel_id, length, size):
+    return make_recording("/srv/vdr/video/Test", "Test", size=size).model_copy(
+        update={"InfoChannelID": channel_id, "LengthInSeconds": length}
+    )
+
+
+RECORDINGS = [
+    recording("S19.2E-1-1019-10301", 3600, 1800),
+    recording("S19.2E-1-1019-10301", 3600, 3600),
+    recording("S19.2E-1-1011-11110", 1800, 3600),
+    # no channel, only used for the average
+    recording(None, 1800, 3600),
+    # too short and empty recordings are ignored
+    recording("S19.2E-1-1011-11110", 60, 1000),
+    recording("S19.2E-1-1011-11110", 3600, 0),
+]
+
+
+def test_bitrate_model():
+    model = BitrateModel(RECORDINGS)
+    assert model.bitrate("S19.2E-1-1019-10301") == (0.75, BitrateSource.channel)
+    assert model.bitrate("S19.2E-1-1011-11110") == (2.0, BitrateSource.channel)
+    assert model.bitrate("S19.2E-1-1079-28006") == (pytest.approx(12600 / 10800), BitrateSource.average)
+    assert BitrateModel([]).bitrate("S19.2E-1-1019-10301") == (
+        disk_forecast.DEFAULT_BITRATE_MB_S, BitrateSource.default
+    )
+
+
+def test_forecast(monkeypatch):
+    monkeypatch.setattr(
+        disk_forecast.shutil, "disk_usage", lambda _path: SimpleNamespace(total=50_000 * MB, free=10_000 * MB)
+    )
+    planned = [
+        PlannedRecording(2, "S19.2E-1-1011-11110", 12_000, 13_800, 50),
+        # already running, only the rest has to fit
+        PlannedRecording(1, "S19.2E-1-1019-10301", 9_000, 13_600, 50),
+        PlannedRecording(3, "S19.2E-1-1079-28006", 20_000, 23_600, 50),
+    ]
+    result = disk_forecast.forecast(
+        planned, BitrateModel(RECORDINGS), Path("/srv/vdr/video"), days=7, now=10_000, reserve_mb=1000
+    )
+    assert [t.timer_id for t in result.timers] == [1, 2, 3]
+    assert [t.estimated_size_mb for t in result.timers] == pytest.approx([2700, 3600, 4200])
+    assert [t.free_mb_after for t in result.timers] == pytest.approx([6300, 2700, -1500])
+    assert result.total_mb == 50_000
+    assert result.free_mb == 9000
+    assert result.required_mb == pytest.approx(10_500)
+    assert result.remaining_mb == pytest.approx(-1500)
+    # the third timer doesn't fit anymore
+    assert result.runs_out_at == 20_000
+    assert result.warning
+
+
+def test_forecast_fits(monkeypatch):
+    monkeypatch.setattr(
+        disk_forecast.shutil, "disk_usage", lambda _path: SimpleNamespace(total=50_000 * MB, free=10_000 * MB)
+    )
+    planned = [PlannedRecording(1, "S19.2E-1-1019-10301", 12_000, 15_600, 50)]
+    result = disk_forecast.forecast(planned, BitrateModel([]), Path("/srv/vdr/video"), days=7, now=10_000)
+    assert result.required_mb == 3600
+    assert result.remaining_mb == 6400
+    assert result.runs_out_at is None
+    assert not result.warning
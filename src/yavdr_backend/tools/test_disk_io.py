@@ -0,0 +1,34 @@
+from .disk_io import DiskIO, parse_diskstats
+
+DISKSTATS = """   7       0 loop0 10 0 100 5 0 0 0 0 0 10 5 0 0 0 0
+   8       0 sda {reads} 0 {sectors} 1000 200 0 4000 {ms_writing} 0 {ms_io} 5000 0 0 0 0
+   8       1 sda1 {reads} 0 {sectors} 1000 200 0 4000 {ms_writing} 0 {ms_io} 5000 0 0 0 0
+   8      16 sdb 0 0 0 0 0 0 0 0 0 0 0 0 0 0 0
+"""
+
+
+def test_parse_diskstats():
+    counters = parse_diskstats(DISKSTATS.format(reads=100, sectors=800, ms_writing=300, ms_io=900))
+    assert list(counters) == ["sda", "sda1", "sdb"]
+    assert counters["sda"].sectors_read == 800
+    assert counters["sda"].ms_doing_io == 900
+
+
+def test_rates(tmp_path):
+    path = tmp_path / "diskstats"
+    path.write_text(DISKSTATS.format(reads=100, sectors=800, ms_writing=300, ms_io=900))
+    disk_io = DiskIO(path)
+    disk_io.set_mounts([(str(tmp_path / "sda1"), "/srv/vdr/video")])
+    assert disk_io.sample() == []
+    disk_io._timestamp -= 2
+    path.write_text(DISKSTATS.format(reads=300, sectors=4896, ms_writing=500, ms_io=1900))
+    stats = {s.name: s for s in disk_io.sample()}
+    assert set(stats) == {"sda", "sda1"}
+    video = stats["sda1"]
+    assert video.mountpoints == ["/srv/vdr/video"]
+    assert 95 < video.read_iops <= 100
+    assert 1_000_000 < video.read_bytes_per_s <= 1_048_576
+    # 1000 ms of I/O in 2 seconds
+    assert 49 < video.utilization <= 50
+    # 200 ms writing for 200 reads
+    assert video.await_ms == 1
@@ -0,0 +1,56 @@
+from . import duplicates
+from .recordings import RecordingCatalog
+from .testing import make_recording, make_timer
+from .timer_cache import TimerCache, TimerEvent
+
+
+def test_fingerprint():
+    assert duplicates.fold("  Café  Größe: Teil-2 ") == "cafe grosse teil 2"
+    assert duplicates.episode_marker("Staffel 3, Folge 12: Die Rückkehr") == "s3e12"
+    assert duplicates.episode_marker("Ein Krimi (4/6)") == "e4"
+    assert duplicates.fingerprint("Tatort", "Borowski und der Schatten") == duplicates.fingerprint(
+        "TATORT", "Borowski und der Schatten!"
+    )
+    # without a subtitle the episode marker of the description is used
+    assert duplicates.fingerprint("Serie", None, "Folge 5. Text") == duplicates.fingerprint("serie", "", "Episode 5")
+    assert duplicates.fingerprint("Serie", None, "Folge 5") != duplicates.fingerprint("Serie", None, "Folge 6")
+    # the episodes of a series without subtitles can't be told apart
+    assert duplicates.fingerprint("Serie", None, "Ein Krimi") is None
+
+
+def timer_details(filename, event=None):
+    cache = TimerCache()
+    cache.schedule.update([make_timer(1, "MTWTFSS", 2015, 2200)._replace(filename=filename)])
+    cache.rebuild()
+    return cache.details[1].model_copy(update={"event": event})
+
+
+def test_timer_fingerprint():
+    assert duplicates.timer_fingerprint(timer_details("Krimis~Tatort~Schatten")) == duplicates.fingerprint("Tatort", "Schatten")
+    # the folder is not taken as the title
+    assert duplicates.timer_fingerprint(timer_details("Krimis~Tatort")) is None
+    assert duplicates.timer_fingerprint(timer_details("Tatort")) is None
+    event = TimerEvent(event_id=1, title="Tatort", short_text="Schatten", start=0, duration=5400)
+    assert duplicates.timer_fingerprint(timer_details("Krimis~Tatort", event)) == duplicates.fingerprint("Tatort", "Schatten")
+
+
+def test_index_and_report():
+    catalog = RecordingCatalog()
+    index = duplicates.DuplicateIndex(catalog, TimerCache())
+    catalog.apply([
+        make_recording("/a", "Tatort", "Schatten", size=3000, start=1),
+        make_recording("/b", "Tatort", "schatten", size=2000, start=2),
+        make_recording("/c", "Tatort", "Licht"),
+        make_recording("/d", "Tagesschau"),
+        make_recording("/e", "Tagesschau"),
+    ])
+    assert index.lookup("tatort", "Schatten").recordings == ["/a", "/b"]
+    assert not index.lookup("Tagesschau").found
+    report = index.report()
+    assert [len(g.recordings) for g in report.groups] == [2]
+    assert (report.size_mb, report.redundant_mb) == (5000, 2000)
+
+    # only the changed recordings are indexed again
+    catalog.apply([make_recording("/a", "Tatort", "Schatten", size=3000, start=1), make_recording("/c", "Tatort", "Licht"), make_recording("/d", "Tagesschau")])
+    assert index.lookup("Tatort", "Schatten").recordings == ["/a"]
+    assert index.report().groups == []
@@ -0,0 +1,64 @@
+import asyncio
+import contextlib
+
+from .gpu_sampler import GpuSampler, GpuStats, parse_line
+
+FAKE_NVIDIA_SMI = """#!/bin/sh
+echo "0, NVIDIA GeForce GT 1030, 41, 3, 250, 2001"
+echo "1, NVIDIA GeForce GT 710, [N/A], [Not Supported], 100, 1024"
+echo "0, NVIDIA GeForce GT 1030, 42, 5, 251, 2001"
+echo "1, NVIDIA GeForce GT 710, 50, 1, 100, 1024"
+exec sleep 10
+"""
+
+
+def fake_command(tmp_path, script):
+    path = tmp_path / "nvidia-smi"
+    path.write_text(script)
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_parse_line():
+    assert parse_line("0, GPU, 41, [N/A], 250, 2001\n") == GpuStats(0, "GPU", 41, None, 250, 2001)
+    assert parse_line("NVIDIA-SMI has failed") is None
+
+
+def test_sampler_reads_the_stream(tmp_path):
+    sampler = GpuSampler(command=fake_command(tmp_path, FAKE_NVIDIA_SMI))
+    samples = []
+    sampler.on_sample = samples.append
+
+    async def run():
+        task = asyncio.create_task(sampler.run_update())
+        while len(samples) < 2:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(asyncio.wait_for(run(), 5))
+    assert [gpu.temperature for gpu in samples[1]] == [42, 50]
+    assert [gpu.index for gpu in sampler.latest()] == [0, 1]
+
+
+def test_sampler_backs_off(tmp_path):
+    sampler = GpuSampler(command=fake_command(tmp_path, "#!/bin/sh\necho 'No devices were found'\nexit 6\n"), backoff=0.01)
+
+    async def run():
+        task = asyncio.create_task(sampler.run_update())
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+    # 0.01 + 0.02 + 0.04 + ... seconds
+    assert 2 <= sampler.failures <= 7
+    assert sampler.latest() == []
+
+
+def test_sampler_stops_without_nvidia_smi(tmp_path):
+    sampler = GpuSampler(command=str(tmp_path / "missing"))
+    asyncio.run(asyncio.wait_for(sampler.run_update(), 5))
+    assert not sampler.available
@@ -0,0 +1,119 @@
+import os
+
+from . import hls
+from .testing import write_index
+from .vdr_index import VdrIndex
+
+
+def make_recording(path, entries, file_sizes, fps=5, age=3600):
+    write_index(path, entries)
+    (path / "info").write_text(f"T Test\nF {fps}\n")
+    for file_number, size in file_sizes.items():
+        (path / f"{file_number:05d}.ts").write_bytes(b"\0" * size)
+    # a finished recording
+    mtime = os.stat(path / "index").st_mtime - age
+    os.utime(path / "index", (mtime, mtime))
+    return VdrIndex(path)
+
+
+def test_segments_start_at_independent_frames(tmp_path):
+    # GOPs of 5 frames (1 s), the second file starts with a new GOP
+    entries = [(1, i * 1000, i % 5 == 0) for i in range(23)] + [(2, i * 1000, i % 5 == 0) for i in range(10)]
+    with make_recording(tmp_path, entries, {1: 23_500, 2: 10_000}) as index:
+        segments = hls.build_segments(index, segment_duration=2)
+    assert segments == [
+        hls.HlsSegment(file_number=1, offset=0, length=10_000, duration=2),
+        hls.HlsSegment(file_number=1, offset=10_000, length=10_000, duration=2),
+        # the rest of the first file, segments never span two files
+        hls.HlsSegment(file_number=1, offset=20_000, length=3_500, duration=0.6),
+        hls.HlsSegment(file_number=2, offset=0, length=10_000, duration=2),
+    ]
+
+
+def test_playlist_of_finished_recording(tmp_path):
+    entries = [(1, i * 1000, i % 5 == 0) for i in range(20)]
+    with make_recording(tmp_path, entries, {1: 20_000}) as index:
+        playlist = hls.get_playlist(index, 2).decode().splitlines()
+    assert "#EXT-X-PLAYLIST-TYPE:VOD" in playlist
+    assert playlist[-1] == "#EXT-X-ENDLIST"
+    assert playlist.count("00001.ts") == 2
+    assert "#EXT-X-BYTERANGE:10000@10000" in playlist
+
+
+def test_playlist_of_running_recording(tmp_path):
+    entries = [(1, i * 1000, i % 5 == 0) for i in range(20)]
+    with make_recording(tmp_path, entries, {1: 20_500}) as index:
+        (tmp_path / hls.TIMER_RECORDING_FILE).write_text("")
+        running = hls.get_playlist(index, 2).decode().splitlines()
+        assert "#EXT-X-PLAYLIST-TYPE:EVENT" in running
+        assert "#EXT-X-ENDLIST" not in running
+        # the last segment is still growing
+        assert running.count("00001.ts") == 1
+
+        # the timer has ended, the index is unchanged
+        (tmp_path / hls.TIMER_RECORDING_FILE).unlink()
+        finished = hls.get_playlist(index, 2).decode().splitlines()
+        assert finished[-1] == "#EXT-X-ENDLIST"
+        assert finished.count("00001.ts") == 2
+
+
+def test_growing_index_is_in_progress(tmp_path):
+    with make_recording(tmp_path, [(1, 0, True)], {1: 1000}, age=0) as index:
+        assert hls.is_in_progress(index)
+        assert not hls.is_in_progress(index, now=index.mtime + hls.INDEX_GROWING_TIMEOUT)
+
+
+def test_playlist_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(hls, "_playlist_cache", {})
+    monkeypatch.setattr(hls, "PLAYLIST_CACHE_SIZE", 2)
+    renders = []
+    render_playlist = hls.render_playlist
+    monkeypatch.setattr(hls, "render_playlist", lambda *args: renders.append(args[0]) or render_playlist(*args))
+    indexes = []
+    for name in "abc":
+        (tmp_path / name).mkdir()
+        indexes.append(make_recording(tmp_path / name, [(1, 0, True)], {1: 1000}))
+    a, b, c = indexes
+
+    assert hls.get_playlist(a) == hls.get_playlist(a)
+    hls.get_playlist(b)
+    # a has been used most recently, so b is evicted
+    hls.get_playlist(a)
+    hls.get_playlist(c)
+    assert len(renders) == 3
+    hls.get_playlist(a)
+    assert len(renders) == 3
+    hls.get_playlist(b)
+    assert renders == [a, b, c, b]
+
+    # a changed index replaces the cached playlist of the recording
+    make_recording(tmp_path / "a", [(1, 0, True), (1, 500, False)], {1: 1000}, age=1800)
+    a2 = VdrIndex(tmp_path / "a")
+    hls.get_playlist(a2)
+    assert [key[0].name for key in hls._playlist_cache] == ["b", "a"]
+    for index in indexes + [a2]:
+        index.close()
+
+
+def test_growing_recording_is_indexed_incrementally(tmp_path, monkeypatch):
+    monkeypatch.setattr(hls, "_playlist_cache", {})
+    gop = [(1, i * 1000, i % 5 == 0) for i in range(20)]
+    with make_recording(tmp_path, gop, {1: 20_000}, age=0) as index:
+        first = hls.get_playlist(index, 2).decode().splitlines()
+    assert "#EXT-X-ENDLIST" not in first
+
+    first_frames = []
+    independent_frames = VdrIndex.independent_frames
+
+    def spy(self, start=0):
+        first_frames.append(start)
+        return independent_frames(self, start)
+
+    monkeypatch.setattr(VdrIndex, "independent_frames", spy)
+    grown = gop + [(1, 20_000 + i * 1000, i % 5 == 0) for i in range(20)]
+    with make_recording(tmp_path, grown, {1: 40_000}, age=0) as index:
+        playlist = hls.get_playlist(index, 2)
+        # only the new frames are read
+        assert first_frames == [20]
+        full = hls.render_playlist(index, hls.build_segments(index, 2)[:-1], in_progress=True)
+    assert playlist == full
@@ -0,0 +1,36 @@
+from .hwmon import HwmonReader, Reading
+
+
+def make_device(root, device, name, files):
+    directory = root / device
+    directory.mkdir()
+    (directory / "name").write_text(f"{name}\n")
+    for filename, value in files.items():
+        (directory / filename).write_text(f"{value}\n")
+
+
+def test_reads_sensors(tmp_path):
+    make_device(tmp_path, "hwmon0", "coretemp", {
+        "temp1_input": 45000, "temp1_label": "Package id 0", "temp1_max": 80000, "temp1_crit": 100000,
+        "temp2_input": 43500,
+    })
+    make_device(tmp_path, "hwmon1", "nct6775", {"fan2_input": 800, "fan10_input": 1200})
+    reader = HwmonReader(tmp_path)
+    assert reader.temperatures() == {
+        "coretemp": [Reading("Package id 0", 45, 80, 100), Reading("", 43.5, None, None)],
+    }
+    assert [r.current for r in reader.fans()["nct6775"]] == [800, 1200]
+
+    # the files stay open and are read again
+    (tmp_path / "hwmon0" / "temp2_input").write_text("50000\n")
+    assert reader.temperatures()["coretemp"][1].current == 50
+    reader.close()
+
+
+def test_rescan_on_hotplug(tmp_path):
+    make_device(tmp_path, "hwmon0", "coretemp", {"temp1_input": 45000})
+    reader = HwmonReader(tmp_path, rescan_interval=0)
+    assert list(reader.temperatures()) == ["coretemp"]
+    make_device(tmp_path, "hwmon1", "drivetemp", {"temp1_input": 30000})
+    assert list(reader.temperatures()) == ["coretemp", "drivetemp"]
+    reader.close()
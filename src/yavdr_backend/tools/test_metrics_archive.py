@@ -0,0 +1,70 @@
+import math
+
+from .metrics_archive import RECORD, MetricsArchive
+from .metrics_store import MetricsStore, Resolution
+
+
+def fill(store, start, stop):
+    for ts in range(start, stop, 5):
+        store.append("cpu", ts, {"total": ts % 100, "cpu0": 1.0})
+
+
+def test_history_survives_restart(tmp_path):
+    archive = MetricsArchive(tmp_path)
+    store = MetricsStore(on_new_group=archive.attach)
+    fill(store, 0, 3600)
+    archive.compact_all()
+    # these buckets are only in the journal
+    fill(store, 3600, 4000)
+    expected = store.groups["cpu"].history(Resolution.s10, 0, 3985)
+    archive.close()
+
+    # a crash in the middle of a record
+    with (tmp_path / "cpu.log").open("ab") as f:
+        f.write(b"\0" * (RECORD.size // 2))
+
+    archive = MetricsArchive(tmp_path)
+    store = MetricsStore(on_new_group=archive.attach)
+    archive.restore(store)
+    restored = store.groups["cpu"].history(Resolution.s10, 0, 3985)
+    assert restored.timestamps == expected.timestamps
+    assert restored.columns == expected.columns
+    assert len(store.groups["cpu"].history(Resolution.min1, 0, math.inf).timestamps) == 66
+
+    # appending continues after the restored buckets
+    fill(store, 4000, 4100)
+    assert store.groups["cpu"].history(Resolution.s10, 0, math.inf).timestamps[-1] == 4095 // 10 * 10
+    archive.close()
+
+
+def test_group_names_with_slashes(tmp_path, caplog):
+    archive = MetricsArchive(tmp_path)
+    store = MetricsStore(on_new_group=archive.attach)
+    for ts in range(0, 700, 5):
+        store.append("process/vdr.service", ts, {"cpu": 1.0})
+        store.append("threads/vdr.service", ts, {"vdr": 2.0})
+    archive.compact_all()
+    archive.close()
+    assert {p.name for p in tmp_path.iterdir()} >= {"process%2Fvdr.service.columns", "threads%2Fvdr.service.log"}
+    assert "could not" not in caplog.text
+
+    archive = MetricsArchive(tmp_path)
+    store = MetricsStore(on_new_group=archive.attach)
+    archive.restore(store)
+    assert sorted(store.groups) == ["process/vdr.service", "threads/vdr.service"]
+    history = store.groups["process/vdr.service"].history(Resolution.min1, 0, math.inf)
+    assert history.columns["cpu"].avg == [1.0] * 11
+    archive.close()
+
+
+def test_failures_are_logged_once_per_group(tmp_path, caplog):
+    archive = MetricsArchive(tmp_path)
+    store = MetricsStore(on_new_group=archive.attach)
+    # a directory in the way of the journal
+    (tmp_path / "disk.log").mkdir()
+    for ts in range(0, 100, 5):
+        store.append("disk", ts, {"used": 1.0})
+        store.append("cpu", ts, {"total": 1.0})
+    archive.close()
+    assert caplog.text.count("could not archive the history of disk") == 1
+    assert "of cpu" not in caplog.text
@@ -0,0 +1,65 @@
+import math
+
+from . import metrics_store
+from .metrics_store import LEVELS, MetricsStore, Resolution, SeriesGroup
+
+
+def test_rollups():
+    group = SeriesGroup("cpu", ["total"])
+    for i in range(120):
+        group.append(1000 * 60 + i * 0.5, [float(i % 20)])
+    history = group.history(Resolution.s10, 0, math.inf)
+    # 6 complete buckets and the current one
+    assert history.step == 10
+    assert len(history.timestamps) == 6
+    assert history.timestamps[0] == 60000
+    total = history.columns["total"]
+    assert total.min[0] == 0 and total.max[0] == 19 and total.avg[0] == 9.5
+
+    minutes = group.history(Resolution.min1, 0, math.inf)
+    assert minutes.timestamps == [60000]
+    assert minutes.columns["total"].max == [19]
+
+
+def test_ring_buffer_wraps():
+    group = SeriesGroup("load")
+    raw = LEVELS[0]
+    for i in range(raw.capacity + 10):
+        group.append(i, {"last_min": i})
+    history = group.history(Resolution.raw, 0, math.inf)
+    assert len(history.timestamps) == raw.capacity
+    assert history.timestamps[0] == 10
+    assert history.columns["last_min"].avg[-1] == raw.capacity + 9
+
+
+def test_new_columns_are_missing_before():
+    store = MetricsStore()
+    store.append("fans", 0, {"a": 1})
+    store.append("fans", 1, {"a": 2, "b": 3})
+    history = store.groups["fans"].history(Resolution.raw, 0, math.inf, ["b"])
+    assert history.columns["b"].avg == [None, 3]
+    # about 100 kB per column for 30 days of history
+    assert store.memory_size() < 300_000
+
+
+def test_lttb_keeps_peaks():
+    xs = [float(i) for i in range(1000)]
+    ys = [0.0] * 1000
+    ys[500] = 100.0
+    ys[10] = float("nan")
+    selected = metrics_store.lttb(xs, ys, 20)
+    assert len(selected) == 20
+    assert selected[0] == 0 and selected[-1] == 999
+    assert 500 in selected and 10 not in selected
+
+
+def test_downsampled_history():
+    group = SeriesGroup("cpu", ["total", "cpu0"])
+    for i in range(500):
+        group.append(i, [1.0, 50.0 if i == 101 else 1.0])
+    history = group.history(Resolution.raw, 0, math.inf, points=50)
+    assert history.timestamps == []
+    cpu0 = history.columns["cpu0"]
+    assert len(cpu0.timestamps) == len(cpu0.avg) == 50
+    assert max(cpu0.max) == 50 and 101 in cpu0.timestamps
+    assert len(group.history(Resolution.raw, 0, math.inf, points=1000).timestamps) == 500
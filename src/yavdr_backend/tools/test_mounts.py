@@ -0,0 +1,51 @@
+import threading
+
+from . import mounts
+from .mounts import DiskUsageReader, Mount, MountTable, Usage, is_shown, parse_mountinfo
+
+MOUNTINFO = """\
+22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw,errors=remount-ro
+30 22 0:25 / /srv/vdr/video\\040nas rw,relatime shared:7 - nfs4 nas:/video rw,vers=4.2
+31 22 7:0 / /snap/core/1 ro,nodev shared:9 - squashfs /dev/loop0 ro
+32 22 0:5 / /proc rw,nosuid shared:12 - proc proc rw
+"""
+
+
+def test_parse_mountinfo():
+    root, nas, snap, proc = parse_mountinfo(MOUNTINFO)
+    assert root == Mount("/dev/sda1", "/", "ext4", "rw,relatime,errors=remount-ro")
+    assert nas.mountpoint == "/srv/vdr/video nas"
+    filesystems = {"ext4", "squashfs"}
+    assert [m.mountpoint for m in (root, nas, snap, proc) if is_shown(m, filesystems)] == ["/", "/srv/vdr/video nas"]
+
+
+def test_mount_table_is_cached():
+    table = MountTable()
+    first = table.mounts()
+    assert table.mounts() is first
+
+
+class FakeTable:
+    def mounts(self):
+        return [Mount("/dev/sda1", "/", "ext4", "rw"), Mount("nas:/video", "/hanging", "nfs4", "rw")]
+
+
+def test_hanging_mount(monkeypatch):
+    release = threading.Event()
+    calls = []
+
+    def fake_usage(mountpoint):
+        calls.append(mountpoint)
+        if mountpoint == "/hanging":
+            release.wait(5)
+        return Usage(100, 40, 60, 40.0)
+
+    monkeypatch.setattr(mounts, "usage", fake_usage)
+    reader = DiskUsageReader(FakeTable(), timeout=0.1)
+    assert [m.mountpoint for m, _ in reader.read()] == ["/"]
+    assert [m.mountpoint for m, _ in reader.read()] == ["/"]
+    # the hanging call isn't repeated
+    assert calls.count("/hanging") == 1
+    release.set()
+    reader._pending["/hanging"].result()
+    assert [m.mountpoint for m, _ in reader.read()] == ["/", "/hanging"]
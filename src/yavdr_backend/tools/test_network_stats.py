@@ -0,0 +1,30 @@
+from . import network_stats
+from .network_stats import NetworkStats, parse_net_dev
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: {lo} 10 0 0 0 0 0 0 {lo} 10 0 0 0 0 0 0
+  eth0: {rx} 1000 {errs} 0 0 0 0 5 {tx} 800 0 0 0 0 0 0
+"""
+
+
+def test_parse_net_dev():
+    counters = parse_net_dev(NET_DEV.format(lo=1, rx=2000, tx=3000, errs=1))
+    assert counters["eth0"].rx_bytes == 2000
+    assert counters["eth0"].tx_bytes == 3000
+    assert counters["eth0"].rx_errors == 1
+
+
+def test_rates(tmp_path, monkeypatch):
+    monkeypatch.setattr(network_stats, "get_nic_acpi_wakeup_map", lambda: {})
+    path = tmp_path / "dev"
+    path.write_text(NET_DEV.format(lo=1, rx=2000, tx=3000, errs=0))
+    stats = NetworkStats(path)
+    (first,) = stats.sample()
+    assert first.name == "eth0" and first.rx_bytes_per_s is None
+    stats._timestamp -= 2
+    path.write_text(NET_DEV.format(lo=1, rx=6000, tx=3000, errs=4))
+    (second,) = stats.sample()
+    assert 1900 < second.rx_bytes_per_s <= 2000
+    assert second.tx_bytes_per_s == 0
+    assert second.rx_errors_per_s > 0
@@ -0,0 +1,57 @@
+import time
+
+from .openmetrics import Histogram, Registry
+
+
+def test_render():
+    registry = Registry()
+    temperatures = {"coretemp": 45.5}
+
+    @registry.gauge("yavdr_temperature_celsius", "sensor temperatures", ["sensor"], unit="celsius")
+    def _temperatures():
+        return [((name,), value) for name, value in temperatures.items()]
+
+    @registry.counter("yavdr_network_bytes", "bytes received", ["interface"], unit="bytes")
+    def _network():
+        return [(('eth"0',), 1024)]
+
+    @registry.gauge("yavdr_empty", "no samples")
+    def _empty():
+        return []
+
+    latency = registry.register(Histogram("yavdr_dbus_request_duration_seconds", "D-Bus calls", "call", (0.01, 0.1)))
+    latency.observe("timers.list", 0.005)
+    latency.observe("timers.list", 0.05)
+    latency.observe("timers.list", 5)
+
+    assert registry.render().decode() == (
+        "# TYPE yavdr_temperature_celsius gauge\n"
+        "# HELP yavdr_temperature_celsius sensor temperatures\n"
+        "# UNIT yavdr_temperature_celsius celsius\n"
+        'yavdr_temperature_celsius{sensor="coretemp"} 45.5\n'
+        "# TYPE yavdr_network_bytes counter\n"
+        "# HELP yavdr_network_bytes bytes received\n"
+        "# UNIT yavdr_network_bytes bytes\n"
+        'yavdr_network_bytes_total{interface="eth\\"0"} 1024\n'
+        "# TYPE yavdr_dbus_request_duration_seconds histogram\n"
+        "# HELP yavdr_dbus_request_duration_seconds D-Bus calls\n"
+        "# UNIT yavdr_dbus_request_duration_seconds seconds\n"
+        'yavdr_dbus_request_duration_seconds_bucket{call="timers.list",le="0.01"} 1\n'
+        'yavdr_dbus_request_duration_seconds_bucket{call="timers.list",le="0.1"} 2\n'
+        'yavdr_dbus_request_duration_seconds_bucket{call="timers.list",le="+Inf"} 3\n'
+        'yavdr_dbus_request_duration_seconds_count{call="timers.list"} 3\n'
+        'yavdr_dbus_request_duration_seconds_sum{call="timers.list"} 5.055\n'
+        "# EOF\n"
+    )
+
+
+def test_render_is_fast():
+    registry = Registry()
+    for n in range(20):
+        registry.gauge(f"yavdr_metric_{n}", "a metric", ["label"])(lambda: [((f"value{i}",), i * 0.5) for i in range(10)])
+    registry.render()
+    start = time.perf_counter()
+    for _ in range(10):
+        registry.render()
+    # usually well below a millisecond
+    assert (time.perf_counter() - start) / 10 < 0.005
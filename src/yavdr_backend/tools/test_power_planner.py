@@ -0,0 +1,44 @@
+import datetime
+
+from . import power_planner
+from .power_planner import Busy, BusyReason, PowerSettings, PowerState
+
+NOW = 1_000_000
+SETTINGS = PowerSettings(wakeup_lead=300, min_sleep=1800)
+
+
+def recording(start, stop, name="rec"):
+    return Busy(NOW + start, NOW + stop, BusyReason.recording, name)
+
+
+def test_idle_system_wakes_up_for_next_recording():
+    plan = power_planner.compute_plan([recording(7200, 9000)], SETTINGS, NOW, user_active=False)
+    assert plan.state == PowerState.idle
+    assert plan.shutdown_possible
+    assert plan.next_wakeup == NOW + 7200 - 300
+
+
+def test_short_gaps_are_bridged():
+    busy = [recording(-600, 600, "a"), recording(1200, 3000, "b"), recording(9000, 10000, "c")]
+    plan = power_planner.compute_plan(busy, SETTINGS, NOW, user_active=True)
+    assert plan.state == PowerState.recording
+    assert not plan.shutdown_possible
+    # the gap between a and b is too short for a shutdown
+    assert plan.shutdown_at == NOW + 3000
+    assert plan.busy_reason == "recording: b"
+    assert plan.next_wakeup == NOW + 9000 - 300
+
+
+def test_maintenance_window(berlin_time):
+    window = power_planner.MaintenanceWindow(name="EPG scan", start=300, duration=60, weekdays=[6])
+    after = datetime.datetime(2025, 3, 27).astimezone()
+    # Sunday, the clocks are set forward at 02:00
+    (busy,) = window.occurrences(after, after + datetime.timedelta(days=7))
+    start = datetime.datetime.fromtimestamp(busy.start)
+    assert (start.day, start.hour) == (30, 3)
+    assert busy.stop - busy.start == 3600
+
+
+def test_unknown_user_state_prevents_shutdown():
+    plan = power_planner.compute_plan([recording(7200, 9000)], SETTINGS, NOW, user_active=None)
+    assert not plan.shutdown_possible
@@ -0,0 +1,68 @@
+import asyncio
+
+from . import process_tracker
+from .process_tracker import CLOCK_TICKS, ProcessTracker, parse_stat, read_process, thread_columns
+
+STAT = "1234 (vdr (main)) S 1 1234 1234 0 -1 4194560 100 0 0 0 {utime} {stime} 0 0 20 0 {threads} 0 500 900000000 {rss} 18446744073709551615"
+
+
+def write_stat(path, name, utime, stime=0, threads=1, rss=1000):
+    path.mkdir(parents=True, exist_ok=True)
+    stat = STAT.format(utime=utime, stime=stime, threads=threads, rss=rss).replace("vdr (main)", name)
+    (path / "stat").write_text(stat)
+
+
+def test_parse_stat():
+    stat = parse_stat(STAT.format(utime=10, stime=5, threads=3, rss=2000))
+    assert stat.name == "vdr (main)"
+    assert (stat.cpu_ticks, stat.threads, stat.rss) == (15, 3, 2000)
+
+
+def test_top_threads(tmp_path):
+    base = tmp_path / "1234"
+    write_stat(base, "vdr", 100, 50, threads=2)
+    write_stat(base / "task" / "1234", "vdr", 90, 50)
+    write_stat(base / "task" / "1240", "device 1 receiver", 10)
+    (base / "io").write_text("rchar: 1\nread_bytes: 4096\nwrite_bytes: 0\n")
+    (base / "fd").mkdir()
+    tracker = ProcessTracker(["vdr.service"], proc=tmp_path)
+    first = read_process(1234, tmp_path)
+    tracker.add_sample("vdr.service", 1234, first)
+
+    write_stat(base, "vdr", 300, 50, threads=2)
+    write_stat(base / "task" / "1240", "device 1 receiver", 200)
+    (base / "io").write_text("rchar: 1\nread_bytes: 8192\nwrite_bytes: 0\n")
+    second = read_process(1234, tmp_path)._replace(timestamp=first.timestamp + 2)
+    tracker.add_sample("vdr.service", 1234, second)
+
+    status = tracker.status["vdr.service"]
+    # 200 ticks in 2 seconds
+    assert status.cpu_percent == round(100 * 200 / CLOCK_TICKS / 2, 1)
+    assert status.read_bytes_per_s == 2048
+    top = tracker.top_threads("vdr.service", 1)
+    assert [t.name for t in top] == ["device 1 receiver"]
+    assert thread_columns(tracker.threads["vdr.service"])["vdr"] == 0
+
+
+def test_stopped_service_is_forgotten(tmp_path, monkeypatch):
+    pids = {"vdr.service": 1234}
+
+    async def main_pid(service):
+        return pids[service]
+
+    monkeypatch.setattr(process_tracker, "service_main_pid", main_pid)
+    write_stat(tmp_path / "1234", "vdr", 100)
+    tracker = ProcessTracker(["vdr.service"], proc=tmp_path)
+    asyncio.run(tracker.update())
+    write_stat(tmp_path / "1234", "vdr", 200)
+    asyncio.run(tracker.update())
+    assert tracker.status["vdr.service"].pid == 1234
+
+    # the process has ended and systemd reports no main PID
+    (tmp_path / "1234" / "stat").unlink()
+    pids["vdr.service"] = 0
+    asyncio.run(tracker.update())
+    assert "vdr.service" not in tracker.status
+    assert tracker.top_threads("vdr.service") == []
+    asyncio.run(tracker.update())
+    assert "vdr.service" not in tracker.status
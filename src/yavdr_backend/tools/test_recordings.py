@@ -0,0 +1,104 @@
+import asyncio
+
+from . import recordings
+from .recordings import RecordingCatalog, parse_recording
+from .testing import make_recording
+
+
+def dbus_recording(name, **info):
+    fields = [
+        ("Path", ("s", f"/srv/vdr/video/{name.replace('~', '/')}/2025-01-01.20.15.1-0.rec")),
+        ("Name", ("s", name)), ("Title", ("s", name)), ("Start", ("x", 1735758900)), ("Priority", ("i", 50)),
+        ("Lifetime", ("i", 99)), ("HierarchyLevels", ("i", name.count("~"))), ("FramesPerSecond", ("d", 25.0)),
+        ("NumFrames", ("i", 135000)), ("LengthInSeconds", ("i", 5400 + 62)), ("FileSizeMB", ("i", 2500)),
+        ("IsPesRecording", ("b", False)), ("IsNew", ("b", True)), ("IsEdited", ("b", False)),
+    ]
+    fields += [(f"Info/{key}", ("s", value)) for key, value in info.items()]
+    return fields
+
+
+def test_parse_recording():
+    recording = parse_recording(7, dbus_recording("Krimis~Tatort", Title="Tatort", ShortText="Schatten", ChannelName="Das Erste HD"))
+    assert recording.RecNum == 7
+    assert recording.InfoTitle == "Tatort"
+    assert recording.InfoChannelName == "Das Erste HD"
+    assert recording.title == "Tatort - Schatten"
+    assert recording.searchTitle == "tatort - schatten"
+    assert recording.duration == "01:31:02"
+    # without info the name is the title
+    assert parse_recording(8, dbus_recording("Tagesschau")).title == "Tagesschau"
+
+
+def recording(name, size=1000, length=3600, is_new=False, start=0):
+    r = make_recording(f"/{name}", name, size=size, start=start)
+    return r.model_copy(update={"LengthInSeconds": length, "IsNew": is_new})
+
+
+def test_folder_aggregates():
+    catalog = RecordingCatalog()
+    assert catalog.apply([
+        recording("Krimis~Tatort~Schatten", size=3000, is_new=True, start=2),
+        recording("Krimis~Tatort~Licht", size=2000, start=1),
+        recording("Krimis~Polizeiruf", size=1000, length=5400),
+        recording("Tagesschau", size=500, length=900, is_new=True),
+    ])
+    root = catalog.level()
+    assert (root.folder.count, root.folder.size_mb, root.folder.duration, root.folder.new_count) == (4, 6500, 13500, 2)
+    assert [f.name for f in root.folders] == ["Krimis"]
+    assert [r.Name for r in root.recordings] == ["Tagesschau"]
+    krimis = catalog.level("Krimis")
+    assert (krimis.folder.count, krimis.folder.size_mb, krimis.folder.new_count) == (3, 6000, 1)
+    tatort = catalog.level("Krimis~Tatort")
+    assert tatort.folder.path == "Krimis~Tatort"
+    # newest first
+    assert [r.Name for r in tatort.recordings] == ["Krimis~Tatort~Schatten", "Krimis~Tatort~Licht"]
+
+    # a changed recording only updates the folders on its path
+    version = catalog.version
+    assert catalog.apply([
+        recording("Krimis~Tatort~Schatten", size=3000, start=2),
+        recording("Krimis~Polizeiruf", size=1000, length=5400),
+        recording("Tagesschau", size=500, length=900, is_new=True),
+    ])
+    assert catalog.version == version + 1
+    assert catalog.level("Krimis").folder.new_count == 0
+    assert catalog.level("Krimis~Tatort").folder.size_mb == 3000
+    assert catalog.level().folder.size_mb == 4500
+    assert not catalog.apply(list(catalog.recordings.values()))
+
+    # empty folders are removed
+    catalog.apply([recording("Tagesschau", size=500, length=900)])
+    assert catalog.level("Krimis~Tatort") is None
+    assert catalog.level().folders == []
+    assert catalog.level().folder.count == 1
+
+
+def test_invalidate_reloads_the_catalog(monkeypatch):
+    current = [recording("Krimis~Tatort"), recording("Tagesschau")]
+
+    async def list_recordings():
+        return list(current)
+
+    async def no_signals():
+        await asyncio.Event().wait()
+        yield
+
+    monkeypatch.setattr(recordings, "list_recordings", list_recordings)
+    monkeypatch.setattr(recordings, "persistent_signal_generator", no_signals)
+
+    async def run():
+        catalog = RecordingCatalog(refresh_interval=3600, debounce=0)
+        updater = asyncio.create_task(catalog.run_update())
+        while not catalog.loaded:
+            await asyncio.sleep(0)
+        assert catalog.level().folder.count == 2
+        # the recording has been deleted
+        del current[0]
+        catalog.invalidate()
+        async with asyncio.timeout(1):
+            while catalog.level().folder.count != 1:
+                await asyncio.sleep(0)
+        assert catalog.level().folders == []
+        updater.cancel()
+
+    asyncio.run(run())
@@ -0,0 +1,102 @@
+import asyncio
+
+from . import search_timers
+from .channels import parse_channel_string
+from .duplicates import DuplicateIndex
+from .recordings import RecordingCatalog
+from .timer_cache import TimerCache
+
+LSTE = """C S19.2E-1-1019-10301 Das Erste HD
+E 1001 1893528900 2700 4E 5
+T Tatort
+S Episode 1
+G 10 11
+X 5 0B deu
+e
+E 1002 1893531600 1800 4E 3
+T Tagesthemen
+e
+c
+C S19.2E-1-1019-10302 arte HD
+E 2001 1893528900 2700 4E 1
+T Tatort
+S Episode 1
+e
+c
+End of EPG data""".splitlines()
+
+
+def test_parse_lste():
+    events = list(search_timers.parse_lste(LSTE))
+    assert [(e.channel_id, e.event_id) for e in events] == [
+        ("S19.2E-1-1019-10301", 1001),
+        ("S19.2E-1-1019-10301", 1002),
+        ("S19.2E-1-1019-10302", 2001),
+    ]
+    assert events[0].short_text == "Episode 1"
+    assert events[0].genres == (0x10, 0x11)
+    assert events[0].version == 5
+
+
+def test_rules_are_evaluated_incrementally(tmp_path):
+    duplicates = DuplicateIndex(RecordingCatalog(), TimerCache())
+    engine = search_timers.SearchTimerEngine(duplicates.timer_cache, duplicates, tmp_path / "search_timers.json")
+    engine.set_rule(search_timers.SearchTimerRule(name="Tatort", title_pattern="^tatort$", genres=[0x1]))
+    events = list(search_timers.parse_lste(LSTE))
+    # the new rule is checked against all events
+    assert [e.event_id for _, e in engine.evaluate(events, now=0)] == [1001]
+    engine._seen = {(e.channel_id, e.event_id): e.revision for e in events}
+    # nothing has changed
+    assert engine.evaluate(events, now=0) == []
+    # a new version of the event is evaluated again
+    events[0] = events[0]._replace(version=6)
+    assert [e.event_id for _, e in engine.evaluate(events, now=0)] == [1001]
+    # episodes which have been recorded before are skipped
+    engine.state.done.add(search_timers.fingerprint("TATORT", " episode  1!"))
+    assert engine.evaluate(events, now=0) == []
+
+
+def test_new_rules_dont_reuse_ids_of_invalid_rules(tmp_path):
+    path = tmp_path / "search_timers.json"
+    broken = search_timers.SearchTimerRule(id=3, name="Broken", title_pattern="(")
+    path.write_text(search_timers.SearchTimerState(rules=[broken]).model_dump_json())
+    engine = search_timers.SearchTimerEngine(TimerCache(), DuplicateIndex(RecordingCatalog(), TimerCache()), path)
+    assert engine.rules == {}
+    rule = engine.set_rule(search_timers.SearchTimerRule(name="Tatort", title_pattern="tatort"))
+    assert rule.id == 4
+    assert [r.name for r in engine.state.rules] == ["Broken", "Tatort"]
+
+
+class RejectingSVDRP:
+    def __init__(self, reject: str) -> None:
+        self.reject = reject
+        self.commands: list[str] = []
+
+    async def send_cmd_with_code(self, cmd: str) -> tuple[int, list[str]]:
+        self.commands.append(cmd)
+        if self.reject in cmd:
+            return 550, ["Timer already defined"]
+        return 250, [f"{len(self.commands)} {cmd[5:]}"]
+
+
+def test_rejected_matches_dont_roll_back_the_others(tmp_path):
+    duplicates = DuplicateIndex(RecordingCatalog(), TimerCache())
+    channels = [
+        parse_channel_string(1, "Das Erste HD;ARD:11494:HC23M5O35P0S1:S19.2E:22000:5101=27:5102=deu@3:5104:0:10301:1:1019:0"),
+        parse_channel_string(2, "arte HD;ARTE:10744:HC23M5O25P0S1:S19.2E:22000:6210=27:6221=deu@3:6230:0:10302:1:1019:0"),
+    ]
+    duplicates.timer_cache.channels = {c.channel_id: c for c in channels}
+    engine = search_timers.SearchTimerEngine(duplicates.timer_cache, duplicates, tmp_path / "search_timers.json")
+    engine.set_rule(search_timers.SearchTimerRule(name="All", title_pattern=".", avoid_duplicates=False))
+    engine._pending.clear()
+    rule = engine.rules[1]
+    events = list(search_timers.parse_lste(LSTE))
+    matches = [(rule, event) for event in events]
+    svdrp = RejectingSVDRP(reject="Tagesthemen")
+    results = asyncio.run(engine.apply_matches(matches, svdrp))
+    assert [r.status for r in results] == ["created", "failed", "created"]
+    assert not any(cmd.startswith("DELT") for cmd in svdrp.commands)
+    # the rejected match isn't tried again until its event changes
+    assert engine.evaluate(events, now=0) == []
+    events[1] = events[1]._replace(version=4)
+    assert [e.event_id for _, e in engine.evaluate(events, now=0)] == [1002]
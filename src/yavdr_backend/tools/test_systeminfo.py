@@ -0,0 +1,84 @@
+import asyncio
+import threading
+import time
+
+from . import systeminfo
+from .systeminfo import Fans, Metric, SystemStatHistory
+
+
+def test_metric_intervals():
+    metric = Metric("cpu_usage", lambda: [], 0.5, idle_interval=10)
+    metric.schedule(100)
+    assert metric.next_due == 100.5
+    metric.schedule(100, active=False)
+    assert metric.next_due == 110
+    static = Metric("kernel", lambda: "", None)
+    static.schedule(100, active=False)
+    assert static.next_due == float("inf")
+
+
+def test_demand():
+    collector = SystemStatHistory(linger=60)
+    now = time.monotonic()
+    assert not collector.active
+    assert not collector.has_demand(now)
+    clients = []
+    collector.demand_sources.append(lambda: bool(clients))
+    clients.append("client")
+    assert collector.has_demand(now)
+    clients.clear()
+    # hysteresis: still active shortly after the last client has gone
+    assert collector.has_demand(now + 30)
+    assert not collector.has_demand(now + 61)
+
+
+def test_status_request_samples_right_away():
+    collector = SystemStatHistory()
+    cpu = collector.metrics["cpu_usage"]
+    cpu.schedule(time.monotonic(), active=False)
+    collector.metrics["temperatures"].schedule(time.monotonic(), active=False)
+    collector.values.pop("cpu_usage")
+    asyncio.run(collector.data())
+    assert collector.active
+    assert "cpu_usage" in collector.values
+    assert cpu.next_due <= time.monotonic() + cpu.interval
+    # blocking metrics are sampled by the background task right away
+    assert collector.metrics["temperatures"].next_due <= time.monotonic()
+
+
+def test_blocking_values_are_not_sampled_on_the_event_loop(monkeypatch):
+    monkeypatch.setattr(systeminfo, "FIRST_SAMPLE_TIMEOUT", 0.2)
+    collector = SystemStatHistory()
+    hanging = threading.Event()
+    calls = []
+
+    def disk_usage():
+        # e.g. a dead NFS mount
+        calls.append(threading.current_thread())
+        hanging.wait(5)
+        return []
+
+    def fans():
+        calls.append(threading.current_thread())
+        raise OSError("no fans")
+
+    collector.metrics["disk_usage"].function = disk_usage
+    collector.metrics["fans"].function = fans
+    collector.metrics["temperatures"].function = lambda: systeminfo.Temperatures(sensors={"cpu": []})
+
+    async def run():
+        started = time.monotonic()
+        status = await collector.data()
+        assert time.monotonic() - started < 1
+        # the values which aren't there are empty
+        assert status.disk_usage == []
+        assert status.fans == Fans(sensors={})
+        assert list(status.temperatures.sensors) == ["cpu"]
+        # the running sample is reused and the failed one isn't retried
+        await collector.data()
+        assert len(calls) == 2
+        assert threading.main_thread() not in calls
+        hanging.set()
+        await collector.metrics["disk_usage"].task
+
+    asyncio.run(run())
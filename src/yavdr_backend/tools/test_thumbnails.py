@@ -0,0 +1,92 @@
+import asyncio
+import contextlib
+import os
+from pathlib import Path
+
+import pytest
+
+from . import thumbnails
+from .thumbnails import ThumbnailCache, ThumbnailFormat, ThumbnailRequest, ThumbnailService
+
+
+def request(frame):
+    return ThumbnailRequest(Path("/srv/vdr/video/Test"), frame, 320, ThumbnailFormat.jpeg, False)
+
+
+def test_cache_removes_least_recently_used(tmp_path):
+    cache = ThumbnailCache(tmp_path, max_size=25)
+    asyncio.run(cache.scan())
+    first = cache.put(request(1), b"1" * 10)
+    cache.put(request(2), b"2" * 10)
+    # the first thumbnail is used again, so the second one is the oldest
+    assert cache.get(request(1)) == first
+    cache.put(request(3), b"3" * 10)
+    assert cache.get(request(2)) is None
+    assert not cache.path(request(2)).exists()
+    assert cache.get(request(1)) == first
+    assert cache.size == 20
+
+    # the order is restored from the modification times
+    os.utime(cache.path(request(3)), (1, 1))
+    cache = ThumbnailCache(tmp_path, max_size=25)
+    asyncio.run(cache.scan())
+    assert cache.size == 20
+    cache.put(request(4), b"4" * 10)
+    assert cache.get(request(3)) is None
+    assert cache.get(request(1)) is not None
+
+
+class FakeRenderer(ThumbnailService):
+    def __init__(self, cache):
+        super().__init__(cache, workers=1)
+        self.available = True
+        self.rendered = []
+        self.release = asyncio.Event()
+
+    async def _render(self, request):
+        self.rendered.append(request.frame)
+        await self.release.wait()
+        return self.cache.put(request, b"image")
+
+
+def test_visible_thumbnails_first(tmp_path):
+    async def run():
+        service = FakeRenderer(ThumbnailCache(tmp_path))
+        for frame in range(3):
+            service.prefetch(request(frame))
+        # the user scrolled to this thumbnail
+        visible = asyncio.create_task(service.get(request(2)))
+        worker = asyncio.create_task(service.worker())
+        await asyncio.sleep(0)
+        assert service.rendered == [2]
+        # requests while the thumbnail is rendered wait for the same result
+        again = asyncio.create_task(service.get(request(2)))
+        await asyncio.sleep(0)
+        service.release.set()
+        assert await visible == await again == service.cache.path(request(2))
+        while len(service.rendered) < 3:
+            await asyncio.sleep(0)
+        worker.cancel()
+        assert service.rendered == [2, 0, 1]
+        assert not service.pending
+
+    asyncio.run(run())
+
+
+def test_failed_thumbnails(tmp_path, monkeypatch):
+    def broken_gop(_index, _frame):
+        raise OSError("no such file")
+
+    monkeypatch.setattr(thumbnails, "open_index", lambda *args, **kwargs: contextlib.nullcontext())
+    monkeypatch.setattr(thumbnails, "read_gop", broken_gop)
+
+    async def run():
+        service = ThumbnailService(ThumbnailCache(tmp_path), workers=1)
+        service.available = True
+        worker = asyncio.create_task(service.worker())
+        with pytest.raises(thumbnails.ThumbnailError, match="no such file"):
+            await service.get(request(1))
+        worker.cancel()
+        assert not service.pending
+
+    asyncio.run(run())
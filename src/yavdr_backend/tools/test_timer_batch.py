@@ -0,0 +1,93 @@
+import asyncio
+import datetime
+
+from . import timer_batch
+from .channels import parse_channel_string
+from .testing import make_timer
+
+CHANNELS = {
+    c.channel_id: c
+    for c in [parse_channel_string(1, "Das Erste HD;ARD:450000:M256:C:6900:5101=27:5102=deu@3:5104;5105=deu@106:0:10301:1:1101:0")]
+}
+
+
+class FakeSVDRP:
+    def __init__(self, fail_on: str) -> None:
+        self.fail_on = fail_on
+        self.commands: list[str] = []
+        self.next_id = 10
+
+    async def send_cmd_with_code(self, cmd: str) -> tuple[int, list[str]]:
+        self.commands.append(cmd)
+        if self.fail_on in cmd:
+            return 550, ["Timer already defined"]
+        if cmd.startswith("NEWT"):
+            self.next_id += 1
+            return 250, [f"{self.next_id} {cmd[5:]}"]
+        if cmd.startswith("LSTT"):
+            return 250, [f"{cmd[5:]} 1:C-1-1101-10301:2030-01-01:2015:2200:50:99:Old:"]
+        return 250, [cmd[5:]]
+
+
+def make_item(hour, title="Test", timer_id=None):
+    start = datetime.datetime(2030, 1, 1, hour, 0)
+    return timer_batch.BulkTimer(
+        id=timer_id, channel_id=1, dt_start=start, dt_end=start + datetime.timedelta(hours=1), title=title
+    )
+
+
+def test_validate_timers():
+    existing = make_timer(1, "2030-01-01", 1000, 1100)._replace(channel_id="C-1-1101-10301")
+    items = [make_item(10), make_item(12), make_item(12), make_item(16, timer_id=1)]
+    results = timer_batch.validate_timers(items, CHANNELS, {1: existing})
+    # the existing timer is replaced by the last item, so the first one is no duplicate
+    assert [r.status for r in results] == ["skipped", "skipped", "invalid", "skipped"]
+    assert results[0].channel_id == "C-1-1101-10301"
+    assert results[3].action == timer_batch.BulkTimerAction.modify
+
+
+def test_apply_timers_rolls_back():
+    items = [make_item(10, timer_id=1), make_item(12), make_item(14, title="Fails")]
+    results = timer_batch.validate_timers(items, CHANNELS, {1: make_timer(1, "2030-01-01", 900, 1000)})
+    svdrp = FakeSVDRP(fail_on="Fails")
+    assert not asyncio.run(timer_batch.apply_timers(items, results, svdrp))
+    assert [r.status for r in results] == ["rolled_back", "rolled_back", "failed"]
+    assert svdrp.commands[-2:] == ["DELT 11", "MODT 1 1:C-1-1101-10301:2030-01-01:2015:2200:50:99:Old:"]
+
+
+def test_rollback_skips_timers_without_id():
+    class NoIdSVDRP(FakeSVDRP):
+        async def send_cmd_with_code(self, cmd: str) -> tuple[int, list[str]]:
+            if "NoId" in cmd:
+                self.commands.append(cmd)
+                return 250, [""]
+            return await super().send_cmd_with_code(cmd)
+
+    items = [make_item(10, title="NoId"), make_item(12), make_item(14, title="Fails")]
+    results = timer_batch.validate_timers(items, CHANNELS, {})
+    svdrp = NoIdSVDRP(fail_on="Fails")
+    assert not asyncio.run(timer_batch.apply_timers(items, results, svdrp))
+    assert [r.status for r in results] == ["created", "rolled_back", "failed"]
+    assert results[0].errors == ["could not delete the timer again: unknown timer id"]
+    assert not any(cmd.startswith("DELT None") for cmd in svdrp.commands)
+
+
+def test_validate_mixed_timezones():
+    now = datetime.datetime(2030, 1, 1, 11, 0)
+    utc = datetime.timezone.utc
+    aware = make_item(12).model_copy(
+        update={
+            "dt_start": datetime.datetime(2030, 1, 2, 12, 0, tzinfo=utc),
+            "dt_end": datetime.datetime(2030, 1, 2, 13, 0, tzinfo=utc),
+        }
+    )
+    # a naive start with an aware end
+    mixed = make_item(14).model_copy(update={"dt_end": datetime.datetime(2030, 1, 3, 15, 0, tzinfo=utc)})
+    results = timer_batch.validate_timers([make_item(10), aware, mixed], CHANNELS, {}, now=now)
+    assert results[0].errors == ["the timer has already ended"]
+    assert results[1].errors == []
+    assert results[2].errors == ["the timer is longer than 24 hours"]
+    # naive datetimes are local time, aware ones are converted to it
+    assert aware.timer_string() == make_item(12).model_copy(
+        update={"dt_start": aware.local_start(), "dt_end": aware.local_end()}
+    ).timer_string()
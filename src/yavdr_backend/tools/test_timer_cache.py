@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+from yavdr_backend.interfaces.vdr_status import Recording, SetVolume
+
+from . import timer_cache
+from .channels import parse_channel_string
+from .testing import make_timer
+from .timer_cache import TimerCache, TimerEvent
+
+CHANNEL = parse_channel_string(1, "Das Erste HD;ARD:11494:HC23M5O35P0S1:S19.2E:22000:5101=27:5102=deu@3:5104:0:10301:1:1019:0")
+
+
+class FakeVDR:
+    def __init__(self, timers):
+        self.timers = timers
+        self.event_requests = []
+        self.channel_requests = 0
+
+    def close(self):
+        # the system bus
+        pass
+
+    async def list_channels(self):
+        self.channel_requests += 1
+        return {"S19.2E-1-1019-10301": CHANNEL}
+
+    async def list_detailed_timers(self):
+        return list(self.timers)
+
+    async def find_timer_event(self, _epg, timer, start, stop):
+        self.event_requests.append(timer.id)
+        return TimerEvent(event_id=timer.event_id, title=f"Event {timer.event_id}", start=start, duration=stop - start)
+
+
+def timer(timer_id, start=2015, event_id=0, **kwargs):
+    return make_timer(timer_id, "MTWTFSS", start, 2200)._replace(
+        channel_id="S19.2E-1-1019-10301", event_id=event_id, **kwargs
+    )
+
+
+def fake_vdr(monkeypatch, timers):
+    vdr = FakeVDR(timers)
+    monkeypatch.setattr(timer_cache, "list_channels", vdr.list_channels)
+    monkeypatch.setattr(timer_cache, "list_detailed_timers", vdr.list_detailed_timers)
+    monkeypatch.setattr(timer_cache, "find_timer_event", vdr.find_timer_event)
+    monkeypatch.setattr(timer_cache.sdbus, "sd_bus_open_system", lambda: vdr)
+    monkeypatch.setattr(timer_cache.DeTvdrVdrEpgInterface, "new_proxy", lambda *args, **kwargs: None)
+    return vdr
+
+
+def test_refresh_joins_channels_and_events(monkeypatch):
+    vdr = fake_vdr(monkeypatch, [timer(1, event_id=11), timer(2)])
+    cache = TimerCache()
+    changes = []
+    cache.on_change.append(lambda: changes.append(cache.version))
+    (first, second) = asyncio.run(cache.timers())
+    assert first.channel_name == second.channel_name == "Das Erste HD"
+    assert first.event is not None and first.event.title == "Event 11"
+    # timers without an event id are not looked up
+    assert second.event is None
+    assert vdr.event_requests == [1]
+    assert first.stop - first.start == first.duration == 105 * 60
+    assert changes == [1]
+
+    # only the changed timer is looked up again
+    vdr.timers[1] = timer(2, start=2030, event_id=12)
+    asyncio.run(cache.refresh())
+    assert vdr.event_requests == [1, 2]
+    assert cache.details[2].event.title == "Event 12"
+    assert cache.details[2].duration == 90 * 60
+    assert changes == [1, 2]
+
+    # an unchanged timer list keeps the version
+    asyncio.run(cache.refresh())
+    assert changes == [1, 2]
+
+    del vdr.timers[0]
+    asyncio.run(cache.refresh())
+    assert list(cache.details) == [2]
+
+    # the channels are only loaded again by a full refresh or for an unknown channel
+    assert vdr.channel_requests == 1
+    asyncio.run(cache.refresh(full=True))
+    assert vdr.channel_requests == 2
+    vdr.timers.append(timer(3)._replace(channel_id="S19.2E-1-1019-10302"))
+    asyncio.run(cache.refresh())
+    assert vdr.channel_requests == 3
+
+
+def test_timers_json(monkeypatch):
+    fake_vdr(monkeypatch, [timer(1, event_id=11, is_recording=True)])
+    cache = TimerCache()
+    (details,) = json.loads(asyncio.run(cache.timers_json()))
+    assert details["id"] == 1
+    assert details["is_recording"]
+    assert details["raw"] == "1:S19.2E-1-1019-10301:MTWTFSS:2015:2200:99:50:"
+    assert details["event"]["event_id"] == 11
+    assert details == cache.details[1].model_dump()
+
+
+def test_recording_signals_invalidate_the_cache(monkeypatch):
+    async def signals():
+        yield SetVolume(Volume=10, Absolute=True)
+        yield Recording(DeviceNumber=0, Name="Test", FileName="/srv/vdr/video/Test", On=True)
+
+    monkeypatch.setattr(timer_cache, "persistent_signal_generator", signals)
+    cache = TimerCache()
+    asyncio.run(cache._watch_signals())
+    assert cache._changed.is_set()
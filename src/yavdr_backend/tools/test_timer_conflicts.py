@@ -0,0 +1,101 @@
+from . import timer_conflicts
+from .channels import parse_channel_string
+from .timer_conflicts import ConflictChecker, Tuner, allocate, find_clusters, tuner_from_device
+from .timers import PlannedRecording
+
+CHANNELS = {
+    channel.channel_id: channel
+    for channel in (
+        # two channels on the same transponder
+        parse_channel_string(1, "Das Erste HD;ARD:11494:HC23M5O35P0S1:S19.2E:22000:5101=27:5102=deu@3:5104:0:10301:1:1019:0"),
+        parse_channel_string(2, "arte HD;ARD:11494:HC23M5O35P0S1:S19.2E:22000:5111=27:5112=deu@3:5114:0:10302:1:1019:0"),
+        parse_channel_string(3, "ZDF HD;ZDFvision:11362:HC23M5O35P0S1:S19.2E:22000:6110=27:6120=deu@3:6130:0:11110:1:1011:0"),
+        parse_channel_string(4, "RTL HD;CBC:10832:HC23M5O35P0S1:S19.2E:22000:255=27:256=deu@3:0:1722:61200:1:1017:0"),
+    )
+}
+ARD, ARTE, ZDF, RTL = CHANNELS
+
+
+def recording(timer_id, channel_id, start, stop, priority=50):
+    return PlannedRecording(timer_id=timer_id, channel_id=channel_id, start=start, stop=stop, priority=priority)
+
+
+def test_tuner_from_device():
+    assert tuner_from_device(0, 1, False, False, "STV090x Multistandard (DVB-S)").sources == ("S",)
+    assert tuner_from_device(1, 2, True, True, "softhddevice") is None
+    assert tuner_from_device(2, 3, False, False, "unknown").can_receive("C")
+
+
+def test_find_clusters():
+    recordings = [recording(1, ARD, 0, 100), recording(2, ZDF, 50, 200), recording(3, ARD, 200, 300), recording(4, ZDF, 250, 260)]
+    assert [[r.timer_id for r in c] for c in find_clusters(recordings)] == [[1, 2], [3, 4]]
+
+
+def test_shared_transponder():
+    tuners = [Tuner(0, "DVB-S")]
+    recordings = [recording(1, ARD, 0, 100), recording(2, ARTE, 50, 150)]
+    assert allocate(recordings, tuners, CHANNELS) == []
+    recordings.append(recording(3, ZDF, 120, 200))
+    (conflict,) = allocate(recordings, tuners, CHANNELS)
+    assert conflict.failed_timer_ids == [3]
+    assert (conflict.start, conflict.stop) == (120, 200)
+    assert conflict.timer_ids == [2, 3]
+
+
+def test_priority_preemption():
+    tuners = [Tuner(0, "DVB-S 1"), Tuner(1, "DVB-S 2")]
+    recordings = [
+        recording(1, ARD, 0, 100, priority=50),
+        recording(2, ZDF, 0, 100, priority=40),
+        recording(3, RTL, 30, 60, priority=99),
+        # shares the tuner of timer 1 (same transponder)
+        recording(4, ARTE, 70, 90, priority=40),
+    ]
+    (conflict,) = allocate(recordings, tuners, CHANNELS)
+    # the recording with the lowest priority loses its tuner
+    assert conflict.failed_timer_ids == [2]
+    assert (conflict.start, conflict.stop) == (30, 100)
+    assert conflict.priorities == {1: 50, 2: 40, 3: 99, 4: 40}
+    assert conflict.max_failed_priority == 40
+
+
+def test_cam_slots():
+    tuners = [Tuner(0, "DVB-S 1"), Tuner(1, "DVB-S 2")]
+    encrypted = parse_channel_string(5, "Sky;Sky:11798:HC34M2O0S0:S19.2E:27500:511=2:512=deu:0:1702:10:133:4:0")
+    channels = {**CHANNELS, encrypted.channel_id: encrypted}
+    recordings = [recording(1, RTL, 0, 100), recording(2, encrypted.channel_id, 10, 100)]
+    (conflict,) = allocate(recordings, tuners, channels, cam_slots=1)
+    assert conflict.failed_timer_ids == [2]
+    assert allocate(recordings, tuners, channels, cam_slots=2) == []
+
+
+def test_checker_only_evaluates_changed_clusters(monkeypatch):
+    calls = []
+
+    def counting_allocate(cluster, *args):
+        calls.append([r.timer_id for r in cluster])
+        return allocate(cluster, *args)
+
+    monkeypatch.setattr(timer_conflicts, "allocate", counting_allocate)
+    checker = ConflictChecker()
+    checker.set_tuners([Tuner(0, "DVB-S")])
+    checker.set_channels(CHANNELS)
+    recordings = [recording(1, ARD, 0, 100), recording(2, ZDF, 50, 150), recording(3, ARD, 1000, 1100)]
+    assert [c.failed_timer_ids for c in checker.check(recordings)] == [[2]]
+    assert calls == [[1, 2], [3]]
+    recordings[2] = recording(3, ARD, 1000, 1200)
+    assert [c.failed_timer_ids for c in checker.check(recordings)] == [[2]]
+    assert calls == [[1, 2], [3], [3]]
+    # new tuners invalidate all results
+    checker.set_tuners([Tuner(0, "DVB-S 1"), Tuner(1, "DVB-S 2")])
+    assert checker.check(recordings) == []
+    assert len(calls) == 5
+
+
+def test_unknown_channels_can_be_received_by_all_tuners():
+    tuners = [Tuner(0, "DVB-S", sources=("S",))]
+    recordings = [recording(1, "S19.2E-1-1079-28006", 0, 100)]
+    assert allocate(recordings, tuners, CHANNELS) == []
+    # but they don't share a tuner with other channels
+    (conflict,) = allocate(recordings + [recording(2, ARD, 50, 100)], tuners, CHANNELS)
+    assert conflict.failed_timer_ids == [2]
@@ -0,0 +1,51 @@
+import asyncio
+
+from . import timer_feed
+from .testing import make_timer
+from .timer_cache import TimerCache
+
+
+def test_ics_fold():
+    line = "SUMMARY:" + "ä" * 60
+    folded = timer_feed.ics_fold(line)
+    assert all(len(part) <= 75 for part in folded.split(b"\r\n"))
+    assert folded.replace(b"\r\n ", b"").decode() == line + "\r\n"
+
+
+def test_feeds_are_cached():
+    cache = TimerCache()
+    cache.schedule.update([make_timer(1, "MTWTFSS", 2015, 2200)])
+    cache.rebuild()
+    cache.loaded = True
+    feeds = timer_feed.TimerFeeds(cache)
+    ics = asyncio.run(feeds.get("ics"))
+    assert ics.body.startswith(b"BEGIN:VCALENDAR\r\n")
+    assert ics.body.count(b"BEGIN:VEVENT") >= 14
+    assert ics.matches(f'"other", {ics.etag}')
+
+    # reloading unchanged timers keeps the ETag
+    cache.rebuild()
+    feeds._key = None
+    assert asyncio.run(feeds.get("ics")).etag == ics.etag
+
+    cache.schedule.update([make_timer(1, "MTWTFSS", 2015, 2300)])
+    cache.rebuild()
+    assert asyncio.run(feeds.get("ics")).etag != ics.etag
+
+
+def test_feed_tokens(tmp_path):
+    path = tmp_path / "feed_tokens.json"
+    tokens = timer_feed.FeedTokens(path)
+    token = tokens.token("vdr")
+    assert tokens.token("vdr") == token
+    assert path.stat().st_mode & 0o077 == 0
+    # the tokens are stored
+    assert timer_feed.FeedTokens(path).user(token) == "vdr"
+    assert tokens.user("") is None
+    assert tokens.user(token[:-1]) is None
+    assert tokens.user("ä") is None
+
+    renewed = tokens.token("vdr", renew=True)
+    assert renewed != token
+    assert tokens.user(token) is None
+    assert tokens.user(renewed) == "vdr"
@@ -0,0 +1,69 @@
+import datetime
+import itertools
+
+import pytest
+
+from . import timers
+from .testing import make_timer
+
+
+def test_parse_day():
+    assert timers.parse_day("2025-01-01") == timers.TimerDays(date=datetime.date(2025, 1, 1))
+    days = timers.parse_day("MTWTF--@2025-01-01")
+    assert days.weekdays == (True, True, True, True, True, False, False)
+    assert days.first_day == datetime.date(2025, 1, 1)
+    # a day of the month is a single shot timer on the next such day
+    today = datetime.date(2025, 1, 19)
+    assert timers.parse_day("19", today) == timers.TimerDays(date=today)
+    assert timers.parse_day("15", today) == timers.TimerDays(date=datetime.date(2025, 2, 15))
+    assert timers.parse_day("31", datetime.date(2025, 2, 1)).date == datetime.date(2025, 3, 31)
+    assert not timers.parse_day("15", today).is_repeating
+    with pytest.raises(ValueError):
+        timers.parse_day("-------")
+
+
+def test_weekly_timer_across_dst_change(berlin_time):
+    # the clocks are set forward on Sunday, 2025-03-30
+    timer = make_timer(1, "M------", 2015, 2200)
+    after = datetime.datetime(2025, 3, 20).astimezone()
+    first, second = itertools.islice(timers.iter_occurrences(timer, after), 2)
+    assert datetime.datetime.fromtimestamp(first.start).strftime("%Y-%m-%d %H:%M") == "2025-03-24 20:15"
+    assert datetime.datetime.fromtimestamp(second.start).strftime("%Y-%m-%d %H:%M") == "2025-03-31 20:15"
+    assert second.start - first.start == 7 * 86400 - 3600
+    assert second.stop - second.start == 105 * 60
+
+
+def test_schedule_merges_timers(berlin_time):
+    schedule = timers.TimerSchedule([
+        make_timer(1, "M-W-F--@2025-01-06", 2300, 100),
+        make_timer(2, "2025-01-07", 1200, 1300),
+        make_timer(3, "2025-01-07", 1400, 1500, flags=0),
+    ])
+    start = datetime.datetime(2025, 1, 1).astimezone()
+    end = datetime.datetime(2025, 1, 11).astimezone()
+    occurrences = list(schedule.occurrences(start, end))
+    assert [o.timer_id for o in occurrences] == [1, 2, 1, 1]
+    # recordings crossing midnight end on the next day
+    assert occurrences[0].stop - occurrences[0].start == 2 * 3600
+    assert schedule.next_occurrence(2, start).start == occurrences[1].start
+    assert len(schedule.next_occurrences(1, start)) == timers.LOOKAHEAD
+
+
+def test_schedule_pages(berlin_time):
+    schedule = timers.TimerSchedule([
+        make_timer(1, "MTWTFSS", 2000, 2200),
+        make_timer(2, "MTWTFSS", 2000, 2100),
+        make_timer(3, "MTWTFSS", 2030, 2300),
+    ])
+    start = datetime.datetime(2025, 1, 1, 12).astimezone()
+    expected = list(itertools.islice(schedule.occurrences(start), 9))
+    pages = []
+    cursor = start, None
+    for _ in range(3):
+        page = list(itertools.islice(schedule.occurrences(cursor[0], after_timer_id=cursor[1]), 3))
+        pages.extend(page)
+        last = page[-1]
+        cursor = datetime.datetime.fromtimestamp(last.start).astimezone(), last.timer_id
+    # neither the last entry nor overlapping recordings are repeated
+    assert pages == expected
+    assert [o.timer_id for o in pages] == [1, 2, 3] * 3
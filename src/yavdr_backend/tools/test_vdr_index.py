@@ -0,0 +1,51 @@
+from . import vdr_index
+from .testing import write_index
+
+
+def test_index_seek(tmp_path):
+    # two GOPs of 5 frames in the first file, one GOP in the second file
+    entries = [(1, i * 1000, i % 5 == 0) for i in range(10)] + [(2, i * 1000, i == 0) for i in range(5)]
+    write_index(tmp_path, entries)
+    (tmp_path / "info").write_text("T Test\nF 5\n")
+
+    with vdr_index.VdrIndex(tmp_path) as index:
+        assert len(index) == 15
+        assert index.frames_per_second == 5
+        assert index.length_in_seconds == 3
+        assert index[7] == vdr_index.IndexEntry(file_number=1, offset=7000, independent=False)
+        assert index.seek(1.8) == vdr_index.SeekPosition(frame=5, seconds=1.0, file_number=1, offset=5000)
+        assert index.seek(100).frame == 10
+        assert index.frame_at_position(1, 7500) == 7
+        assert index.frame_at_position(2, 0) == 10
+        assert [frame for frame, _ in index.independent_frames()] == [0, 5, 10]
+        assert index.file_path(2).name == "00002.ts"
+
+
+def test_open_index_follows_growing_recording(tmp_path):
+    write_index(tmp_path, [(1, 0, True)])
+    with vdr_index.open_index(tmp_path) as index:
+        assert len(index) == 1
+    write_index(tmp_path, [(1, 0, True), (1, 1000, False), (1, 2000, False)])
+    with vdr_index.open_index(tmp_path) as index:
+        assert len(index) == 3
+
+
+def test_open_index_keeps_used_indexes_open(tmp_path, monkeypatch):
+    monkeypatch.setattr(vdr_index, "_index_cache", {})
+    monkeypatch.setattr(vdr_index, "INDEX_CACHE_SIZE", 1)
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        write_index(tmp_path / name, [(1, 0, True), (1, 1000, False)])
+
+    with vdr_index.open_index(tmp_path / "a") as a:
+        # the index is replaced while it is read (e.g. by a thread creating a thumbnail)
+        write_index(tmp_path / "a", [(1, 0, True), (1, 1000, False), (1, 2000, False)])
+        with vdr_index.open_index(tmp_path / "a") as grown:
+            assert len(grown) == 3
+        assert a[1].offset == 1000
+        # and removed from the cache
+        with vdr_index.open_index(tmp_path / "b") as b:
+            assert grown._mmap is None
+            assert a[1].offset == 1000
+        assert b._mmap is not None
+    assert a._mmap is None
@@ -0,0 +1,30 @@
+"""builders for the objects used by several test modules"""
+import struct
+
+from yavdr_backend.interfaces.vdr_timers import DetailedTimer
+
+from .recordings import Recording
+
+
+def make_timer(timer_id, day, start, stop, flags=1):
+    return DetailedTimer(
+        id=timer_id, remote="", flags=flags, channel_id="C-1-2-3", day_weekdays=day,
+        start=start, stop=stop, priority=50, lifetime=99, filename="Test", aux="",
+        event_id=0, is_recording=False, is_pending=False, in_vps_margin=False,
+    )
+
+
+def make_recording(path, title, short_text=None, description=None, size=1000, start=0):
+    return Recording(
+        RecNum=0, Path=path, Name=title, Title=title, title=title, searchTitle=title.lower(), Start=start,
+        Priority=50, Lifetime=99, HierarchyLevels=0, FramesPerSecond=25, NumFrames=0, LengthInSeconds=3600,
+        duration="01:00:00", FileSizeMB=size, IsPesRecording=False, IsNew=False, IsEdited=False,
+        InfoTitle=title, InfoShortText=short_text, InfoDescription=description,
+    )
+
+
+def write_index(path, entries):
+    """write a VDR index file of TS recordings, entries are (file number, offset, independent)"""
+    with open(path / "index", "wb") as f:
+        for file_number, offset, independent in entries:
+            f.write(struct.pack("<Q", file_number << 48 | int(independent) << 47 | offset))
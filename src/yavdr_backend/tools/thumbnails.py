@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Thumbnails for recordings.
+
+The GOP starting at an independent frame is cut out of the recording (using its index
+file) and decoded by a pool of ffmpeg processes. Requests are handled by priority,
+so thumbnails which are visible in the frontend are done before prefetched ones.
+The images are stored in an on-disk cache (keyed by a hash of recording, frame and size)
+which is limited in size by removing the least recently used files.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from enum import StrEnum
+from pathlib import Path
+from typing import NamedTuple
+
+from .vdr_index import VdrIndex, open_index
+
+THUMBNAIL_CACHE_DIR = Path(os.environ.get("YAVDR_THUMBNAIL_CACHE_DIR", "/var/cache/yavdr-webfrontend/thumbnails"))
+THUMBNAIL_CACHE_SIZE = int(os.environ.get("YAVDR_THUMBNAIL_CACHE_SIZE", 256 * 1024 * 1024))
+DEFAULT_WIDTH = 320
+# position of the thumbnail (as a fraction of the recording's length) if no time is given
+DEFAULT_POSITION = 0.1
+# don't read more than this for a single GOP
+MAX_FRAME_DATA = 4 * 1024 * 1024
+
+PRIORITY_VISIBLE = 0
+PRIORITY_PREFETCH = 10
+
+
+class ThumbnailFormat(StrEnum):
+    jpeg = "jpeg"
+    webp = "webp"
+
+
+FORMAT_OPTIONS: dict[ThumbnailFormat, tuple[str, str, str]] = {
+    # codec, file suffix, media type
+    ThumbnailFormat.jpeg: ("mjpeg", ".jpg", "image/jpeg"),
+    ThumbnailFormat.webp: ("libwebp", ".webp", "image/webp"),
+}
+
+
+class ThumbnailError(Exception):
+    pass
+
+
+class ThumbnailRequest(NamedTuple):
+    recording_dir: Path
+    frame: int
+    width: int
+    format: ThumbnailFormat
+    is_pes_recording: bool
+
+    @property
+    def key(self) -> str:
+        return hashlib.sha256(
+            f"{self.recording_dir}|{self.frame}|{self.width}|{self.format}".encode()
+        ).hexdigest()
+
+
+def media_type(fmt: ThumbnailFormat) -> str:
+    return FORMAT_OPTIONS[fmt][2]
+
+
+def read_gop(index: VdrIndex, frame: int) -> bytes:
+    """read the data from the given independent frame up to the next independent frame"""
+    entry = index[frame]
+    length = MAX_FRAME_DATA
+    if (next_frame := index.independent_frame_after(frame)) is not None:
+        next_entry = index[next_frame]
+        if next_entry.file_number == entry.file_number:
+            length = min(next_entry.offset - entry.offset, MAX_FRAME_DATA)
+    with open(index.file_path(entry.file_number), "rb") as f:
+        f.seek(entry.offset)
+        return f.read(length)
+
+
+async def decode_frame(data: bytes, width: int, fmt: ThumbnailFormat, is_pes_recording: bool = False) -> bytes:
+    codec, _suffix, _media_type = FORMAT_OPTIONS[fmt]
+    proc = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-f", "mpeg" if is_pes_recording else "mpegts", "-i", "pipe:0",
+        "-frames:v", "1", "-vf", f"scale={width}:-2",
+        "-c:v", codec, "-f", "image2pipe", "pipe:1",
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    image, err = await proc.communicate(data)
+    if proc.returncode or not image:
+        raise ThumbnailError(f"ffmpeg failed: {err.decode(errors='replace').strip()}")
+    return image
+
+
+class ThumbnailCache:
+    """files in the cache directory, the least recently used ones are removed first"""
+
+    def __init__(self, cache_dir: Path = THUMBNAIL_CACHE_DIR, max_size: int = THUMBNAIL_CACHE_SIZE) -> None:
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.size = 0
+        self.entries: OrderedDict[Path, int] = OrderedDict()
+        self.scanned = False
+
+    def _read_dir(self) -> list[tuple[float, Path, int]]:
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files: list[tuple[float, Path, int]] = []
+        for path in self.cache_dir.glob("*/*"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        return sorted(files)
+
+    async def scan(self) -> None:
+        """read the files of the cache directory (in a thread), the cache is empty until then"""
+        files = await asyncio.to_thread(self._read_dir)
+        # files which have been added in the meantime are newer
+        for _mtime, path, size in reversed(files):
+            if path not in self.entries:
+                self.entries[path] = size
+                self.entries.move_to_end(path, last=False)
+                self.size += size
+        self.scanned = True
+
+    def path(self, request: ThumbnailRequest) -> Path:
+        key = request.key
+        return self.cache_dir / key[:2] / f"{key}{FORMAT_OPTIONS[request.format][1]}"
+
+    def get(self, request: ThumbnailRequest) -> Path | None:
+        path = self.path(request)
+        if path not in self.entries:
+            return None
+        self.entries.move_to_end(path)
+        try:
+            # the modification time keeps the lru order across restarts
+            os.utime(path)
+        except OSError:
+            self.size -= self.entries.pop(path)
+            return None
+        return path
+
+    def put(self, request: ThumbnailRequest, data: bytes) -> Path:
+        path = self.path(request)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        self.size += len(data) - self.entries.pop(path, 0)
+        self.entries[path] = len(data)
+        while self.size > self.max_size and len(self.entries) > 1:
+            old_path, old_size = self.entries.popitem(last=False)
+            self.size -= old_size
+            old_path.unlink(missing_ok=True)
+        return path
+
+
+class ThumbnailService:
+    def __init__(self, cache: ThumbnailCache | None = None, workers: int | None = None) -> None:
+        self.cache = cache or ThumbnailCache()
+        self.workers = workers or max((os.cpu_count() or 2) // 2, 1)
+        self.queue: asyncio.PriorityQueue[tuple[int, int, ThumbnailRequest]] = asyncio.PriorityQueue()
+        self.pending: dict[ThumbnailRequest, asyncio.Future[Path]] = {}
+        self.priorities: dict[ThumbnailRequest, int] = {}
+        self._counter = itertools.count()
+        self.available = False
+
+    def submit(self, request: ThumbnailRequest, priority: int = PRIORITY_VISIBLE) -> asyncio.Future[Path]:
+        future = self.pending.get(request)
+        if future is None:
+            future = self.pending[request] = asyncio.get_running_loop().create_future()
+        elif request not in self.priorities or priority >= self.priorities[request]:
+            # the thumbnail is being rendered or already queued with a higher priority
+            return future
+        # a request with a higher priority is queued again, the old entry is skipped by the workers
+        self.priorities[request] = priority
+        self.queue.put_nowait((priority, next(self._counter), request))
+        return future
+
+    async def get(self, request: ThumbnailRequest, priority: int = PRIORITY_VISIBLE) -> Path:
+        if (path := self.cache.get(request)) is not None:
+            return path
+        if not self.available:
+            raise ThumbnailError("ffmpeg is not available")
+        return await asyncio.shield(self.submit(request, priority))
+
+    def prefetch(self, request: ThumbnailRequest) -> None:
+        if self.available and self.cache.get(request) is None:
+            self.submit(request, PRIORITY_PREFETCH)
+
+    async def _render(self, request: ThumbnailRequest) -> Path:
+        if (path := self.cache.get(request)) is not None:
+            return path
+        # the index stays open while the thread reads it, even if it is replaced in the meantime
+        with open_index(request.recording_dir, is_pes_recording=request.is_pes_recording) as index:
+            data = await asyncio.to_thread(read_gop, index, request.frame)
+        image = await decode_frame(data, request.width, request.format, request.is_pes_recording)
+        return self.cache.put(request, image)
+
+    async def worker(self) -> None:
+        while True:
+            priority, _n, request = await self.queue.get()
+            future = self.pending.get(request)
+            if future is None or self.priorities.get(request) != priority:
+                continue
+            # the future stays pending while the thumbnail is rendered, so requests for it wait
+            del self.priorities[request]
+            try:
+                path = await self._render(request)
+            except Exception as err:
+                logging.debug("could not create thumbnail for %s: %s", request, err)
+                future.set_exception(ThumbnailError(str(err)))
+                # nobody might wait for prefetched thumbnails
+                future.exception()
+            else:
+                future.set_result(path)
+            finally:
+                del self.pending[request]
+
+    async def run_workers(self) -> None:
+        try:
+            await self.cache.scan()
+        except OSError as err:
+            logging.error("could not read the thumbnail cache: %s", err)
+        if shutil.which("ffmpeg") is None:
+            logging.warning("ffmpeg is not installed, thumbnails for recordings are not available")
+            return
+        self.available = True
+        try:
+            async with asyncio.TaskGroup() as group:
+                for _ in range(self.workers):
+                    group.create_task(self.worker())
+        finally:
+            self.available = False
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Create or modify several timers at once.
+
+All timers are validated first (channel, time span, existing timers, EPG). If all of them
+are valid, NEWT and MODT are sent in a single SVDRP session. If VDR rejects one of the
+timers, the timers created so far are deleted again and modified timers are restored,
+so either all timers of a batch are applied or none of them.
+"""
+import contextlib
+import datetime
+import logging
+from collections.abc import Sequence
+from enum import StrEnum
+
+import sdbus
+from pydantic import BaseModel
+
+from yavdr_backend.interfaces.vdr_epg import DeTvdrVdrEpgInterface
+from yavdr_backend.interfaces.vdr_timers import DetailedTimer
+
+from .async_svdrp import SVDRP
+from .channels import ChannelInfo
+from .duplicates import DuplicateIndex
+from .timer_cache import parse_epg_event
+from .timers import TimerData
+
+SVDRP_OK = 250
+# VDR's timers can't be longer than a day
+MAX_TIMER_DURATION = datetime.timedelta(hours=24)
+
+
+class BulkTimer(TimerData):
+    # the id of an existing timer which is replaced by this one, None for a new timer
+    id: int | None = None
+
+
+class BulkTimerAction(StrEnum):
+    new = "new"
+    modify = "modify"
+
+
+class BulkTimerStatus(StrEnum):
+    invalid = "invalid"
+    skipped = "skipped"
+    created = "created"
+    modified = "modified"
+    failed = "failed"
+    rolled_back = "rolled_back"
+
+
+class BulkTimerResult(BaseModel):
+    index: int
+    action: BulkTimerAction
+    status: BulkTimerStatus
+    timer_id: int | None = None
+    channel_id: str | None = None
+    event_title: str | None = None
+    errors: list[str] = []
+    warnings: list[str] = []
+
+
+class BulkTimerResponse(BaseModel):
+    success: bool
+    rolled_back: bool
+    results: list[BulkTimerResult]
+
+
+def resolve_channel(channel: str | int, channels: dict[str, ChannelInfo]) -> str | None:
+    """return the channel id for a channel id or a channel number"""
+    if isinstance(channel, str) and channel in channels:
+        return channel
+    with contextlib.suppress(ValueError):
+        number = int(channel)
+        return next((c.channel_id for c in channels.values() if c.number == number), None)
+    return None
+
+
+def timer_key(channel_id: str, day: str, start: int, stop: int) -> tuple[str, str, int, int]:
+    return channel_id, day, start, stop
+
+
+def validate_timers(
+    items: Sequence[BulkTimer],
+    channels: dict[str, ChannelInfo],
+    timers: dict[int, DetailedTimer],
+    now: datetime.datetime | None = None,
+) -> list[BulkTimerResult]:
+    """check the timers without talking to VDR, returns a result for each item"""
+    now = (now or datetime.datetime.now()).astimezone()
+    modified_ids = {item.id for item in items if item.id is not None}
+    existing = {
+        timer_key(t.channel_id, t.day_weekdays, t.start, t.stop): t.id
+        for t in timers.values()
+        if t.id not in modified_ids
+    }
+    seen: dict[tuple[str, str, int, int], int] = {}
+    results: list[BulkTimerResult] = []
+    for index, item in enumerate(items):
+        result = BulkTimerResult(
+            index=index,
+            action=BulkTimerAction.new if item.id is None else BulkTimerAction.modify,
+            status=BulkTimerStatus.skipped,
+            timer_id=item.id,
+            channel_id=resolve_channel(item.channel_id, channels),
+        )
+        results.append(result)
+        start, end = item.local_start(), item.local_end()
+        if result.channel_id is None:
+            result.errors.append(f"unknown channel {item.channel_id}")
+        if item.id is not None and item.id not in timers:
+            result.errors.append(f"unknown timer {item.id}")
+        if not item.title.strip():
+            result.errors.append("the title is empty")
+        if end <= start:
+            result.errors.append("the timer ends before it starts")
+        elif end - start > MAX_TIMER_DURATION:
+            result.errors.append("the timer is longer than 24 hours")
+        if end <= now:
+            result.errors.append("the timer has already ended")
+        if result.channel_id is not None:
+            key = timer_key(result.channel_id, start.strftime("%Y-%m-%d"), int(start.strftime("%H%M")), int(end.strftime("%H%M")))
+            if (timer_id := existing.get(key)) is not None:
+                result.errors.append(f"the same timer already exists (timer {timer_id})")
+            elif (other := seen.get(key)) is not None:
+                result.errors.append(f"the same timer is part of the request (item {other})")
+            else:
+                seen[key] = index
+        if result.errors:
+            result.status = BulkTimerStatus.invalid
+    return results
+
+
+async def check_epg(
+    items: Sequence[BulkTimer], results: list[BulkTimerResult], duplicates: DuplicateIndex | None = None
+) -> None:
+    """
+    add the title of the EPG event of each timer or a warning if there is no EPG data,
+    and a warning if the event has already been recorded or is scheduled by another timer
+    """
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        epg = DeTvdrVdrEpgInterface.new_proxy("de.tvdr.vdr", "/EPG", bus=bus)
+        for item, result in zip(items, results):
+            if result.channel_id is None:
+                continue
+            middle = (item.local_start().timestamp() + item.local_end().timestamp()) // 2
+            try:
+                code, _msg, events = await epg.at(result.channel_id, int(middle))
+            except Exception as err:
+                logging.debug("could not look up the EPG event for %s: %s", result.channel_id, err)
+                code, events = 0, []
+            if code != SVDRP_OK or not events:
+                result.warnings.append("no EPG event found for the timer")
+                continue
+            try:
+                event = parse_epg_event(events[0])
+            except (KeyError, ValueError):
+                continue
+            result.event_title = event.title
+            if duplicates is None:
+                continue
+            match = duplicates.lookup(event.title, event.short_text, event.description)
+            if match.recordings:
+                result.warnings.append(f"already recorded: {', '.join(match.recordings)}")
+            if other_timers := [t for t in match.timer_ids if t != item.id]:
+                result.warnings.append(f"already scheduled by timer {', '.join(map(str, other_timers))}")
+
+
+def parse_timer_id(response: list[str]) -> int | None:
+    """NEWT, MODT and LSTT answer with the timer id followed by the timer"""
+    with contextlib.suppress(IndexError, ValueError):
+        return int(response[-1].split(maxsplit=1)[0])
+    return None
+
+
+async def apply_timers(items: Sequence[BulkTimer], results: list[BulkTimerResult], svdrp: SVDRP) -> bool:
+    """send the timers in the given SVDRP session, returns False if the batch has been rolled back"""
+    created: list[BulkTimerResult] = []
+    # timer id -> previous timer
+    originals: dict[int, str] = {}
+    failed = False
+    for item, result in zip(items, results):
+        if failed:
+            break
+        # channel numbers are replaced by the channel id, the numbers change when channels are sorted
+        item = item.model_copy(update={"channel_id": result.channel_id})
+        if item.id is None:
+            code, response = await svdrp.send_cmd_with_code(f"NEWT {item.timer_string()}")
+        else:
+            code, response = await svdrp.send_cmd_with_code(f"LSTT {item.id}")
+            if code == SVDRP_OK:
+                originals[item.id] = response[-1].split(maxsplit=1)[1]
+                code, response = await svdrp.send_cmd_with_code(f"MODT {item.id} {item.timer_string()}")
+        if code != SVDRP_OK:
+            result.status = BulkTimerStatus.failed
+            result.errors.append(" ".join(response) or f"SVDRP error {code}")
+            failed = True
+        elif item.id is None:
+            result.status = BulkTimerStatus.created
+            result.timer_id = parse_timer_id(response)
+            created.append(result)
+        else:
+            result.status = BulkTimerStatus.modified
+    if not failed:
+        return True
+
+    for result in reversed(created):
+        if result.timer_id is None:
+            # VDR didn't tell the id of the new timer, so it can't be deleted
+            result.errors.append("could not delete the timer again: unknown timer id")
+            continue
+        code, response = await svdrp.send_cmd_with_code(f"DELT {result.timer_id}")
+        if code == SVDRP_OK:
+            result.status = BulkTimerStatus.rolled_back
+        else:
+            result.errors.append(f"could not delete the timer again: {' '.join(response)}")
+    for item, result in zip(items, results):
+        if result.status != BulkTimerStatus.modified or item.id is None:
+            continue
+        code, response = await svdrp.send_cmd_with_code(f"MODT {item.id} {originals[item.id]}")
+        if code == SVDRP_OK:
+            result.status = BulkTimerStatus.rolled_back
+        else:
+            result.errors.append(f"could not restore the timer: {' '.join(response)}")
+    return False
+
+
+async def bulk_timers(
+    items: Sequence[BulkTimer],
+    channels: dict[str, ChannelInfo],
+    timers: dict[int, DetailedTimer],
+    duplicates: DuplicateIndex | None = None,
+) -> BulkTimerResponse:
+    results = validate_timers(items, channels, timers)
+    if any(r.status == BulkTimerStatus.invalid for r in results):
+        return BulkTimerResponse(success=False, rolled_back=False, results=results)
+    await check_epg(items, results, duplicates)
+    async with SVDRP() as svdrp:
+        success = await apply_timers(items, results, svdrp)
+    return BulkTimerResponse(success=success, rolled_back=not success, results=results)
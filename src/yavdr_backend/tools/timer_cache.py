@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+In-memory cache of VDR's timers.
+
+The timers are reloaded from dbus2vdr when VDR signals a timer change (tcAdd, tcMod, tcDel)
+or the start or end of a recording (which changes the flags of its timer) and joined with the channel names and the EPG event of each timer (by its event id).
+The serialized timer list is kept as well, so requests don't depend on the number of timers
+or on VDR's response times.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+import sdbus
+from pydantic import BaseModel, TypeAdapter
+
+from yavdr_backend.interfaces.vdr_epg import DeTvdrVdrEpgInterface
+from yavdr_backend.interfaces.vdr_status import Recording, TimerChange, persistent_signal_generator
+from yavdr_backend.interfaces.vdr_timers import DetailedTimer
+
+from .channels import ChannelInfo, list_channels
+from .openmetrics import DBUS_LATENCY
+from .timers import TimerSchedule, format_time_span, list_detailed_timers, timer_interval
+
+
+class TimerEvent(BaseModel):
+    event_id: int
+    title: str
+    short_text: str | None = None
+    description: str | None = None
+    start: int
+    duration: int
+
+
+class TimerDetails(BaseModel):
+    status_flags: int
+    raw: str
+    id: int
+    channel_id: str
+    channel_name: str
+    remote: str
+    day_weekdays: str
+    start: int
+    stop: int
+    time_span: str
+    duration: int
+    priority: int
+    lifetime: int
+    filename: str
+    aux: str
+    event_id: int
+    is_recording: bool
+    is_pending: bool
+    in_vps_margin: bool
+    event: TimerEvent | None = None
+
+
+timer_list_adapter = TypeAdapter(list[TimerDetails])
+
+
+def parse_epg_event(fields: list[tuple[str, tuple[str, Any]]]) -> TimerEvent:
+    """convert an event returned by dbus2vdr (a list of key - variant pairs)"""
+    values = {key: value for key, (_signature, value) in fields}
+    return TimerEvent(
+        event_id=values["EventID"],
+        title=values.get("Title", ""),
+        short_text=values.get("ShortText"),
+        description=values.get("Description"),
+        start=values.get("StartTime", 0),
+        duration=values.get("Duration", 0),
+    )
+
+
+async def find_timer_event(epg: DeTvdrVdrEpgInterface, timer: DetailedTimer, start: int, stop: int) -> TimerEvent | None:
+    """
+    look up the EPG event of a timer, the timer's start includes the margin before the event,
+    so the event running in the middle of the timer is requested
+    """
+    code, _msg, events = await epg.at(timer.channel_id, (start + stop) // 2)
+    if code != 250:
+        return None
+    for fields in events:
+        try:
+            event = parse_epg_event(fields)
+        except (KeyError, ValueError):
+            continue
+        if event.event_id == timer.event_id:
+            return event
+    return None
+
+
+class TimerCache:
+    def __init__(self, refresh_interval: float = 300, debounce: float = 1) -> None:
+        self.schedule = TimerSchedule()
+        self.channels: dict[str, ChannelInfo] = {}
+        self.details: dict[int, TimerDetails] = {}
+        self.refresh_interval = refresh_interval
+        self.debounce = debounce
+        self.loaded = False
+        self.version = 0
+        # the details have to be rebuilt when the next recording of a timer has ended
+        self.valid_until = 0.0
+        self._json = b"[]"
+        # called after the timers have changed
+        self.on_change: list[Callable[[], None]] = []
+        self._events: dict[tuple[str, int], TimerEvent | None] = {}
+        self._changed = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    def timer_details(self, timer: DetailedTimer) -> TimerDetails | None:
+        if (occurrence := self.schedule.next_occurrence(timer.id)) is not None:
+            # the next recording of the timer, for repeating timers this is the next matching day
+            start, stop = occurrence.start, occurrence.stop
+        else:
+            try:
+                # a single shot timer in the past
+                dt_start, dt_stop = timer_interval(timer.day_weekdays, timer.start, timer.stop)
+            except ValueError as err:
+                logging.warning("could not parse the day of timer %d: %s", timer.id, err)
+                return None
+            start, stop = int(dt_start.timestamp()), int(dt_stop.timestamp())
+        channel = self.channels.get(timer.channel_id)
+        return TimerDetails(
+            id=timer.id,
+            status_flags=timer.flags,
+            raw=f"{timer.flags}:{timer.channel_id}:{timer.day_weekdays}:{timer.start}:{timer.stop}:{timer.lifetime}:{timer.priority}:{timer.aux}",
+            remote=timer.remote,
+            channel_id=timer.channel_id,
+            channel_name=channel.name if channel is not None else "?",
+            day_weekdays=timer.day_weekdays,
+            event_id=timer.event_id,
+            start=start,
+            stop=stop,
+            time_span=format_time_span(timer.start, timer.stop),
+            duration=stop - start,
+            priority=timer.priority,
+            lifetime=timer.lifetime,
+            filename=timer.filename,
+            aux=timer.aux,
+            is_recording=timer.is_recording,
+            is_pending=timer.is_pending,
+            in_vps_margin=timer.in_vps_margin,
+            event=self._events.get((timer.channel_id, timer.event_id)),
+        )
+
+    def rebuild(self, timer_ids: set[int] | None = None) -> None:
+        """rebuild the details of the given timers (or of all timers) and the serialized list"""
+        now = time.time()
+        for timer_id in self.details.keys() - self.schedule.timers.keys():
+            del self.details[timer_id]
+        for timer_id, timer in self.schedule.timers.items():
+            if timer_ids is not None and timer_id not in timer_ids and now < self.valid_until:
+                continue
+            if (details := self.timer_details(timer)) is not None:
+                self.details[timer_id] = details
+            else:
+                self.details.pop(timer_id, None)
+        upcoming = [d.stop for d in self.details.values() if d.stop > now]
+        self.valid_until = min(upcoming, default=now + self.refresh_interval)
+        serialized = timer_list_adapter.dump_json(list(self.details.values()))
+        if serialized != self._json:
+            self._json = serialized
+            self.version += 1
+            for callback in self.on_change:
+                callback()
+
+    async def _load_events(self, timer_ids: set[int]) -> None:
+        wanted = {(t.channel_id, t.event_id): t for t in self.schedule.timers.values() if t.event_id}
+        for key in self._events.keys() - wanted.keys():
+            del self._events[key]
+        missing = [
+            (key, timer) for key, timer in wanted.items()
+            if key not in self._events or timer.id in timer_ids
+        ]
+        if not missing:
+            return
+        with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+            epg = DeTvdrVdrEpgInterface.new_proxy("de.tvdr.vdr", "/EPG", bus=bus)
+            for key, timer in missing:
+                occurrence = self.schedule.next_occurrence(timer.id)
+                if occurrence is None:
+                    self._events[key] = None
+                    continue
+                try:
+                    self._events[key] = await find_timer_event(epg, timer, occurrence.start, occurrence.stop)
+                except Exception as err:
+                    logging.debug("could not get the EPG event of timer %d: %s", timer.id, err)
+                    self._events[key] = None
+
+    async def refresh(self, full: bool = False) -> None:
+        """
+        reload the timers, the channels are only reloaded on a full refresh or if a timer
+        uses an unknown channel (VDR doesn't signal channel changes)
+        """
+        async with self._lock:
+            with DBUS_LATENCY.time("timers.list"):
+                timers = await list_detailed_timers()
+            channels_changed = False
+            if full or not self.loaded or any(t.channel_id not in self.channels for t in timers):
+                with DBUS_LATENCY.time("channels.list"):
+                    channels = await list_channels()
+                channels_changed = channels != self.channels
+                self.channels = channels
+            changed = self.schedule.update(timers)
+            if full:
+                self._events.clear()
+            await self._load_events(changed)
+            self.rebuild(None if full or channels_changed or not self.loaded else changed)
+            self.loaded = True
+
+    async def ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.refresh()
+        elif time.time() >= self.valid_until:
+            # a recording has ended, so the next occurrence of its timer is needed
+            self.rebuild()
+
+    def invalidate(self) -> None:
+        """reload the timers soon, e.g. after the timers have been changed by this backend"""
+        self._changed.set()
+
+    async def timers(self) -> list[TimerDetails]:
+        await self.ensure_loaded()
+        return list(self.details.values())
+
+    async def timers_json(self) -> bytes:
+        await self.ensure_loaded()
+        return self._json
+
+    async def _watch_signals(self) -> None:
+        async for status_signal in persistent_signal_generator():
+            # a timer which starts or stops recording isn't signaled as a timer change
+            if isinstance(status_signal, TimerChange | Recording):
+                self._changed.set()
+
+    async def run_update(self) -> None:
+        watcher = asyncio.create_task(self._watch_signals())
+        try:
+            full = True
+            while True:
+                try:
+                    await self.refresh(full)
+                except Exception as err:
+                    logging.warning("could not update the timers: %s", err)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), self.refresh_interval)
+                    # adding a timer with a repeating pattern can emit several changes at once
+                    await asyncio.sleep(self.debounce)
+                    full = False
+                except TimeoutError:
+                    # EPG events and channels might have changed without a timer change
+                    full = True
+                self._changed.clear()
+        finally:
+            watcher.cancel()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Timer conflict detection.
+
+The recordings of the timer schedule are split into clusters of overlapping recordings.
+For each cluster a sweep over the start and stop times assigns the recordings to the
+tuners: recordings on the same transponder share a tuner, a recording with a higher
+priority takes over the tuner of recordings with a lower priority (like VDR does).
+The result of each cluster is cached, so if a timer changes only the clusters
+containing its old or new recordings are evaluated again.
+"""
+import contextlib
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from typing import NamedTuple
+
+import sdbus
+from pydantic import BaseModel
+
+from yavdr_backend.interfaces.vdr_devices import DeTvdrVdrDeviceInterface
+
+from .channels import ChannelInfo
+from .timers import PlannedRecording
+
+# devices reported by VDR which are output devices without a tuner
+OUTPUT_DEVICE_NAMES = (
+    "softhddevice",
+    "softhdcuvid",
+    "softhdvaapi",
+    "softhdodroid",
+    "xineliboutput",
+    "vaapidevice",
+    "dummydevice",
+    "rpihddevice",
+)
+DEVICE_SOURCES = {"DVB-S": "S", "DVB-C": "C", "DVB-T": "T", "ATSC": "A"}
+
+
+class Tuner(NamedTuple):
+    index: int
+    name: str
+    # source prefixes the tuner can receive, None if unknown (any source)
+    sources: tuple[str, ...] | None = None
+
+    def can_receive(self, source: str | None) -> bool:
+        """source None is an unknown channel, which might be received by any tuner"""
+        return self.sources is None or source is None or any(source.startswith(s) for s in self.sources)
+
+
+def tuner_from_device(index: int, _number: int, _has_decoder: bool, _is_primary: bool, name: str) -> Tuner | None:
+    if any(output_name in name.lower() for output_name in OUTPUT_DEVICE_NAMES):
+        return None
+    sources = tuple(source for device_type, source in DEVICE_SOURCES.items() if device_type in name.upper())
+    return Tuner(index=index, name=name, sources=sources or None)
+
+
+async def list_tuners() -> list[Tuner]:
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        vdr_devices = DeTvdrVdrDeviceInterface.new_proxy("de.tvdr.vdr", "/Devices", bus=bus)
+        devices = await vdr_devices.list()
+    return [tuner for device in devices if (tuner := tuner_from_device(*device)) is not None]
+
+
+class Conflict(BaseModel):
+    start: int
+    stop: int
+    # all timers recording during the conflict
+    timer_ids: list[int]
+    # timers which can't be recorded (completely or partially)
+    failed_timer_ids: list[int]
+    priorities: dict[int, int]
+    max_failed_priority: int
+
+
+@dataclass
+class _TunerState:
+    tuner: Tuner
+    transponder: tuple[str, int | str] | None = None
+    encrypted: bool = False
+    recordings: set[PlannedRecording] = field(default_factory=set)
+
+
+def find_clusters(recordings: Iterable[PlannedRecording]) -> list[list[PlannedRecording]]:
+    """split the recordings into groups of (transitively) overlapping recordings"""
+    clusters: list[list[PlannedRecording]] = []
+    cluster_end = None
+    for r in sorted(recordings, key=lambda r: (r.start, r.timer_id)):
+        if cluster_end is None or r.start >= cluster_end:
+            clusters.append([])
+            cluster_end = r.stop
+        clusters[-1].append(r)
+        cluster_end = max(cluster_end, r.stop)
+    return clusters
+
+
+def channel_properties(
+    recording: PlannedRecording, channels: dict[str, ChannelInfo]
+) -> tuple[str | None, tuple[str, int | str], bool]:
+    """source, transponder and encryption of the channel of the recording"""
+    channel = channels.get(recording.channel_id)
+    if channel is None:
+        # the source of unknown channels is unknown and they can't share a tuner
+        return None, ("?", recording.channel_id), False
+    return channel.source, channel.transponder, channel.is_encrypted
+
+
+def find_tuner(
+    states: list[_TunerState],
+    source: str | None,
+    transponder: tuple[str, int | str],
+    encrypted: bool,
+    cam_slots: int | None,
+) -> tuple[_TunerState | None, list[_TunerState]]:
+    """
+    return a tuner which is tuned to the transponder already or is free (if there is a
+    CAM slot left for encrypted channels) and the tuners which can receive the source
+    """
+    candidates = [s for s in states if s.tuner.can_receive(source)]
+    if (state := next((s for s in candidates if s.transponder == transponder), None)) is not None:
+        return state, candidates
+    if encrypted and cam_slots is not None and sum(s.encrypted for s in states) >= cam_slots:
+        candidates = [s for s in candidates if s.encrypted]
+    return next((s for s in candidates if not s.recordings), None), candidates
+
+
+def lowest_priority_tuner(candidates: list[_TunerState], priority: int) -> _TunerState | None:
+    """the tuner whose recordings have the lowest priority, if it is lower than the given priority"""
+    busy = [s for s in candidates if max(r.priority for r in s.recordings) < priority]
+    return min(busy, key=lambda s: (max(r.priority for r in s.recordings), len(s.recordings)), default=None)
+
+
+def merge_failures(
+    failures: list[tuple[PlannedRecording, int]], recordings: list[PlannedRecording]
+) -> list[Conflict]:
+    """merge the failed recordings (and the time they fail) into conflict intervals"""
+    conflicts: list[Conflict] = []
+    for recording, failed_at in sorted(failures, key=lambda f: f[1]):
+        if conflicts and failed_at < conflicts[-1].stop:
+            conflict = conflicts[-1]
+            conflict.stop = max(conflict.stop, recording.stop)
+        else:
+            conflict = Conflict(
+                start=failed_at, stop=recording.stop, timer_ids=[], failed_timer_ids=[], priorities={},
+                max_failed_priority=recording.priority,
+            )
+            conflicts.append(conflict)
+        if recording.timer_id not in conflict.failed_timer_ids:
+            conflict.failed_timer_ids.append(recording.timer_id)
+        conflict.max_failed_priority = max(conflict.max_failed_priority, recording.priority)
+    for conflict in conflicts:
+        for r in recordings:
+            if r.start < conflict.stop and r.stop > conflict.start and r.timer_id not in conflict.priorities:
+                conflict.timer_ids.append(r.timer_id)
+                conflict.priorities[r.timer_id] = r.priority
+    return conflicts
+
+
+def allocate(
+    recordings: list[PlannedRecording],
+    tuners: list[Tuner],
+    channels: dict[str, ChannelInfo],
+    cam_slots: int | None = None,
+) -> list[Conflict]:
+    """assign the recordings to the tuners and return the time spans in which recordings fail"""
+    states = [_TunerState(tuner) for tuner in tuners]
+    assignment: dict[PlannedRecording, _TunerState] = {}
+    # recording -> time of failure
+    failures: list[tuple[PlannedRecording, int]] = []
+
+    def release(recording: PlannedRecording) -> None:
+        if (state := assignment.pop(recording, None)) is None:
+            return
+        state.recordings.discard(recording)
+        if not state.recordings:
+            state.transponder = None
+            state.encrypted = False
+
+    # stop events are handled before start events at the same time
+    events = sorted(
+        [(r.start, 1, -r.priority, r.timer_id, r) for r in recordings]
+        + [(r.stop, 0, 0, r.timer_id, r) for r in recordings],
+        key=lambda e: e[:4],
+    )
+    for ts, is_start, _prio, _timer_id, recording in events:
+        if not is_start:
+            release(recording)
+            continue
+        source, transponder, encrypted = channel_properties(recording, channels)
+        state, candidates = find_tuner(states, source, transponder, encrypted, cam_slots)
+        if state is None and (state := lowest_priority_tuner(candidates, recording.priority)) is not None:
+            # take over the tuner with the recordings of the lowest priority
+            for preempted in list(state.recordings):
+                release(preempted)
+                failures.append((preempted, ts))
+        if state is None:
+            failures.append((recording, ts))
+            continue
+        state.transponder = transponder
+        state.encrypted = state.encrypted or encrypted
+        state.recordings.add(recording)
+        assignment[recording] = state
+    return merge_failures(failures, recordings)
+
+
+class ConflictChecker:
+    def __init__(self, cam_slots: int | None = None) -> None:
+        self.cam_slots = cam_slots
+        self.tuners: list[Tuner] = []
+        self.channels: dict[str, ChannelInfo] = {}
+        self._cache: dict[frozenset[PlannedRecording], list[Conflict]] = {}
+
+    def set_tuners(self, tuners: list[Tuner]) -> None:
+        if tuners != self.tuners:
+            self.tuners = tuners
+            self._cache.clear()
+
+    def set_channels(self, channels: dict[str, ChannelInfo]) -> None:
+        if channels != self.channels:
+            self.channels = channels
+            self._cache.clear()
+
+    def check(self, recordings: Iterable[PlannedRecording]) -> list[Conflict]:
+        """return the conflicts, only clusters which have changed since the last call are evaluated"""
+        cache: dict[frozenset[PlannedRecording], list[Conflict]] = {}
+        conflicts: list[Conflict] = []
+        for cluster in find_clusters(recordings):
+            key = frozenset(cluster)
+            if (result := self._cache.get(key)) is None:
+                result = allocate(cluster, self.tuners, self.channels, self.cam_slots)
+            cache[key] = result
+            conflicts.extend(result)
+        self._cache = cache
+        return conflicts
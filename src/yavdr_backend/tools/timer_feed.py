@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Calendar (iCalendar) and JSON feeds of the upcoming recordings.
+
+The feeds are rendered from the expanded timer schedule once per version of the
+timer cache (and day, so the time window moves on) and kept as bytes together with
+a strong ETag, so polling calendar apps mostly get a 304 response.
+
+Calendar apps can't send a bearer token, so the feeds are protected by a secret token
+per user in the query string of the feed URL. The tokens are stored in a file and can
+be renewed, which invalidates the URLs handed out before.
+"""
+import datetime
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+from dataclasses import dataclass
+from pathlib import Path
+from typing import NamedTuple
+
+from pydantic import BaseModel
+
+from .timer_cache import TimerCache, TimerDetails
+from .timers import PlannedRecording
+
+ICS_MEDIA_TYPE = "text/calendar; charset=utf-8"
+JSON_MEDIA_TYPE = "application/json"
+PRODUCT_ID = "-//yaVDR//yavdr-webfrontend//EN"
+UID_DOMAIN = "yavdr"
+# maximum length of a content line in octets (RFC 5545, 3.1)
+MAX_LINE_LENGTH = 75
+FEED_TOKENS_FILE = Path(
+    os.environ.get("YAVDR_FEED_TOKENS_FILE", "/var/lib/yavdr-webfrontend/feed_tokens.json")
+)
+
+
+class FeedItem(NamedTuple):
+    recording: PlannedRecording
+    timer: TimerDetails
+
+    @property
+    def uid(self) -> str:
+        return f"timer-{self.recording.timer_id}-{self.recording.start}@{UID_DOMAIN}"
+
+    @property
+    def title(self) -> str:
+        if self.timer.event is not None:
+            return self.timer.event.title
+        # the last part of the file name, the other parts are folders
+        return self.timer.filename.rsplit("~", 1)[-1]
+
+    @property
+    def short_text(self) -> str | None:
+        return self.timer.event.short_text if self.timer.event is not None else None
+
+    @property
+    def description(self) -> str | None:
+        return self.timer.event.description if self.timer.event is not None else None
+
+    @property
+    def content(self) -> tuple:
+        """everything that is part of the feeds"""
+        return self.recording, self.title, self.short_text, self.description, self.timer.channel_name
+
+
+@dataclass(frozen=True)
+class RenderedFeed:
+    body: bytes
+    etag: str
+    media_type: str
+
+    @classmethod
+    def create(cls, body: bytes, media_type: str) -> "RenderedFeed":
+        return cls(body=body, etag=f'"{hashlib.sha256(body).hexdigest()[:32]}"', media_type=media_type)
+
+    def matches(self, if_none_match: str | None) -> bool:
+        """check an If-None-Match header (a list of ETags or "*")"""
+        if not if_none_match:
+            return False
+        tags = {t.strip() for t in if_none_match.split(",")}
+        return "*" in tags or self.etag in tags
+
+
+def ics_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def ics_fold(line: str) -> bytes:
+    """split a content line into lines of at most 75 octets without splitting UTF-8 sequences"""
+    data = line.encode()
+    chunks: list[bytes] = []
+    limit = MAX_LINE_LENGTH
+    while len(data) > limit:
+        cut = limit
+        # don't cut in the middle of a multi byte character
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        chunks.append(data[:cut])
+        data = data[cut:]
+        # continuation lines start with a space
+        limit = MAX_LINE_LENGTH - 1
+    chunks.append(data)
+    return b"\r\n ".join(chunks) + b"\r\n"
+
+
+def ics_time(ts: int) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+
+
+def render_ics(items: list[FeedItem], generated: int) -> bytes:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        f"PRODID:{PRODUCT_ID}",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        "X-WR-CALNAME:VDR",
+    ]
+    for item in items:
+        summary = item.title if not item.short_text else f"{item.title} - {item.short_text}"
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{item.uid}",
+            f"DTSTAMP:{ics_time(generated)}",
+            f"DTSTART:{ics_time(item.recording.start)}",
+            f"DTEND:{ics_time(item.recording.stop)}",
+            f"SUMMARY:{ics_escape(summary)}",
+            f"LOCATION:{ics_escape(item.timer.channel_name)}",
+        ]
+        if item.description:
+            lines.append(f"DESCRIPTION:{ics_escape(item.description)}")
+        lines += ["TRANSP:TRANSPARENT", "END:VEVENT"]
+    lines.append("END:VCALENDAR")
+    return b"".join(ics_fold(line) for line in lines)
+
+
+def render_json(items: list[FeedItem], generated: int) -> bytes:
+    data = {
+        "generated": generated,
+        "items": [
+            {
+                "id": item.uid,
+                "timer_id": item.recording.timer_id,
+                "title": item.title,
+                "short_text": item.short_text,
+                "channel": item.timer.channel_name,
+                "channel_id": item.recording.channel_id,
+                "start": item.recording.start,
+                "stop": item.recording.stop,
+            }
+            for item in items
+        ],
+    }
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class TimerFeeds:
+    def __init__(self, timer_cache: TimerCache, days: int = 14) -> None:
+        self.timer_cache = timer_cache
+        self.days = days
+        self._key: tuple[int, datetime.date] | None = None
+        self._content: list[tuple] | None = None
+        self._feeds: dict[str, RenderedFeed] = {}
+
+    def items(self, now: datetime.datetime) -> list[FeedItem]:
+        until = now + datetime.timedelta(days=self.days)
+        details = self.timer_cache.details
+        return [
+            FeedItem(recording, details[recording.timer_id])
+            for recording in self.timer_cache.schedule.occurrences(now, until)
+            if recording.timer_id in details
+        ]
+
+    async def get(self, name: str) -> RenderedFeed:
+        """return the feed "ics" or "json", both are rendered again if the timers have changed"""
+        await self.timer_cache.ensure_loaded()
+        now = datetime.datetime.now().astimezone()
+        key = (self.timer_cache.version, now.date())
+        if key != self._key:
+            # the window starts at the beginning of the day, so the feeds stay the same during the day
+            day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            items = self.items(day_start)
+            # keep the ETags if the timers have been reloaded without changes
+            content = [item.content for item in items]
+            if content != self._content:
+                generated = int(now.timestamp())
+                self._feeds = {
+                    "ics": RenderedFeed.create(render_ics(items, generated), ICS_MEDIA_TYPE),
+                    "json": RenderedFeed.create(render_json(items, generated), JSON_MEDIA_TYPE),
+                }
+                self._content = content
+            self._key = key
+        return self._feeds[name]
+
+
+class FeedToken(BaseModel):
+    token: str
+
+
+class FeedTokens:
+    """the secret feed tokens of the users (username -> token)"""
+
+    def __init__(self, path: Path = FEED_TOKENS_FILE) -> None:
+        self.path = path
+        self.tokens: dict[str, str] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            self.tokens = json.loads(self.path.read_bytes())
+        except FileNotFoundError:
+            self.tokens = {}
+        except ValueError as err:
+            logging.error("could not read the feed tokens from %s: %s", self.path, err)
+            self.tokens = {}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        # the tokens are readable for the backend only
+        tmp.touch(mode=0o600)
+        tmp.write_text(json.dumps(self.tokens, indent=2))
+        tmp.replace(self.path)
+
+    def token(self, username: str, renew: bool = False) -> str:
+        """the token of the user, a new token is created if there is none yet or renew is set"""
+        if renew or username not in self.tokens:
+            self.tokens[username] = secrets.token_urlsafe(32)
+            self.save()
+        return self.tokens[username]
+
+    def user(self, token: str) -> str | None:
+        """the user a token belongs to, all tokens are compared in constant time"""
+        found = None
+        for username, user_token in self.tokens.items():
+            if hmac.compare_digest(token.encode(), user_token.encode()):
+                found = username
+        return found
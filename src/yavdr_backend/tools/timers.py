@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+Helpers for VDR's timers.
+
+Besides single shot timers (the day is an ISO date) VDR knows repeating timers with a
+weekday mask like "M-W-F--" (optionally starting at a given day: "MTWTF--@2025-01-01").
+Old timers may use a day of the month, like VDR this is a single shot timer on the next
+day with this number. The `TimerSchedule` expands all of them into
+lazily generated streams of concrete recordings (occurrences).
+"""
+import contextlib
+import datetime
+import heapq
+import itertools
+from collections.abc import Iterable, Iterator
+from enum import IntFlag
+from typing import NamedTuple
+
+import sdbus
+from pydantic import BaseModel, Field
+
+from yavdr_backend.interfaces.vdr_timers import DeTvdrVdrTimerInterface, DetailedTimer
+
+TIMER_ACTIVE = 1  # tfActive
+# number of upcoming occurrences which are kept for each timer
+LOOKAHEAD = 8
+
+
+class PlannedRecording(NamedTuple):
+    timer_id: int
+    channel_id: str
+    start: int
+    stop: int
+    priority: int
+
+
+class TimerStatus(IntFlag):
+    INACTIVE = 0
+    PENDING = 1
+    INSTANT_REC = 2
+    VPS = 4
+    IS_RECORDING = 8
+
+
+class TimerData(BaseModel):
+    active: int = Field(default=TimerStatus.PENDING)
+    channel_id: str | int
+    dt_start: datetime.datetime
+    dt_end: datetime.datetime
+    title: str
+    prio: int = Field(default=50)
+    lifetime: int = Field(default=99)
+    aux: str = Field(default="")
+
+    def local_start(self) -> datetime.datetime:
+        """the start in local time as an aware datetime, naive datetimes are local time already"""
+        return self.dt_start.astimezone()
+
+    def local_end(self) -> datetime.datetime:
+        return self.dt_end.astimezone()
+
+    def timer_string(self) -> str:
+        """the timer in the format used by NEWT and MODT ("flags:channel:day:start:stop:priority:lifetime:file:aux")"""
+        start, end = self.local_start(), self.local_end()
+        # VDR uses "|" for colons in the file name, line breaks would end the command
+        title = self.title.replace(":", "|").replace("\n", " ")
+        aux = self.aux.replace("\n", " ")
+        return (
+            f"{self.active}:{self.channel_id}:{start.strftime('%Y-%m-%d')}:{start.strftime('%H%M')}:"
+            f"{end.strftime('%H%M')}:{self.prio}:{self.lifetime}:{title}:{aux}"
+        )
+
+
+class TimerDays(NamedTuple):
+    date: datetime.date | None = None
+    # Monday ... Sunday
+    weekdays: tuple[bool, ...] | None = None
+    first_day: datetime.date | None = None
+
+    @property
+    def is_repeating(self) -> bool:
+        return self.date is None
+
+
+def split_hhmm(value: int) -> tuple[int, int]:
+    """split VDR's hhmm time values into hours and minutes"""
+    return value // 100, value % 100
+
+
+def format_time_span(start: int, stop: int) -> str:
+    start_h, start_m = split_hhmm(start)
+    stop_h, stop_m = split_hhmm(stop)
+    return f"{start_h:02d}:{start_m:02d} - {stop_h:02d}:{stop_m:02d}"
+
+
+def next_day_of_month(day: int, today: datetime.date) -> datetime.date:
+    """the next date with the given day of the month (today included)"""
+    year, month = today.year, today.month
+    while True:
+        with contextlib.suppress(ValueError):  # e.g. the 31st of a short month
+            if (date := datetime.date(year, month, day)) >= today:
+                return date
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def parse_day(day_weekdays: str, today: datetime.date | None = None) -> TimerDays:
+    """parse the day field of a VDR timer, raises a ValueError for invalid values"""
+    days, _, first_day = day_weekdays.partition("@")
+    if len(days) == 7 and not days.isdigit():
+        weekdays = tuple(c != "-" for c in days)
+        if not any(weekdays):
+            raise ValueError(f"no weekday is set in {day_weekdays!r}")
+        return TimerDays(
+            weekdays=weekdays,
+            first_day=datetime.date.fromisoformat(first_day) if first_day else None,
+        )
+    if days.isdigit() and 1 <= int(days) <= 31:
+        return TimerDays(date=next_day_of_month(int(days), today or datetime.date.today()))
+    return TimerDays(date=datetime.date.fromisoformat(days))
+
+
+def local_datetime(day: datetime.date, t: datetime.time) -> datetime.datetime:
+    """combine day and local time, the result has the utc offset valid on that day"""
+    return datetime.datetime.combine(day, t).astimezone()
+
+
+def timer_interval(day: str, start: int, stop: int) -> tuple[datetime.datetime, datetime.datetime]:
+    """
+    calculate start and end of a single shot timer, raises a ValueError for repeating timers
+    """
+    days = parse_day(day)
+    if days.date is None:
+        raise ValueError(f"{day!r} is a repeating timer")
+    return recording_interval(days.date, start, stop)
+
+
+def recording_interval(day: datetime.date, start: int, stop: int) -> tuple[datetime.datetime, datetime.datetime]:
+    t_start = datetime.time(*split_hhmm(start))
+    t_stop = datetime.time(*split_hhmm(stop))
+
+    # check if the end point in hours is smaller than the start point - in this case we have a day change
+    day_stop = day + datetime.timedelta(days=1) if t_stop < t_start else day
+    return local_datetime(day, t_start), local_datetime(day_stop, t_stop)
+
+
+def _candidate_days(days: TimerDays, first: datetime.date) -> Iterator[datetime.date]:
+    if days.date is not None:
+        yield days.date
+    elif days.weekdays is not None:
+        day = max(first, days.first_day) if days.first_day else first
+        while True:
+            if days.weekdays[day.weekday()]:
+                yield day
+            day += datetime.timedelta(days=1)
+
+
+def iter_occurrences(
+    timer: DetailedTimer, after: datetime.datetime, until: datetime.datetime | None = None
+) -> Iterator[PlannedRecording]:
+    """
+    generate the recordings of a timer which end after `after` (and start before `until`),
+    sorted by their start time - for repeating timers without `until` this never ends
+    """
+    days = parse_day(timer.day_weekdays)
+    # a recording which started the day before might still be running
+    first = (after - datetime.timedelta(days=1)).date()
+    for day in _candidate_days(days, first):
+        start, stop = recording_interval(day, timer.start, timer.stop)
+        if until is not None and start >= until:
+            return
+        if stop <= after:
+            continue
+        yield PlannedRecording(
+            timer_id=timer.id,
+            channel_id=timer.channel_id,
+            start=int(start.timestamp()),
+            stop=int(stop.timestamp()),
+            priority=timer.priority,
+        )
+
+
+class TimerSchedule:
+    """
+    Timers and their upcoming occurrences. The next occurrences of each timer are calculated
+    once when the timer is added or changed, longer time spans are generated on demand.
+    """
+
+    def __init__(self, timers: Iterable[DetailedTimer] = (), lookahead: int = LOOKAHEAD) -> None:
+        self.lookahead = lookahead
+        self.timers: dict[int, DetailedTimer] = {}
+        self._next: dict[int, list[PlannedRecording]] = {}
+        self.update(timers)
+
+    def update(self, timers: Iterable[DetailedTimer]) -> set[int]:
+        """replace all timers, returns the ids of the timers which have been added, changed or removed"""
+        timers = {t.id: t for t in timers}
+        changed = {timer_id for timer_id in self.timers if timer_id not in timers}
+        for timer_id in changed:
+            self.remove(timer_id)
+        for timer in timers.values():
+            if self.set(timer):
+                changed.add(timer.id)
+        return changed
+
+    def set(self, timer: DetailedTimer) -> bool:
+        """add or update a timer, returns False if the timer is unchanged"""
+        if self.timers.get(timer.id) == timer:
+            return False
+        self.timers[timer.id] = timer
+        self._next[timer.id] = self._calculate_next(timer, datetime.datetime.now().astimezone())
+        return True
+
+    def remove(self, timer_id: int) -> None:
+        self.timers.pop(timer_id, None)
+        self._next.pop(timer_id, None)
+
+    def is_repeating(self, timer_id: int) -> bool:
+        try:
+            return parse_day(self.timers[timer_id].day_weekdays).is_repeating
+        except ValueError:
+            return False
+
+    def is_active(self, timer_id: int) -> bool:
+        return bool(self.timers[timer_id].flags & TIMER_ACTIVE)
+
+    def next_occurrences(self, timer_id: int, now: datetime.datetime | None = None) -> list[PlannedRecording]:
+        now = now or datetime.datetime.now().astimezone()
+        ts = now.timestamp()
+        upcoming = self._next.get(timer_id)
+        if upcoming is not None:
+            # drop recordings which have ended in the meantime
+            while upcoming and upcoming[0].stop <= ts:
+                upcoming.pop(0)
+            if upcoming and (len(upcoming) > self.lookahead // 2 or not self.is_repeating(timer_id)):
+                return upcoming
+        upcoming = self._next[timer_id] = self._calculate_next(self.timers[timer_id], now)
+        return upcoming
+
+    def _calculate_next(self, timer: DetailedTimer, now: datetime.datetime) -> list[PlannedRecording]:
+        try:
+            return list(itertools.islice(iter_occurrences(timer, now), self.lookahead))
+        except ValueError:
+            return []
+
+    def next_occurrence(self, timer_id: int, now: datetime.datetime | None = None) -> PlannedRecording | None:
+        upcoming = self.next_occurrences(timer_id, now)
+        return upcoming[0] if upcoming else None
+
+    def occurrences(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime | None = None,
+        active_only: bool = True,
+        after_timer_id: int | None = None,
+    ) -> Iterator[PlannedRecording]:
+        """
+        all occurrences of all timers between start and end, sorted by their start time and timer id.
+        With `after_timer_id` only the occurrences after the one of this timer starting at `start`
+        are returned, so the last entry of a page continues the next one.
+        """
+        generators: list[Iterator[PlannedRecording]] = []
+        for timer_id, timer in self.timers.items():
+            if active_only and not self.is_active(timer_id):
+                continue
+            try:
+                parse_day(timer.day_weekdays)
+            except ValueError:
+                continue
+            generators.append(iter_occurrences(timer, start, end))
+        merged = heapq.merge(*generators, key=lambda o: (o.start, o.timer_id))
+        if after_timer_id is None:
+            return merged
+        cursor = (int(start.timestamp()), after_timer_id)
+        return (o for o in merged if (o.start, o.timer_id) > cursor)
+
+
+async def list_detailed_timers() -> list[DetailedTimer]:
+    with contextlib.closing(sdbus.sd_bus_open_system()) as bus:
+        vdr_timers = DeTvdrVdrTimerInterface.new_proxy("de.tvdr.vdr", "/Timers", bus=bus)
+        return [DetailedTimer(*timer) for timer in await vdr_timers.list_detailed()]
+
+
+def planned_recordings(schedule: TimerSchedule, now: float, until: float) -> list[PlannedRecording]:
+    """return the recordings of active timers which have not ended yet and start before `until`"""
+    return list(
+        schedule.occurrences(
+            datetime.datetime.fromtimestamp(now).astimezone(),
+            datetime.datetime.fromtimestamp(until).astimezone(),
+        )
+    )
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Reader for the binary ``index`` file VDR writes for each recording.
+
+Each frame of a recording has one 8 byte entry in the index file. For TS
+recordings (VDR >= 1.7) an entry is the little endian bit field
+
+    offset:40 | reserved:7 | independent:1 | file number:16
+
+PES recordings (``001.vdr`` ...) use ``offset:32 | type:8 | number:8 | reserved:16``
+with type 1 marking an I-frame. The frame number is the position of the entry in the
+file, so converting a time into a byte position is a simple multiplication followed
+by a short walk back to the previous independent frame.
+"""
+import contextlib
+import mmap
+import os
+import struct
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+INDEX_FILENAME = "index"
+INFO_FILENAME = "info"
+DEFAULT_FRAMES_PER_SECOND = 25.0
+
+INDEX_ENTRY = struct.Struct("<Q")
+PES_I_FRAME = 1
+
+
+class IndexEntry(NamedTuple):
+    file_number: int
+    offset: int
+    independent: bool
+
+
+class SeekPosition(NamedTuple):
+    frame: int
+    seconds: float
+    file_number: int
+    offset: int
+
+
+def read_frames_per_second(recording_dir: Path) -> float:
+    """read the frame rate from the "F" line of the recording's info file"""
+    try:
+        with open(recording_dir / INFO_FILENAME, encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line.startswith("F "):
+                    return float(line[2:].strip())
+    except (OSError, ValueError):
+        pass
+    return DEFAULT_FRAMES_PER_SECOND
+
+
+class VdrIndex:
+    """
+    Memory mapped view of a recording's index file.
+
+    The mapping covers the file as it was when it was opened - use `open_index()`
+    to get an instance that follows recordings which are still growing.
+    """
+
+    def __init__(
+        self,
+        recording_dir: Path | str,
+        frames_per_second: float | None = None,
+        is_pes_recording: bool | None = None,
+    ) -> None:
+        self.recording_dir = Path(recording_dir)
+        if is_pes_recording is None:
+            is_pes_recording = (self.recording_dir / "001.vdr").exists()
+        self.is_pes_recording = is_pes_recording
+        self.frames_per_second = frames_per_second or read_frames_per_second(self.recording_dir)
+        self._mmap: mmap.mmap | None = None
+        with open(self.recording_dir / INDEX_FILENAME, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.size = stat.st_size
+            self.mtime = stat.st_mtime
+            if self.size >= INDEX_ENTRY.size:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # ignore a partially written entry at the end of the file
+        self.num_frames = self.size // INDEX_ENTRY.size
+        # users of an index from `open_index()`, it is only closed if nobody uses it anymore
+        self.users = 0
+        self._retired = False
+
+    def close(self) -> None:
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def __enter__(self) -> "VdrIndex":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_frames
+
+    def _decode(self, raw: int) -> IndexEntry:
+        if self.is_pes_recording:
+            return IndexEntry(
+                file_number=(raw >> 40) & 0xFF,
+                offset=raw & 0xFFFFFFFF,
+                independent=((raw >> 32) & 0xFF) == PES_I_FRAME,
+            )
+        return IndexEntry(
+            file_number=raw >> 48,
+            offset=raw & 0xFFFFFFFFFF,
+            independent=bool((raw >> 47) & 1),
+        )
+
+    def __getitem__(self, frame: int) -> IndexEntry:
+        if frame < 0:
+            frame += self.num_frames
+        if not 0 <= frame < self.num_frames or self._mmap is None:
+            raise IndexError(f"frame {frame} is out of range (0 - {self.num_frames - 1})")
+        (raw,) = INDEX_ENTRY.unpack_from(self._mmap, frame * INDEX_ENTRY.size)
+        return self._decode(raw)
+
+    def __iter__(self) -> Iterator[IndexEntry]:
+        return self.entries()
+
+    def entries(self, start: int = 0) -> Iterator[IndexEntry]:
+        """the entries from the given frame on"""
+        if self._mmap is None:
+            return
+        view = memoryview(self._mmap)[start * INDEX_ENTRY.size : self.num_frames * INDEX_ENTRY.size]
+        try:
+            for (raw,) in INDEX_ENTRY.iter_unpack(view):
+                yield self._decode(raw)
+        finally:
+            view.release()
+
+    @property
+    def length_in_seconds(self) -> float:
+        return self.num_frames / self.frames_per_second
+
+    def file_path(self, file_number: int) -> Path:
+        if self.is_pes_recording:
+            return self.recording_dir / f"{file_number:03d}.vdr"
+        return self.recording_dir / f"{file_number:05d}.ts"
+
+    def frame_at(self, seconds: float) -> int:
+        """return the number of the frame shown at the given time"""
+        if not self.num_frames:
+            raise IndexError("the index is empty")
+        frame = int(max(seconds, 0) * self.frames_per_second)
+        return min(frame, self.num_frames - 1)
+
+    def independent_frame_before(self, frame: int) -> int:
+        """return the closest independent frame at or before the given frame"""
+        for f in range(frame, -1, -1):
+            if self[f].independent:
+                return f
+        return 0
+
+    def independent_frame_after(self, frame: int) -> int | None:
+        """return the next independent frame after the given frame"""
+        for f in range(frame + 1, self.num_frames):
+            if self[f].independent:
+                return f
+        return None
+
+    def independent_frames(self, start: int = 0) -> Iterator[tuple[int, IndexEntry]]:
+        for frame, entry in enumerate(self.entries(start), start):
+            if entry.independent:
+                yield frame, entry
+
+    def seek(self, seconds: float) -> SeekPosition:
+        """
+        map a point in time to the independent frame a player has to start from
+        """
+        frame = self.independent_frame_before(self.frame_at(seconds))
+        entry = self[frame]
+        return SeekPosition(
+            frame=frame,
+            seconds=frame / self.frames_per_second,
+            file_number=entry.file_number,
+            offset=entry.offset,
+        )
+
+    def frame_at_position(self, file_number: int, offset: int) -> int:
+        """
+        binary search for the frame containing the given byte position,
+        e.g. to convert a resume position of a player back into a time
+        """
+        position = (file_number, offset)
+        lo, hi = 0, self.num_frames
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = self[mid]
+            if (entry.file_number, entry.offset) <= position:
+                lo = mid + 1
+            else:
+                hi = mid
+        return max(lo - 1, 0)
+
+
+# every mapping keeps a file descriptor open, so only the most recently used indexes are kept
+INDEX_CACHE_SIZE = 32
+_index_cache: dict[Path, VdrIndex] = {}
+
+
+def _retire(index: VdrIndex) -> None:
+    """the index has been removed from the cache, it is closed as soon as nobody uses it"""
+    index._retired = True
+    if not index.users:
+        index.close()
+
+
+@contextlib.contextmanager
+def open_index(
+    recording_dir: Path | str,
+    frames_per_second: float | None = None,
+    is_pes_recording: bool | None = None,
+) -> Iterator[VdrIndex]:
+    """
+    use a cached VdrIndex for the recording, the index is mapped again if the file has
+    been changed since it was opened. An index which is replaced or removed from the
+    cache stays open until the last user (e.g. a thread reading it) has left the block.
+    """
+    recording_dir = Path(recording_dir)
+    index = _index_cache.pop(recording_dir, None)
+    if index is not None:
+        try:
+            stat = os.stat(recording_dir / INDEX_FILENAME)
+        except OSError:
+            _retire(index)
+            raise
+        if stat.st_size != index.size or stat.st_mtime != index.mtime:
+            _retire(index)
+            index = None
+    if index is None:
+        index = VdrIndex(recording_dir, frames_per_second, is_pes_recording)
+    _index_cache[recording_dir] = index
+    while len(_index_cache) > INDEX_CACHE_SIZE:
+        _retire(_index_cache.pop(next(iter(_index_cache))))
+    index.users += 1
+    try:
+        yield index
+    finally:
+        index.users -= 1
+        if index._retired and not index.users:
+            index.close()